@@ -0,0 +1,293 @@
+"""Opt-in benchmarks for the archive handlers.
+
+They are skipped unless the ``JA_BENCHMARK`` environment variable is set::
+
+    JA_BENCHMARK=1 JA_BENCHMARK_SIZE_MB=4096 JA_BENCHMARK_FILES=200000 python -m pytest benchmarks
+
+The results are also written as JSON to ``JA_BENCHMARK_OUTPUT`` if set, and
+``JA_PROFILE_DIR`` profiles the archiving and the extraction of each request.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+BENCHMARK_SIZE_MB = int(os.environ.get("JA_BENCHMARK_SIZE_MB", 512))
+FILE_SIZE_MB = 64
+BENCHMARK_FILES = int(os.environ.get("JA_BENCHMARK_FILES", 200000))
+FILES_PER_DIRECTORY = 100
+# Interval in seconds between two samples of the memory used by the process
+RSS_INTERVAL = 0.01
+
+_results = []
+_file_results = []
+
+
+def _rss():
+    # Memory used by the process now on Linux, otherwise its peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = _rss()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, _rss())
+
+
+@contextmanager
+def measure():
+    """Measure the wall time, the CPU time and the peak RSS of the process during the block.
+
+    The server and the client run in the benchmark process: the CPU time
+    includes the client side, e.g. the parsing of the response.
+    """
+    metrics = {}
+    sampler = _RssSampler()
+    sampler.start()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics["duration"] = time.perf_counter() - start
+        metrics["cpu"] = time.process_time() - cpu
+        sampler.stop()
+        metrics["peak_rss"] = sampler.peak
+
+
+def _text(size, rng):
+    # Compressible text-like content
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(1000)]
+    text = b" ".join(rng.choices(words, k=size // 4))
+    return (text * (size // len(text) + 1))[:size]
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("JA_BENCHMARK"):
+        return
+    skip = pytest.mark.skip(reason="Set JA_BENCHMARK=1 to run the benchmarks")
+    for item in items:
+        if "benchmarks" in item.nodeid.split("/")[0]:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _results and not _file_results:
+        return
+    terminalreporter.section("jupyter-archive benchmarks")
+    for result in _results:
+        size = result["size"] / 2**20
+        line = "{:<60} {:>8.1f} MB in {:>7.2f} s -> {:>8.1f} MB/s".format(
+            result["name"], size, result["duration"], size / result["duration"]
+        )
+        if result.get("ttfb") is not None:
+            line += " | first byte {:>7.1f} ms".format(result["ttfb"] * 1000)
+        if result.get("cpu") is not None:
+            line += " | CPU {:>6.1f} ms/MB".format(result["cpu"] * 1000 / size)
+        if result.get("peak_rss") is not None:
+            line += " | peak RSS {:>7.1f} MB".format(result["peak_rss"] / 2**20)
+        terminalreporter.write_line(line)
+    for name, files, duration in _file_results:
+        terminalreporter.write_line(
+            "{:<60} {:>8d} files in {:>7.2f} s -> {:>8.0f} files/s".format(name, files, duration, files / duration)
+        )
+
+
+def pytest_sessionfinish(session):
+    output = os.environ.get("JA_BENCHMARK_OUTPUT")
+    if not output or not (_results or _file_results):
+        return
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "python": sys.version,
+                "platform": platform.platform(),
+                "size_mb": BENCHMARK_SIZE_MB,
+                "throughput": _results,
+                "file_rate": [
+                    {"name": name, "files": files, "duration": duration} for name, files, duration in _file_results
+                ],
+            },
+            f,
+            indent=1,
+        )
+
+
+@pytest.fixture
+def record_throughput(request):
+    """Record the throughput of ``size`` bytes processed, with the metrics of :func:`measure`."""
+
+    def record(size, duration, ttfb=None, cpu=None, peak_rss=None, archive_size=None):
+        _results.append(
+            {
+                "name": request.node.name,
+                "size": size,
+                "duration": duration,
+                "ttfb": ttfb,
+                "cpu": cpu,
+                "peak_rss": peak_rss,
+                "archive_size": archive_size,
+            }
+        )
+
+    return record
+
+
+@pytest.fixture
+def record_file_rate(request):
+    def record(files, duration):
+        _file_results.append((request.node.name, files, duration))
+
+    return record
+
+
+@pytest.fixture(scope="session")
+def large_tree(tmp_path_factory):
+    """A directory of ``JA_BENCHMARK_SIZE_MB`` MB made of half random, half repetitive files."""
+    root = tmp_path_factory.mktemp("benchmark") / "large-tree"
+    root.mkdir()
+    chunk = random.Random(0).randbytes(2**20)
+    n_files = max(1, BENCHMARK_SIZE_MB // FILE_SIZE_MB)
+    size = min(BENCHMARK_SIZE_MB, FILE_SIZE_MB)
+    for index in range(n_files):
+        with open(root / "file-{}.bin".format(index), "wb") as f:
+            for block in range(size):
+                f.write(chunk if index % 2 else chunk[:1024] * 1024)
+    return root
+
+
+@pytest.fixture(scope="session")
+def many_files_tree(tmp_path_factory):
+    """A directory of ``JA_BENCHMARK_FILES`` small files, ``FILES_PER_DIRECTORY`` per directory."""
+    root = tmp_path_factory.mktemp("benchmark") / "many-files-tree"
+    for index in range(BENCHMARK_FILES):
+        directory = root / "dir-{}".format(index // FILES_PER_DIRECTORY // FILES_PER_DIRECTORY) / "sub-{}".format(
+            index // FILES_PER_DIRECTORY % FILES_PER_DIRECTORY
+        )
+        if index % FILES_PER_DIRECTORY == 0:
+            directory.mkdir(parents=True)
+        with open(directory / "file-{}.txt".format(index), "wb") as f:
+            f.write(b"x" * (index % 1024))
+    return root
+
+
+@pytest.fixture(scope="session")
+def mixed_tree(tmp_path_factory):
+    """A directory of ``JA_BENCHMARK_SIZE_MB`` MB: half in a few large files, half in small files.
+
+    The content is reproducible, a mix of random and text-like data.
+    """
+    root = tmp_path_factory.mktemp("benchmark") / "mixed-tree"
+    root.mkdir()
+    rng = random.Random(0)
+    random_pool = rng.randbytes(2**20)
+    text_pool = _text(2**20, rng)
+    large_size = BENCHMARK_SIZE_MB // 2
+    for index in range(max(1, large_size // FILE_SIZE_MB)):
+        with open(root / "large-{}.bin".format(index), "wb") as f:
+            for _ in range(min(large_size, FILE_SIZE_MB)):
+                f.write(random_pool if index % 2 else text_pool)
+    remaining = BENCHMARK_SIZE_MB * 2**20 - large_size * 2**20
+    index = 0
+    while remaining > 0:
+        directory = root / "small-{}".format(index // FILES_PER_DIRECTORY)
+        if index % FILES_PER_DIRECTORY == 0:
+            directory.mkdir()
+        size = min(remaining, rng.randint(1, 64) * 1024)
+        pool = random_pool if rng.random() < 0.3 else text_pool
+        offset = rng.randrange(len(pool) - size + 1)
+        (directory / "file-{}.txt".format(index)).write_bytes(pool[offset:offset + size])
+        remaining -= size
+        index += 1
+    return root
+
+
+@pytest.fixture(scope="session")
+def archives(tmp_path_factory):
+    """Make an archive of a tree once per format; return its path."""
+    directory = tmp_path_factory.mktemp("benchmark-archives")
+    formats = {"zip": "zip", "tar.gz": "gztar", "tar.bz2": "bztar", "tar.xz": "xztar"}
+    made = {}
+
+    def make(tree, format):
+        if (tree, format) not in made:
+            base_name = directory / "{}-{}".format(tree.name, format.replace(".", "-")) / tree.name
+            made[tree, format] = shutil.make_archive(base_name, formats[format], tree.parent, tree.name)
+        return made[tree, format]
+
+    return make
+
+
+@pytest.fixture
+def download(jp_fetch, http_server_client):
+    """Download an archive without buffering it; return its metrics for ``record_throughput``.
+
+    They are the metrics of :func:`measure`, the archive size and the
+    latency to the first byte.
+    """
+    http_server_client.max_body_size = 2**50
+
+    async def fetch(path, **params):
+        received = 0
+        first_byte = None
+
+        def count(chunk):
+            nonlocal received, first_byte
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            received += len(chunk)
+
+        params.setdefault("archiveToken", 564646)
+        with measure() as metrics:
+            start = time.perf_counter()
+            r = await jp_fetch(
+                "directories", path, params=params, method="GET", streaming_callback=count, request_timeout=3600
+            )
+        assert r.code == 200
+        metrics["archive_size"] = received
+        metrics["ttfb"] = first_byte - start if first_byte is not None else None
+        return metrics
+
+    return fetch
+
+
+@pytest.fixture
+def extract(jp_fetch):
+    """Extract an archive of the server root; return the metrics of :func:`measure`."""
+
+    async def fetch(path):
+        with measure() as metrics:
+            r = await jp_fetch("extract-archive", path, method="GET", request_timeout=3600)
+        assert r.code == 200
+        return metrics
+
+    return fetch
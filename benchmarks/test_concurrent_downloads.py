@@ -0,0 +1,31 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+CONCURRENCY = int(os.environ.get("JA_BENCHMARK_CONCURRENCY", 30))
+
+
+@pytest.mark.parametrize("concurrency", sorted({1, CONCURRENCY}))
+@pytest.mark.parametrize("format, level", [("zip", 0), ("tar.gz", 1)])
+async def test_concurrent_downloads(
+    jp_root_dir, jp_serverapp, large_tree, download, record_throughput, format, level, concurrency
+):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    # Archive all the downloads at once
+    config.max_download_jobs = concurrency
+    config.max_jobs = 0
+    (jp_root_dir / large_tree.name).symlink_to(large_tree, target_is_directory=True)
+    size = sum(f.stat().st_size for f in large_tree.iterdir())
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            download(large_tree.name, archiveFormat=format, compressionLevel=level, archiveToken=index)
+            for index in range(concurrency)
+        )
+    )
+
+    # Aggregate throughput of the files archived
+    record_throughput(size * concurrency, time.perf_counter() - start)
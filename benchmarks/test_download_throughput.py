@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from jupyter_archive.tarstream import is_available
+
+# The optional formats are skipped if their compression library is not installed
+FORMATS = [
+    "zip",
+    "tar.gz",
+    pytest.param("tar.zst", marks=pytest.mark.skipif(not is_available("zst"), reason="zstd is not installed")),
+    pytest.param("tar.lz4", marks=pytest.mark.skipif(not is_available("lz4"), reason="lz4 is not installed")),
+]
+
+SETTINGS = {
+    "default": {},
+    "small-chunks": {"handler_max_buffer_length": 64},
+    "small-buffer": {"stream_max_buffer_size": 8 * 1024 * 1024},
+    "short-flush-delay": {"archive_download_flush_delay": 10},
+}
+
+
+@pytest.mark.parametrize("settings", list(SETTINGS))
+@pytest.mark.parametrize("tree", ["large_tree", "mixed_tree"])
+@pytest.mark.parametrize("format", FORMATS)
+async def test_download_throughput(
+    request, jp_root_dir, jp_serverapp, download, record_throughput, format, tree, settings
+):
+    tree = request.getfixturevalue(tree)
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    for name, value in SETTINGS[settings].items():
+        setattr(config, name, value)
+    (jp_root_dir / tree.name).symlink_to(tree, target_is_directory=True)
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tree) for name in names)
+
+    metrics = await download(tree.name, archiveFormat=format)
+
+    record_throughput(size, **metrics)
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("format", ["zip", "tar.gz", "tar.xz"])
+async def test_extract_throughput(jp_root_dir, jp_serverapp, mixed_tree, archives, extract, record_throughput, format, workers):
+    jp_serverapp.web_app.settings["jupyter_archive"].extraction_workers = workers
+    archive_path = archives(mixed_tree, format)
+    name = os.path.basename(archive_path)
+    (jp_root_dir / name).symlink_to(archive_path)
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(mixed_tree) for name in names)
+
+    metrics = await extract(name)
+
+    record_throughput(size, archive_size=os.path.getsize(archive_path), **metrics)
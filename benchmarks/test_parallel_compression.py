@@ -0,0 +1,25 @@
+import pytest
+
+from jupyter_archive.tarstream import is_available
+
+# The optional formats are skipped if their compression library is not installed
+FORMATS = [
+    "zip",
+    "tar.gz",
+    "tar.bz2",
+    "tar.xz",
+    pytest.param("tar.zst", marks=pytest.mark.skipif(not is_available("zst"), reason="zstd is not installed")),
+    pytest.param("tar.lz4", marks=pytest.mark.skipif(not is_available("lz4"), reason="lz4 is not installed")),
+]
+
+
+@pytest.mark.parametrize("workers", [1, 4, 16])
+@pytest.mark.parametrize("format", FORMATS)
+async def test_parallel_compression(jp_root_dir, jp_serverapp, large_tree, download, record_throughput, format, workers):
+    jp_serverapp.web_app.settings["jupyter_archive"].compression_workers = workers
+    (jp_root_dir / large_tree.name).symlink_to(large_tree, target_is_directory=True)
+    size = sum(f.stat().st_size for f in large_tree.iterdir())
+
+    metrics = await download(large_tree.name, archiveFormat=format)
+
+    record_throughput(size, **metrics)
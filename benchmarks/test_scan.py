@@ -0,0 +1,51 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive.scanner import scan_files
+
+
+def walk_and_stat(archive_path):
+    # The listing before os.scandir: a sorted os.walk, then a stat per file
+    # to fingerprint it and another one to build its archive member.
+    files = []
+    for root, dirs, names in os.walk(archive_path):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            os.stat(path)
+            os.stat(path)
+            files.append(path)
+    return files
+
+
+def test_scan_walk(many_files_tree, record_file_rate):
+    start = time.perf_counter()
+    files = walk_and_stat(many_files_tree)
+    record_file_rate(len(files), time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("prefetch", [0, 8])
+def test_scan_files(many_files_tree, record_file_rate, prefetch):
+    executor = ThreadPoolExecutor(prefetch) if prefetch else None
+    start = time.perf_counter()
+    files = scan_files(many_files_tree, executor=executor, prefetch=prefetch)
+    record_file_rate(len(files), time.perf_counter() - start)
+    if executor is not None:
+        executor.shutdown()
+
+
+@pytest.mark.parametrize("read_ahead_workers", [0, 4])
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+async def test_download_many_files(
+    jp_root_dir, jp_serverapp, many_files_tree, download, record_file_rate, format, read_ahead_workers
+):
+    jp_serverapp.web_app.settings["jupyter_archive"].read_ahead_workers = read_ahead_workers
+    (jp_root_dir / many_files_tree.name).symlink_to(many_files_tree, target_is_directory=True)
+    n_files = sum(len(names) for _, _, names in os.walk(many_files_tree))
+
+    metrics = await download(many_files_tree.name, archiveFormat=format, compressionLevel=0)
+
+    record_file_rate(n_files, metrics["duration"])
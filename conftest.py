@@ -1,4 +1,5 @@
 import pytest
+from jupyter_server.auth import User
 
 pytest_plugins = ("pytest_jupyter.jupyter_server", )
 
@@ -6,3 +7,11 @@ pytest_plugins = ("pytest_jupyter.jupyter_server", )
 @pytest.fixture
 def jp_server_config(jp_server_config):
     return {"ServerApp": {"jpserver_extensions": {"jupyter_archive": True}}}
+
+
+@pytest.fixture
+def jp_serverapp(jp_serverapp, monkeypatch):
+    # The requests authenticated by the token are from one user, as with the login cookie
+    user = User("tester")
+    monkeypatch.setattr(jp_serverapp.identity_provider, "generate_anonymous_user", lambda handler: user)
+    return jp_serverapp
@@ -1,7 +1,10 @@
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from jupyter_core.paths import jupyter_runtime_dir
 from traitlets.config import Configurable
-from traitlets import Int, default
+from traitlets import Bool, Enum, Int, Unicode, default
 
 try:
     from ._version import __version__
@@ -12,6 +15,8 @@ except ImportError:
     import warnings
     warnings.warn("Importing 'jupyter-archive' outside a proper installation.")
     __version__ = "dev"
+from .cache import ArchiveCache
+from .jobs import JobRegistry
 from .handlers import setup_handlers
 
 
@@ -37,7 +42,7 @@ class JupyterArchive(Configurable):
         # 100 * 1024 * 1024 equals to 100M
         return int(os.environ.get("JA_IOSTREAM_MAX_BUFFER_SIZE", 100 * 1024 * 1024))
 
-    handler_max_buffer_length = Int(help="The max length of chunks in tornado RequestHandler",
+    handler_max_buffer_length = Int(help="The max length of chunks in tornado RequestHandler; a download holds at most this many 8 KiB chunks not sent yet",
                                     config=True)
 
     @default("handler_max_buffer_length")
@@ -45,13 +50,300 @@ class JupyterArchive(Configurable):
         # if 8K for one chunk, 10240 * 8K equals to 80M
         return int(os.environ.get("JA_HANDLER_MAX_BUFFER_LENGTH", 10240))
 
-    archive_download_flush_delay = Int(help="The delay in ms at which we send the chunk of data to the client.",
+    archive_download_flush_delay = Int(help="The delay in ms before trying again to send data to the client when the IOStream buffer is full.",
                                        config=True)
 
     @default("archive_download_flush_delay")
     def _default_archive_download_flush_delay(self):
         return int(os.environ.get("JA_ARCHIVE_DOWNLOAD_FLUSH_DELAY", 100))
 
+    compression_workers = Int(help="The number of workers compressing archive blocks in parallel; with 1 the compression runs in the archiving thread.",
+                              config=True)
+
+    @default("compression_workers")
+    def _default_compression_workers(self):
+        return int(os.environ.get("JA_COMPRESSION_WORKERS", 1))
+
+    compression_pool = Enum(["thread", "process"],
+                            help="The type of pool used by the compression workers.",
+                            config=True)
+
+    @default("compression_pool")
+    def _default_compression_pool(self):
+        return os.environ.get("JA_COMPRESSION_POOL", "thread")
+
+    compression_level = Int(help="The default compression level, from 0 (no compression) to 9; -1 uses the default level of each format.",
+                            min=-1, max=9, config=True)
+
+    @default("compression_level")
+    def _default_compression_level(self):
+        return int(os.environ.get("JA_COMPRESSION_LEVEL", -1))
+
+    adaptive_compression = Bool(help="Whether to store the files that look already compressed without compressing them again (zip only) by default.",
+                                config=True)
+
+    @default("adaptive_compression")
+    def _default_adaptive_compression(self):
+        return os.environ.get("JA_ADAPTIVE_COMPRESSION", "false").lower() == "true"
+
+    archive_cache_dir = Unicode(help="The directory caching the downloaded archives; the cache is disabled if empty.",
+                                config=True)
+
+    @default("archive_cache_dir")
+    def _default_archive_cache_dir(self):
+        return os.environ.get("JA_ARCHIVE_CACHE_DIR", "")
+
+    archive_cache_max_size = Int(help="The max size in bytes of the archive cache; the least recently used archives are removed beyond it.",
+                                 config=True)
+
+    @default("archive_cache_max_size")
+    def _default_archive_cache_max_size(self):
+        # 10 * 1024 * 1024 * 1024 equals to 10G
+        return int(os.environ.get("JA_ARCHIVE_CACHE_MAX_SIZE", 10 * 1024 * 1024 * 1024))
+
+    archive_index_dir = Unicode(help="The directory caching the indexes of the tar archives listed or partially extracted; they are not cached if empty.",
+                                config=True)
+
+    @default("archive_index_dir")
+    def _default_archive_index_dir(self):
+        return os.environ.get("JA_ARCHIVE_INDEX_DIR", os.path.join(jupyter_runtime_dir(), "jupyter-archive-index"))
+
+    archive_index_max_size = Int(help="The max size in bytes of the archive index cache; the least recently used indexes are removed beyond it.",
+                                 config=True)
+
+    @default("archive_index_max_size")
+    def _default_archive_index_max_size(self):
+        # 256 * 1024 * 1024 equals to 256M
+        return int(os.environ.get("JA_ARCHIVE_INDEX_MAX_SIZE", 256 * 1024 * 1024))
+
+    extraction_workers = Int(help="The number of workers extracting zip members in parallel; above 1, tar archives are also decompressed and written on separate threads.",
+                             config=True)
+
+    @default("extraction_workers")
+    def _default_extraction_workers(self):
+        return int(os.environ.get("JA_EXTRACTION_WORKERS", 1))
+
+    max_extraction_jobs = Int(help="The number of extractions running at the same time; the others wait in a queue.",
+                              config=True)
+
+    @default("max_extraction_jobs")
+    def _default_max_extraction_jobs(self):
+        return int(os.environ.get("JA_MAX_EXTRACTION_JOBS", 2))
+
+    max_extraction_size = Int(help="The max number of bytes extracted from an archive; the extraction fails beyond it (0 for no limit).",
+                              config=True)
+
+    @default("max_extraction_size")
+    def _default_max_extraction_size(self):
+        return int(os.environ.get("JA_MAX_EXTRACTION_SIZE", 0))
+
+    max_extraction_members = Int(help="The max number of members extracted from an archive; the extraction fails beyond it (0 for no limit).",
+                                 config=True)
+
+    @default("max_extraction_members")
+    def _default_max_extraction_members(self):
+        return int(os.environ.get("JA_MAX_EXTRACTION_MEMBERS", 0))
+
+    max_compression_ratio = Int(help="The max ratio between the extracted size and the archive size, beyond 64M extracted, to stop decompression bombs (0 for no limit).",
+                                config=True)
+
+    @default("max_compression_ratio")
+    def _default_max_compression_ratio(self):
+        return int(os.environ.get("JA_MAX_COMPRESSION_RATIO", 0))
+
+    max_download_jobs = Int(help="The number of downloads and compressions archived at the same time; the others wait in a queue.",
+                            config=True)
+
+    @default("max_download_jobs")
+    def _default_max_download_jobs(self):
+        return int(os.environ.get("JA_MAX_DOWNLOAD_JOBS", 4))
+
+    max_jobs = Int(help="The max number of downloads and extractions running or waiting; the requests beyond it are rejected with 503 (0 for no limit).",
+                   config=True)
+
+    @default("max_jobs")
+    def _default_max_jobs(self):
+        return int(os.environ.get("JA_MAX_JOBS", 32))
+
+    max_jobs_per_user = Int(help="The max number of downloads and extractions running or waiting for a user; the requests beyond it are rejected with 429 (0 for no limit).",
+                            config=True)
+
+    @default("max_jobs_per_user")
+    def _default_max_jobs_per_user(self):
+        return int(os.environ.get("JA_MAX_JOBS_PER_USER", 0))
+
+    retry_after = Int(help="The delay in seconds sent in the Retry-After header of the rejected requests.",
+                      config=True)
+
+    @default("retry_after")
+    def _default_retry_after(self):
+        return int(os.environ.get("JA_RETRY_AFTER", 10))
+
+    scan_prefetch = Int(help="The number of directories scanned ahead in parallel when listing the files to archive; 0 to scan them one at a time.",
+                        config=True)
+
+    @default("scan_prefetch")
+    def _default_scan_prefetch(self):
+        return int(os.environ.get("JA_SCAN_PREFETCH", 0))
+
+    read_ahead_workers = Int(help="The number of threads reading the files ahead of the archiving thread, e.g. on network file systems; 0 to read them in the archiving thread.",
+                             config=True)
+
+    @default("read_ahead_workers")
+    def _default_read_ahead_workers(self):
+        return int(os.environ.get("JA_READ_AHEAD_WORKERS", 2))
+
+    read_ahead_size = Int(help="The max number of bytes read ahead of the archiving thread for each download.",
+                          config=True)
+
+    @default("read_ahead_size")
+    def _default_read_ahead_size(self):
+        # 16 * 1024 * 1024 equals to 16M
+        return int(os.environ.get("JA_READ_AHEAD_SIZE", 16 * 1024 * 1024))
+
+    contents_prefetch = Int(help="The number of files read ahead or saved at the same time through a contents manager which does not store them on the local file system.",
+                            config=True)
+
+    @default("contents_prefetch")
+    def _default_contents_prefetch(self):
+        return int(os.environ.get("JA_CONTENTS_PREFETCH", 16))
+
+    profile_dir = Unicode(help="The directory where the archiving and the extraction of each request are profiled with cProfile; profiling is disabled if empty.",
+                          config=True)
+
+    @default("profile_dir")
+    def _default_profile_dir(self):
+        return os.environ.get("JA_PROFILE_DIR", "")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._compression_executor = None
+        self._compression_executor_spec = None
+        self._extraction_executor = None
+        self._extraction_job_executor = None
+        self._download_executor = None
+        self._scan_executor = None
+        self._read_executor = None
+        self._archive_cache = None
+        self._index_cache = None
+        self.jobs = JobRegistry()
+
+    def get_compression_executor(self):
+        """Return the pool shared by the compression workers, or None if compression is not parallel."""
+        if self.compression_workers <= 1:
+            return None
+        spec = (self.compression_pool, self.compression_workers)
+        with self._lock:
+            if self._compression_executor_spec != spec:
+                if self._compression_executor is not None:
+                    self._compression_executor.shutdown(wait=False)
+                if self.compression_pool == "process":
+                    self._compression_executor = ProcessPoolExecutor(max_workers=self.compression_workers)
+                else:
+                    self._compression_executor = ThreadPoolExecutor(max_workers=self.compression_workers,
+                                                                    thread_name_prefix="jupyter-archive-compression")
+                self._compression_executor_spec = spec
+            return self._compression_executor
+
+    def get_extraction_executor(self):
+        """Return the thread pool shared by the extraction workers, or None if extraction is not parallel."""
+        if self.extraction_workers <= 1:
+            return None
+        with self._lock:
+            self._extraction_executor = self._resize_pool(self._extraction_executor, self.extraction_workers,
+                                                          "jupyter-archive-extraction")
+            return self._extraction_executor
+
+    def get_extraction_job_executor(self):
+        """Return the thread pool running the extractions."""
+        with self._lock:
+            self._extraction_job_executor = self._resize_pool(self._extraction_job_executor, self.max_extraction_jobs,
+                                                              "jupyter-archive-extraction-job")
+            return self._extraction_job_executor
+
+    def get_download_executor(self):
+        """Return the thread pool archiving the downloads, apart from the kernels and contents work."""
+        with self._lock:
+            self._download_executor = self._resize_pool(self._download_executor, self.max_download_jobs,
+                                                        "jupyter-archive-download")
+            return self._download_executor
+
+    def get_scan_executor(self):
+        """Return the thread pool prefetching the directories to archive, or None if they are scanned one at a time."""
+        if self.scan_prefetch <= 0:
+            return None
+        with self._lock:
+            self._scan_executor = self._resize_pool(self._scan_executor, self.scan_prefetch, "jupyter-archive-scan")
+            return self._scan_executor
+
+    def get_read_executor(self):
+        """Return the thread pool reading the files ahead of the archiving threads, or None if they read them."""
+        if self.read_ahead_workers <= 0:
+            return None
+        with self._lock:
+            self._read_executor = self._resize_pool(self._read_executor, self.read_ahead_workers,
+                                                    "jupyter-archive-read")
+            return self._read_executor
+
+    @staticmethod
+    def _resize_pool(executor, workers, name):
+        workers = max(1, workers)
+        if executor is None or executor._max_workers != workers:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        return executor
+
+    def start_job(self, kind, path, job_id=None, status="running", user=None, archive_format=None):
+        """Register a job within the limits; see :meth:`JobRegistry.start`."""
+        return self.jobs.start(
+            kind, path, job_id, status, user, self.max_jobs, self.max_jobs_per_user, archive_format
+        )
+
+    def get_archive_cache(self):
+        """Return the archive cache, or None if it is disabled."""
+        if not self.archive_cache_dir:
+            return None
+        with self._lock:
+            cache = self._archive_cache
+            if cache is None or (cache.directory, cache.max_size) != (self.archive_cache_dir, self.archive_cache_max_size):
+                self._archive_cache = ArchiveCache(self.archive_cache_dir, self.archive_cache_max_size)
+            return self._archive_cache
+
+    def get_index_cache(self):
+        """Return the cache of the tar archive indexes, or None if it is disabled."""
+        if not self.archive_index_dir:
+            return None
+        with self._lock:
+            cache = self._index_cache
+            if cache is None or (cache.directory, cache.max_size) != (self.archive_index_dir, self.archive_index_max_size):
+                self._index_cache = ArchiveCache(self.archive_index_dir, self.archive_index_max_size, ".index")
+            return self._index_cache
+
+    def shutdown(self):
+        """Stop the worker pools."""
+        with self._lock:
+            if self._compression_executor is not None:
+                self._compression_executor.shutdown(wait=False, cancel_futures=True)
+            self._compression_executor = None
+            self._compression_executor_spec = None
+            if self._extraction_executor is not None:
+                self._extraction_executor.shutdown(wait=False, cancel_futures=True)
+            self._extraction_executor = None
+            if self._extraction_job_executor is not None:
+                self._extraction_job_executor.shutdown(wait=False, cancel_futures=True)
+            self._extraction_job_executor = None
+            if self._download_executor is not None:
+                self._download_executor.shutdown(wait=False, cancel_futures=True)
+            self._download_executor = None
+            if self._scan_executor is not None:
+                self._scan_executor.shutdown(wait=False, cancel_futures=True)
+            self._scan_executor = None
+            if self._read_executor is not None:
+                self._read_executor.shutdown(wait=False, cancel_futures=True)
+            self._read_executor = None
+
 
 def _load_jupyter_server_extension(server_app):
     """Registers the API handler to receive HTTP requests from the frontend extension.
@@ -64,3 +356,8 @@ def _load_jupyter_server_extension(server_app):
     config = JupyterArchive(config=server_app.config)
     server_app.web_app.settings["jupyter_archive"] = config
     setup_handlers(server_app.web_app)
+
+
+def _unload_jupyter_server_extension(server_app):
+    """Stops the worker pools when the server is shut down."""
+    server_app.web_app.settings["jupyter_archive"].shutdown()
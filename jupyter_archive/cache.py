@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Temporary files older than this (in seconds) are left over by a crashed server
+STALE_TEMPORARY_DELAY = 24 * 3600
+
+_SUFFIX = ".archive"
+_TEMPORARY_PREFIX = ".tmp-"
+
+
+def fingerprint(files):
+    """Fingerprint a directory content from the path, mtime, size and inode of its files.
+
+    ``files`` is an iterable of ``(filename, arcname, stat)``, as listed by
+    :func:`~jupyter_archive.scanner.scan_files`.
+    """
+    digest = hashlib.sha256()
+    for _, arcname, st in files:
+        entry = "{}\0{}\0{}\0{}\n".format(arcname, st.st_mtime_ns, st.st_size, st.st_ino)
+        digest.update(entry.encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    """Temporary file receiving an archive; it becomes visible in the cache once committed."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, self.temporary_path = tempfile.mkstemp(prefix=_TEMPORARY_PREFIX, dir=cache.directory)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Finish writing the archive, before committing it."""
+        self.file.close()
+
+    def commit(self):
+        """Move the archive into the cache, unless it is larger than the whole cache."""
+        self.file.close()
+        if os.path.getsize(self.temporary_path) > self.cache.max_size:
+            self.discard()
+            return
+        os.replace(self.temporary_path, self.cache.path(self.key))
+        self.cache.evict()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.temporary_path)
+        except FileNotFoundError:
+            pass
+
+
+class ArchiveCache:
+    """On-disk cache of archives with a least-recently-used eviction under ``max_size`` bytes.
+
+    The entries are files named after their key with ``suffix``.
+    """
+
+    def __init__(self, directory, max_size, suffix=_SUFFIX):
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Cache key of an archive made from the JSON-serializable ``parts``."""
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """Return the path of the cached archive, or None."""
+        path = self.path(key)
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def open(self, key):
+        """Start writing the archive for ``key``; see :class:`CacheEntry`."""
+        return CacheEntry(self, key)
+
+    def evict(self):
+        """Remove the least recently used archives until the cache fits in its budget."""
+        with self._lock:
+            entries = []
+            now = time.time()
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith(self.suffix):
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                    elif entry.name.startswith(_TEMPORARY_PREFIX) and now - st.st_mtime > STALE_TEMPORARY_DELAY:
+                        self._remove(entry.path)
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,350 @@
+import asyncio
+import base64
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import zipfile
+from collections import deque
+
+from jupyter_server.services.contents.filemanager import FileManagerMixin
+from jupyter_server.utils import ensure_async, url_path_join
+
+from .index import MemberSelection, select_members
+from .jobs import Job
+
+# Mode of the archive members, the contents models have no permissions
+FILE_MODE = stat.S_IFREG | 0o644
+DIRECTORY_MODE = stat.S_IFDIR | 0o755
+# Max number of bytes of the files saved by a single batch
+MAX_BATCH_SIZE = 64 * 1024 * 1024
+# Destination against which the "data" filter checks the tar members; it is never written
+_FILTER_ROOT = os.path.abspath(os.sep + "jupyter-archive")
+
+
+def api_path(path):
+    """Return the API path of a :class:`pathlib.PurePosixPath`, "" for the root."""
+    return path.as_posix() if path.parts else ""
+
+
+def is_local(contents_manager):
+    """Whether the files of ``contents_manager`` are on the local file system, as with FileContentsManager."""
+    return isinstance(contents_manager, FileManagerMixin)
+
+
+def _stat_result(mode, size, mtime):
+    mtime_ns = int(mtime * 1e9)
+    times = (int(mtime),) * 3 + (mtime,) * 3 + (mtime_ns,) * 3
+    return os.stat_result((mode, 0, 0, 1, 0, 0, size) + times)
+
+
+def contents_stat(model):
+    """Return the ``os.stat_result`` of a contents model, used to build its archive member."""
+    mode = DIRECTORY_MODE if model["type"] == "directory" else FILE_MODE
+    last_modified = model.get("last_modified")
+    return _stat_result(mode, model.get("size") or 0, last_modified.timestamp() if last_modified is not None else 0)
+
+
+def _call(loop, function, *args):
+    # Call a contents manager method on the event loop from a worker thread
+    async def call():
+        return await ensure_async(function(*args))
+
+    return asyncio.run_coroutine_threadsafe(call(), loop).result()
+
+
+async def read_contents(contents_manager, path):
+    """Return the bytes of the file at the API ``path``."""
+    model = await ensure_async(contents_manager.get(path, content=True, type="file", format="base64"))
+    if model["format"] == "base64":
+        return base64.b64decode(model["content"])
+    return model["content"].encode("utf-8")
+
+
+async def walk_contents(contents_manager, path, arcname_root, download_hidden=False, path_filter=None, root=""):
+    """List the ``(None, arcname, stat)`` of the files to archive below the API ``path``, like `scan_files`.
+
+    The arcnames are relative to the API path ``arcname_root``. The files
+    are selected by ``path_filter``, a
+    :class:`~jupyter_archive.scanner.PathFilter` on their path below the
+    local ``root`` of ``contents_manager``; they are read by
+    :class:`ContentsReader`.
+    """
+    # Without its content: the body of a file is only fetched by ContentsReader
+    model = await ensure_async(contents_manager.get(path, content=False))
+    if model["type"] != "directory":
+        if not path_filter or path_filter.includes(os.path.join(root, *path.split("/"))):
+            return [(None, _arcname(path, arcname_root), contents_stat(model))]
+        return []
+    return await _walk_directory(contents_manager, path, arcname_root, download_hidden, path_filter, root)
+
+
+async def _walk_directory(contents_manager, path, arcname_root, download_hidden, path_filter, root):
+    files = []
+    model = await ensure_async(contents_manager.get(path, content=True, type="directory"))
+    children = sorted(model["content"], key=lambda child: child["name"])
+    for child in children:
+        if not download_hidden and child["name"][0] == ".":
+            continue
+        local_path = os.path.join(root, *child["path"].split("/"))
+        if child["type"] == "directory":
+            if path_filter and path_filter.excludes(local_path):
+                continue
+            files.extend(
+                await _walk_directory(contents_manager, child["path"], arcname_root, download_hidden, path_filter, root)
+            )
+        elif not path_filter or path_filter.includes(local_path):
+            files.append((None, _arcname(child["path"], arcname_root), contents_stat(child)))
+    return files
+
+
+def _arcname(path, arcname_root):
+    parts = path.strip("/").split("/")
+    root_parts = [part for part in arcname_root.strip("/").split("/") if part]
+    return os.path.join(*parts[len(root_parts):])
+
+
+class ContentsReader:
+    """Iterate over the files listed by :func:`walk_contents` with their content fetched ahead.
+
+    The files are read through the ``contents_manager`` on the event
+    ``loop``, up to ``max_files`` at a time within ``max_size`` bytes, and
+    yielded in order by the archiving thread like a
+    :class:`~jupyter_archive.readahead.ReadAhead`. The contents models have
+    no ranges: each file is fetched whole, and its stat result is updated
+    with the size read.
+    """
+
+    def __init__(self, files, contents_manager, arcname_root, loop, max_size, max_files):
+        self._files = files
+        self._contents_manager = contents_manager
+        self._arcname_root = arcname_root
+        self._loop = loop
+        self._max_size = max_size
+        self._max_files = max(1, max_files)
+        self._pending = deque()
+        self._pending_size = 0
+        self._next = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for index, (file_name, arcname, st) in enumerate(self._files):
+            if not stat.S_ISREG(st.st_mode):
+                yield file_name, arcname, st, None
+                continue
+            self._submit(index)
+            size, future = self._pending.popleft()
+            self._pending_size -= size
+            data = future.result()
+            self._submit(index + 1)
+            if len(data) != st.st_size:
+                st = _stat_result(st.st_mode, len(data), st.st_mtime)
+            yield file_name, arcname, st, io.BytesIO(data)
+
+    def close(self):
+        """Cancel the reads not done yet."""
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pending_size = 0
+        self._next = len(self._files)
+
+    def _submit(self, start):
+        # Start the next reads from `start` on within the limits, at least one
+        self._next = max(self._next, start)
+        while self._next < len(self._files) and len(self._pending) < self._max_files:
+            _, arcname, st = self._files[self._next]
+            if self._pending and self._pending_size + st.st_size > self._max_size:
+                return
+            self._next += 1
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            path = url_path_join(self._arcname_root, *arcname.split(os.sep))
+            future = asyncio.run_coroutine_threadsafe(read_contents(self._contents_manager, path), self._loop)
+            self._pending.append((st.st_size, future))
+            self._pending_size += st.st_size
+
+
+class ContentsArchive:
+    """Copy of an archive of the ``contents_manager`` in a local temporary file, to read it.
+
+    The contents models have no streaming: the archive is fetched whole.
+    """
+
+    def __init__(self, contents_manager, path, loop):
+        self.contents_manager = contents_manager
+        self.path = path
+        self._loop = loop
+        self.local_path = None
+
+    def __enter__(self):
+        data = _call(self._loop, read_contents, self.contents_manager, self.path)
+        # Keep the suffixes, which give the format
+        name = self.path.rsplit("/", 1)[-1]
+        suffix = name[name.index("."):] if "." in name else ""
+        fd, self.local_path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.remove(self.local_path)
+
+
+class CreatedContents:
+    """Paths created through a contents manager by an extraction, to delete them on rollback.
+
+    Like :class:`~jupyter_archive.extract.CreatedPaths`, the files
+    overwritten by the extraction are not restored.
+    """
+
+    def __init__(self, contents_manager, loop):
+        self.contents_manager = contents_manager
+        self._loop = loop
+        self.paths = []
+
+    def add(self, paths):
+        self.paths.extend(paths)
+
+    def rollback(self):
+        """Delete the recorded paths, children first."""
+        for path in reversed(self.paths):
+            try:
+                _call(self._loop, self.contents_manager.delete_file, path)
+            except Exception:
+                pass
+        self.paths = []
+
+
+class ContentsWriter:
+    """Save the extracted files through a contents manager from the extracting thread.
+
+    The files are saved by batches of ``batch_size`` concurrent saves, or
+    ``MAX_BATCH_SIZE`` bytes, on the event ``loop``; their directories are
+    created beforehand, parents first. The new paths are recorded in
+    ``created``, a :class:`CreatedContents`.
+    """
+
+    def __init__(self, contents_manager, loop, batch_size, created=None):
+        self.contents_manager = contents_manager
+        self.batch_size = max(1, batch_size)
+        self.created = created
+        self._loop = loop
+        self._batch = []
+        self._batch_bytes = 0
+        self._directories = {""}
+
+    def directory(self, path):
+        """Create the directory ``path`` and its parents if they do not exist."""
+        missing = []
+        while path not in self._directories:
+            missing.append(path)
+            path = path.rpartition("/")[0]
+        for path in reversed(missing):
+            self._directories.add(path)
+            if not _call(self._loop, self.contents_manager.dir_exists, path):
+                _call(self._loop, self.contents_manager.save, {"type": "directory"}, path)
+                if self.created is not None:
+                    self.created.add([path])
+
+    def file(self, path, data):
+        """Save ``data`` as the file ``path`` with the next batch."""
+        self.directory(path.rpartition("/")[0])
+        self._batch.append((path, data))
+        self._batch_bytes += len(data)
+        if len(self._batch) >= self.batch_size or self._batch_bytes >= MAX_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Save the files of the batch."""
+        if not self._batch:
+            return
+        batch = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+        existed = _call(self._loop, self._save_batch, batch)
+        if self.created is not None:
+            self.created.add([path for (path, _), exists in zip(batch, existed) if not exists])
+
+    async def _save_batch(self, batch):
+        return await asyncio.gather(*(self._save(path, data) for path, data in batch))
+
+    async def _save(self, path, data):
+        # Return whether the file existed before
+        exists = await ensure_async(self.contents_manager.file_exists(path))
+        model = {"type": "file", "format": "base64", "content": base64.b64encode(data).decode("ascii")}
+        await ensure_async(self.contents_manager.save(model, path))
+        return exists
+
+
+def _member_path(name, destination):
+    # Same sanitization as ZipFile.extract: drop the empty, "." and ".." parts
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join([destination.strip("/")] + parts if destination.strip("/") else parts)
+
+
+def extract_contents(archive, writer, destination, job=None, names=None, quota=None):
+    """Extract a zip or tar ``archive`` into the API path ``destination`` through ``writer``, a :class:`ContentsWriter`.
+
+    The tar members are checked by the "data" filter. The contents managers
+    have no links: the hard links are extracted as copies of their target
+    and the symbolic links and special files are skipped. As by
+    :func:`~jupyter_archive.extract.extract_zip`, the ``names`` select the
+    members, the progress is reported to ``job``, which can cancel the
+    extraction between two members, and the sizes are checked against
+    ``quota``, for the whole zip archive or tar member by member.
+    """
+    if job is None:
+        job = Job(None, "extract", destination)
+    if isinstance(archive, zipfile.ZipFile):
+        members = archive.infolist()
+        if names is not None:
+            selected = select_members(archive.namelist(), names)
+            members = [member for member in members if member.filename in selected]
+        if quota is not None:
+            for member in members:
+                quota.check(member.file_size)
+        job.set_total(len(members), sum(member.file_size for member in members))
+        for member in members:
+            if job.cancel_requested:
+                break
+            path = _member_path(member.filename, destination)
+            if member.is_dir():
+                writer.directory(path)
+            else:
+                writer.file(path, archive.read(member))
+            job.advance(1, member.file_size)
+    else:
+        # The zstd and lz4 archives are read in streaming mode: the members are selected as they come
+        selection = None if names is None else MemberSelection(names)
+        for member in archive:
+            if job.cancel_requested:
+                break
+            if selection is not None and member.name not in selection:
+                continue
+            member = tarfile.data_filter(member, _FILTER_ROOT)
+            size = member.size if member.isreg() else 0
+            if quota is not None and not member.islnk():
+                quota.check(size)
+            path = _member_path(member.name, destination)
+            if member.isdir():
+                writer.directory(path)
+            elif member.isreg() or member.islnk():
+                with archive.extractfile(member) as f:
+                    data = f.read()
+                if member.islnk():
+                    # A copy of its target, read before it is checked
+                    size = len(data)
+                    if quota is not None:
+                        quota.check(size)
+                writer.file(path, data)
+            job.advance(1, size)
+        if selection is not None and not job.cancel_requested:
+            selection.check()
+    writer.flush()
@@ -0,0 +1,567 @@
+import copy
+import os
+import queue
+import secrets
+import shutil
+import stat
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+
+from .index import IndexedReader, MemberSelection, read_member, select_members
+from .jobs import Job
+
+# Size of the chunks handed from the decompressing thread to the writing thread
+CHUNK_SIZE = 1024 * 1024
+# Number of chunks waiting to be written; it bounds the memory used by the pipeline
+MAX_PENDING_CHUNKS = 16
+# Extracted size below which the compression ratio is not checked: small
+# archives of e.g. blank files legitimately have huge ratios.
+RATIO_MIN_SIZE = 64 * 1024 * 1024
+
+
+class ExtractionLimitError(Exception):
+    """Raised when an archive exceeds the limits of an :class:`ExtractionQuota`."""
+
+
+class ExtractionQuota:
+    """Limits of an extraction, checked from the size of each member before it is written.
+
+    The extraction is stopped beyond ``max_members`` members or ``max_size``
+    bytes (0 for no limit) and beyond the ``free_space`` of the destination
+    volume, if given. It is also stopped once the extracted size exceeds
+    ``max_ratio`` times ``archive_size``, the size of the archive file (and
+    ``RATIO_MIN_SIZE``), as decompression bombs do.
+
+    The sizes are those of the member headers: the zip and tar readers
+    never write more than announced.
+    """
+
+    def __init__(self, archive_size, max_size=0, max_members=0, max_ratio=0, free_space=None):
+        self.archive_size = archive_size
+        self.max_size = max_size
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.free_space = free_space
+        self.size = 0
+        self.members = 0
+
+    def check(self, size):
+        """Count a member of ``size`` bytes about to be extracted; raise ExtractionLimitError beyond a limit."""
+        self.members += 1
+        self.size += size
+        if self.max_members and self.members > self.max_members:
+            raise ExtractionLimitError("The archive has more than {} members".format(self.max_members))
+        if self.max_size and self.size > self.max_size:
+            raise ExtractionLimitError("The archive content is larger than {} bytes".format(self.max_size))
+        if self.max_ratio and self.size > max(RATIO_MIN_SIZE, self.max_ratio * self.archive_size):
+            raise ExtractionLimitError(
+                "The archive expands more than {} times, it looks like a decompression bomb".format(self.max_ratio)
+            )
+        if self.free_space is not None and self.size > self.free_space:
+            raise ExtractionLimitError("Not enough disk space to extract the archive")
+
+
+class CreatedPaths:
+    """Paths created by an extraction in ``destination``, to remove them on rollback.
+
+    Only the paths which did not exist are recorded: the files overwritten
+    by the extraction are not restored.
+    """
+
+    def __init__(self, destination):
+        self.destination = os.path.realpath(destination)
+        self.paths = []
+        self._seen = set()
+
+    def missing(self, path):
+        """Return ``path`` and its ancestors which do not exist yet, from the top one."""
+        missing = []
+        path = os.path.normpath(path)
+        while path.startswith(self.destination + os.sep) and path not in self._seen and not os.path.lexists(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        return missing[::-1]
+
+    def add(self, paths):
+        """Record the ``paths`` returned by :meth:`missing` once they are extracted."""
+        self._seen.update(paths)
+        self.paths.extend(paths)
+
+    def rollback(self):
+        """Remove the recorded paths, children first."""
+        for path in reversed(self.paths):
+            if os.path.isdir(path) and not os.path.islink(path):
+                # The directory may have been made read-only by the archive
+                for root, _, _ in os.walk(path):
+                    os.chmod(root, 0o700)
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self.paths = []
+
+
+def _zip_target_path(member, destination):
+    # Same sanitization as ZipFile.extract: drop the drive, empty, "." and ".." parts
+    arcname = member.filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in ("", os.path.curdir, os.path.pardir))
+    return os.path.normpath(os.path.join(destination, arcname))
+
+
+def _tar_target_path(member, destination):
+    # The "data" filter strips the leading slashes before checking the path
+    return os.path.join(destination, member.name.lstrip("/" + os.sep))
+
+
+def _extract_zip_members(archive_path, members, destination, job):
+    # Each worker reads the archive through its own file handle
+    with zipfile.ZipFile(archive_path) as archive:
+        while not job.cancel_requested:
+            try:
+                member = members.popleft()
+            except IndexError:
+                return
+            archive.extract(member, destination)
+            job.advance(1, member.file_size)
+
+
+def _track(members, job, size, target_path, created, quota=None):
+    # Hand the members one by one to extractall: stop between two members once
+    # the job is canceled or beyond the quota, and record each member when it
+    # is extracted, i.e. when the next one is asked for.
+    for member in members:
+        if job.cancel_requested:
+            return
+        if quota is not None:
+            quota.check(size(member))
+        missing = [] if created is None else created.missing(target_path(member))
+        yield member
+        if created is not None:
+            created.add(missing)
+        job.advance(1, size(member))
+
+
+def extract_zip(archive_path, destination, executor=None, workers=1, job=None, created=None, names=None, quota=None):
+    """Extract a zip archive, or its members selected by ``names``, into ``destination``.
+
+    The members are read independently from the central directory: with an
+    ``executor``, ``workers`` tasks extract them concurrently, each with its
+    own handle on the archive. All directories are created beforehand so
+    that the workers never race on them. Paths are sanitized as by
+    :meth:`zipfile.ZipFile.extract`, which writes the files.
+
+    The progress is reported to ``job``, a :class:`~jupyter_archive.jobs.Job`,
+    and the extraction stops between two members once it is canceled. The
+    new paths are recorded in ``created``, a :class:`CreatedPaths`. The
+    ``names`` are selected as by :func:`~jupyter_archive.index.select_members`.
+
+    The sizes of the members are known from the central directory: the
+    whole archive is checked against ``quota``, an :class:`ExtractionQuota`,
+    before anything is written.
+    """
+    if job is None:
+        job = Job(None, "extract", str(archive_path))
+    destination = os.path.realpath(destination)
+    with zipfile.ZipFile(archive_path) as archive:
+        infolist = archive.infolist()
+        if names is not None:
+            selected = select_members(archive.namelist(), names)
+            infolist = [member for member in infolist if member.filename in selected]
+        if quota is not None:
+            for member in infolist:
+                quota.check(member.file_size)
+        job.set_total(len(infolist), sum(member.file_size for member in infolist))
+        if executor is None or workers <= 1:
+            members = _track(
+                infolist,
+                job,
+                lambda member: member.file_size,
+                lambda member: _zip_target_path(member, destination),
+                created,
+            )
+            archive.extractall(destination, members=members)
+            return
+        members = deque()
+        directories = set()
+        for member in infolist:
+            target = _zip_target_path(member, destination)
+            if member.is_dir():
+                directories.add(target)
+                job.advance(1, 0)
+            else:
+                directories.add(os.path.dirname(target))
+                members.append((member, target))
+    for directory in sorted(directories):
+        missing = [] if created is None else created.missing(directory)
+        os.makedirs(directory, exist_ok=True)
+        if created is not None:
+            created.add(missing)
+    if created is not None:
+        # The workers extract the files in any order; record them all beforehand
+        for _, target in members:
+            created.add(created.missing(target))
+
+    # Largest members first, so that a big file does not end the extraction alone
+    members = deque(sorted((member for member, _ in members), key=lambda member: member.file_size, reverse=True))
+    futures = [
+        executor.submit(_extract_zip_members, archive_path, members, destination, job)
+        for _ in range(min(workers, len(members)))
+    ]
+    try:
+        for future in futures:
+            future.result()
+    finally:
+        # Stop the other workers on error
+        members.clear()
+
+
+class _FileWriter(threading.Thread):
+    """Thread writing the regular files of a tar archive while the next data is decompressed."""
+
+    def __init__(self):
+        super().__init__(name="jupyter-archive-extraction", daemon=True)
+        self.queue = queue.Queue(MAX_PENDING_CHUNKS)
+        self.error = None
+        self._file = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    function, args = item
+                    function(*args)
+            except BaseException as error:
+                self.error = error
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+            finally:
+                self.queue.task_done()
+
+    def submit(self, function, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((function, args))
+
+    def wait(self):
+        """Wait for the pending writes, e.g. before creating a link to a written file."""
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def open(self, path):
+        self._file = open(path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def finish(self, path, mode, mtime):
+        self._file.close()
+        self._file = None
+        if mode is not None:
+            os.chmod(path, mode)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+
+def _set_directory_attributes(directories, destination):
+    # Deepest directories first, in case they are made read-only
+    directories.sort(key=lambda member: member.name, reverse=True)
+    for member in directories:
+        path = os.path.join(destination, member.name)
+        if member.mtime is not None:
+            os.utime(path, (member.mtime, member.mtime))
+        if member.mode is not None:
+            os.chmod(path, member.mode)
+
+
+def _tar_size(member):
+    return member.size if member.isreg() else 0
+
+
+def extract_tar(archive, destination, pipeline=False, job=None, created=None, quota=None):
+    """Extract the opened tar ``archive`` into ``destination`` with the "data" filter.
+
+    With ``pipeline``, the regular files are written by a separate thread
+    while this one decompresses the archive. Every member goes through
+    :func:`tarfile.data_filter` first and the other members are extracted by
+    :class:`tarfile.TarFile` once the pending writes are done, so links are
+    checked against the files actually on disk.
+
+    The progress is reported to ``job``; the totals are not known as
+    listing the members would decompress the whole archive. The extraction
+    stops between two members once the job is canceled and the new paths
+    are recorded in ``created``. Each member is checked against ``quota``
+    before it is written.
+    """
+    if job is None:
+        job = Job(None, "extract", str(archive.name))
+    destination = os.path.realpath(destination)
+    if not pipeline:
+        members = _track(
+            archive, job, _tar_size, lambda member: _tar_target_path(member, destination), created, quota
+        )
+        archive.extractall(destination, members=members, filter="data")
+        return
+
+    directories = []
+    writer = _FileWriter()
+    writer.start()
+    try:
+        for tarinfo in archive:
+            if job.cancel_requested:
+                return
+            member = tarfile.data_filter(tarinfo, destination)
+            if quota is not None:
+                quota.check(_tar_size(member))
+            target = os.path.join(destination, member.name)
+            missing = [] if created is None else created.missing(target)
+            if member.isreg():
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if created is not None:
+                    created.add(missing)
+                source = archive.extractfile(tarinfo)
+                writer.submit(writer.open, target)
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    writer.submit(writer.write, chunk)
+                writer.submit(writer.finish, target, member.mode, member.mtime)
+                job.advance(1, member.size)
+                continue
+            writer.wait()
+            if member.isdir():
+                # Like extractall, set the attributes of the directories at the end
+                # in case they are read-only
+                directories.append(member)
+                archive.extract(tarinfo, destination, set_attrs=False, filter="data")
+            else:
+                archive.extract(tarinfo, destination, filter="data")
+            if created is not None:
+                created.add(missing)
+            job.advance(1, 0)
+        writer.wait()
+    finally:
+        writer.close()
+
+    _set_directory_attributes(directories, destination)
+
+
+def extract_tar_members(archive_path, index, names, destination, job=None, created=None, quota=None):
+    """Extract the members of a tar archive selected by ``names`` into ``destination``.
+
+    The members are read from the ``index`` of the archive (see
+    :func:`~jupyter_archive.index.tar_index`) without decompressing the
+    whole archive, and extracted with the "data" filter. A hard link to a
+    member which is not selected is extracted as a copy of its target.
+
+    The progress is reported to ``job`` and the new paths are recorded in
+    ``created``, as by :func:`extract_tar`. The selection is checked against
+    ``quota`` from the index before anything is written.
+    """
+    if job is None:
+        job = Job(None, "extract", str(archive_path))
+    destination = os.path.realpath(destination)
+    members = {entry["name"]: entry for entry in index["members"]}
+    selected = select_members(list(members), names)
+    entries = [entry for entry in index["members"] if entry["name"] in selected]
+    if quota is not None:
+        for entry in entries:
+            size = entry["size"]
+            if entry["type"] == "link" and entry["linkname"] not in selected and entry["linkname"] in members:
+                # Extracted as a copy of its target
+                size = members[entry["linkname"]]["size"]
+            quota.check(size)
+    job.set_total(len(entries), sum(entry["size"] for entry in entries))
+
+    directories = []
+    with IndexedReader(archive_path, index) as reader, tarfile.TarFile(fileobj=reader) as archive:
+        for entry in entries:
+            if job.cancel_requested:
+                return
+            tarinfo = read_member(archive, entry["offset"])
+            if tarinfo.islnk() and tarinfo.linkname not in selected and tarinfo.linkname in members:
+                target = read_member(archive, members[tarinfo.linkname]["offset"])
+                tarinfo = copy.copy(tarinfo)
+                tarinfo.type = tarfile.REGTYPE
+                tarinfo.linkname = ""
+                tarinfo.size = target.size
+                tarinfo.offset_data = target.offset_data
+            member = tarfile.data_filter(tarinfo, destination)
+            missing = [] if created is None else created.missing(os.path.join(destination, member.name))
+            if member.isdir():
+                # Like extractall, set the attributes of the directories at the end
+                directories.append(member)
+                archive.extract(tarinfo, destination, set_attrs=False, filter="data")
+            else:
+                archive.extract(tarinfo, destination, filter="data")
+            if created is not None:
+                created.add(missing)
+            job.advance(1, _tar_size(member))
+
+    _set_directory_attributes(directories, destination)
+
+
+def _zip_mtime(member):
+    # Zip dates are in local time
+    return time.mktime(member.date_time + (0, 0, -1))
+
+
+def _crc32(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _unchanged_zip(member, target):
+    # Zip dates have a 2 second resolution; with another mtime, e.g. extracted
+    # without incremental mode, the CRC-32 of the file is compared instead and
+    # the mtime is fixed for the next time.
+    try:
+        st = os.lstat(target)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_size != member.file_size:
+        return False
+    mtime = _zip_mtime(member)
+    if abs(st.st_mtime - mtime) < 2:
+        return True
+    if _crc32(target) != member.CRC:
+        return False
+    os.utime(target, (mtime, mtime))
+    return True
+
+
+def _unchanged_tar(member, target):
+    try:
+        st = os.lstat(target)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size == member.size and int(st.st_mtime) == int(member.mtime)
+
+
+def _replace_file(source, target, mode, mtime):
+    # Write a temporary file next to `target` and rename it over the old one,
+    # so that the file is never seen half written. It is created like open()
+    # does, with the default permissions.
+    directory, name = os.path.split(target)
+    while True:
+        temporary_path = os.path.join(directory, ".{}.{}.part".format(name, secrets.token_hex(4)))
+        try:
+            f = open(temporary_path, "xb")
+        except FileExistsError:
+            continue
+        break
+    try:
+        with f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+        if mode is not None:
+            os.chmod(temporary_path, mode)
+        os.utime(temporary_path, (mtime, mtime))
+        os.replace(temporary_path, target)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def extract_incremental(archive, destination, job=None, created=None, names=None, quota=None):
+    """Extract the opened zip or tar ``archive`` into ``destination``, skipping the files which did not change.
+
+    A regular member is skipped if the file at its path has its size and
+    mtime, or for zip members its size and CRC-32 (from the central
+    directory): the unchanged members are not decompressed. The other files
+    are written to a temporary file renamed over the old one, with the mtime
+    of the member so that the next extraction skips them. The tar members
+    go through the "data" filter and the links to an existing file are
+    extracted again.
+
+    The files are written one by one. As by :func:`extract_zip` and
+    :func:`extract_tar`, the ``names`` select the members, the progress is
+    reported to ``job``, the new paths are recorded in ``created`` and the
+    members written are checked against ``quota``.
+    """
+    if job is None:
+        job = Job(None, "extract", str(destination))
+    destination = os.path.realpath(destination)
+    if isinstance(archive, zipfile.ZipFile):
+        members = archive.infolist()
+        if names is not None:
+            selected = select_members(archive.namelist(), names)
+            members = [member for member in members if member.filename in selected]
+        job.set_total(len(members), sum(member.file_size for member in members))
+        for member in members:
+            if job.cancel_requested:
+                return
+            target = _zip_target_path(member, destination)
+            if not member.is_dir() and _unchanged_zip(member, target):
+                job.skip(1, member.file_size)
+                continue
+            if quota is not None:
+                quota.check(member.file_size)
+            missing = [] if created is None else created.missing(target)
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(member) as source:
+                    _replace_file(source, target, None, _zip_mtime(member))
+            if created is not None:
+                created.add(missing)
+            job.advance(1, member.file_size)
+        return
+
+    # The zstd and lz4 archives are read in streaming mode: the members are selected as they come
+    selection = None if names is None else MemberSelection(names)
+    directories = []
+    for tarinfo in archive:
+        if job.cancel_requested:
+            return
+        if selection is not None and tarinfo.name not in selection:
+            continue
+        member = tarfile.data_filter(tarinfo, destination)
+        target = os.path.join(destination, member.name)
+        if member.isreg() and _unchanged_tar(member, target):
+            job.skip(1, member.size)
+            continue
+        if quota is not None:
+            quota.check(_tar_size(member))
+        missing = [] if created is None else created.missing(target)
+        if member.isreg():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.extractfile(tarinfo) as source:
+                _replace_file(source, target, member.mode, member.mtime)
+        elif member.isdir():
+            # Like extractall, set the attributes of the directories at the end
+            directories.append(member)
+            archive.extract(tarinfo, destination, set_attrs=False, filter="data")
+        else:
+            if member.islnk() and os.path.lexists(target):
+                # tarfile does not replace an existing file by a hard link
+                os.remove(target)
+            archive.extract(tarinfo, destination, filter="data")
+        if created is not None:
+            created.add(missing)
+        job.advance(1, _tar_size(member))
+    if selection is not None:
+        selection.check()
+
+    _set_directory_attributes(directories, destination)
@@ -1,18 +1,55 @@
+import functools
+import io
 import json
 import os
 import pathlib
+import shutil
+import stat
 import tarfile
+import tempfile
 import time
 import traceback
 import zipfile
+import zlib
 import threading
+from contextlib import closing
 from http.client import responses
 
 from jupyter_server.base.handlers import JupyterHandler
 from jupyter_server.utils import url2path, url_path_join, ensure_async
-from tornado import ioloop, web
+from tornado import ioloop, iostream, web
 from urllib.parse import quote
 
+from .cache import fingerprint as cache_fingerprint
+from .contents import (
+    ContentsArchive,
+    ContentsReader,
+    ContentsWriter,
+    CreatedContents,
+    api_path,
+    extract_contents,
+    is_local,
+    walk_contents,
+)
+from .extract import (
+    CreatedPaths,
+    ExtractionLimitError,
+    ExtractionQuota,
+    extract_tar,
+    extract_incremental,
+    extract_tar_members,
+    extract_zip,
+)
+from .index import list_members, tar_index
+from .jobs import JobConflictError, JobLimitError
+from .manifest import MANIFEST_NAME, HashingReader, Manifest, load_manifest
+from .metrics import BUFFERED_BYTES, DOWNLOAD_TIMEOUTS, FLUSH_SKIPS, STALL_SECONDS
+from .profiling import profiled
+from .readahead import ReadAhead
+from .scanner import PathFilter, scan_files, scan_paths
+from .tarstream import is_available, open_tar_reader, open_tar_writer, tarinfo_from_stat
+from .zipstream import ZipStreamWriter, stored_size, zipinfo_from_stat
+
 SUPPORTED_FORMAT = [
     "zip",
     "tgz",
@@ -23,78 +60,353 @@ SUPPORTED_FORMAT = [
     "tar.bz2",
     "txz",
     "tar.xz",
+    "tzst",
+    "tar.zst",
+    "tlz4",
+    "tar.lz4",
 ]
 
+# Formats requiring an optional dependency, with their compression
+OPTIONAL_FORMAT = {
+    "tzst": "zst",
+    "tar.zst": "zst",
+    "tlz4": "lz4",
+    "tar.lz4": "lz4",
+}
+
+# Suffixes of the tar archives for each compression
+TAR_SUFFIXES = {
+    "gz": (".tgz", ".tar.gz"),
+    "bz2": (".tbz", ".tbz2", ".tar.bz", ".tar.bz2"),
+    "xz": (".txz", ".tar.xz"),
+    "zst": (".tzst", ".tar.zst"),
+    "lz4": (".tlz4", ".tar.lz4"),
+}
+
+# Size of the chunks read from a cached archive
+CACHE_CHUNK_SIZE = 1024 * 1024
+
+# Size of the buffers coalescing the archive data before the archiving thread
+# asks the IOLoop to send it; flushing every small compressor chunk is expensive.
+SLAB_SIZE = 256 * 1024
+# Number of buffers of a download waiting to be sent or being filled.
+SLAB_COUNT = 8
+# Size of the chunks ``handler_max_buffer_length`` counts; a download holds at
+# most that many of them in bytes handed to tornado and not sent yet, as the
+# large writes are handed whole.
+BUFFER_CHUNK_SIZE = 8 * 1024
+
+
+def zip_members(files):
+    """Return the zip members of the ``(filename, arcname, stat)`` listed by `scan_files`."""
+    return [zipinfo_from_stat(file_name, arcname, st) for file_name, arcname, st in files]
+
+
+def add_file(archive, file_name, arcname, st, fileobj=None):
+    """Add a file to the archive from its stat result, without stat'ing it again.
+
+    The content is read from ``fileobj`` if given, e.g. read ahead.
+    """
+    if isinstance(archive, ZipStreamWriter):
+        archive.add(file_name, zinfo=zipinfo_from_stat(file_name, arcname, st), fileobj=fileobj)
+        return
+    tarinfo = tarinfo_from_stat(archive, file_name, arcname, st)
+    if tarinfo is None:
+        # Like tarfile, skip the sockets
+        return
+    if not tarinfo.isreg():
+        archive.addfile(tarinfo)
+    elif fileobj is not None:
+        archive.addfile(tarinfo, fileobj)
+    else:
+        with open(file_name, "rb") as f:
+            archive.addfile(tarinfo, f)
+
+
+def add_bytes(archive, arcname, data):
+    """Add a member made of the bytes ``data`` to the archive, e.g. a manifest."""
+    if isinstance(archive, ZipStreamWriter):
+        zinfo = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        zinfo.external_attr = 0o644 << 16
+        archive.writestr(zinfo, data)
+        return
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mtime = time.time()
+    tarinfo.mode = 0o644
+    archive.addfile(tarinfo, io.BytesIO(data))
+
+
+def iter_contents(files, executor=None, max_size=0, hardlinks=False):
+    """Iterate over the ``(filename, arcname, stat)`` of `scan_files` with a file object reading their content.
+
+    The file object is None if the content is to be read in the archiving
+    thread: without ``executor`` or for the files without content.
+    """
+    if executor is None:
+        for file_name, arcname, st in files:
+            yield file_name, arcname, st, None
+        return
+    with ReadAhead(files, executor, max_size, hardlinks) as read_ahead:
+        yield from read_ahead
+
+
+def job_user(handler):
+    """Return the name of the user of the request, who owns its job."""
+    user = handler.current_user
+    user = getattr(user, "username", user)
+    return user and str(user)
+
+
+def job_path(handler, path):
+    """Return the API path reported by the job of ``path``, a path under the server root or already an API path."""
+    path = pathlib.PurePath(path)
+    try:
+        return path.relative_to(handler.contents_manager.root_dir).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def start_job(handler, kind, archive_path, status="running", archive_format=None):
+    """Register the job of a request.
+
+    If it exceeds the limits of the server, reply 503 (or 429 if the user
+    has too many jobs) with a Retry-After header and return None. If its
+    ``archiveToken`` is the id of an active job, reply 409 and return None.
+    """
+    config = handler.settings["jupyter_archive"]
+    try:
+        return config.start_job(
+            kind,
+            job_path(handler, archive_path),
+            handler.get_argument("archiveToken", None),
+            status,
+            job_user(handler),
+            archive_format,
+        )
+    except JobLimitError as error:
+        handler.log.warning(str(error))
+        handler.set_status(429 if error.per_user else 503)
+        handler.set_header("Retry-After", config.retry_after)
+        handler.set_header("Content-Type", "application/json")
+        handler.finish(json.dumps({"message": str(error), "reason": None}))
+        return None
+    except JobConflictError as error:
+        handler.log.warning(str(error))
+        handler.set_status(409)
+        handler.set_header("Content-Type", "application/json")
+        handler.finish(json.dumps({"message": str(error), "reason": None}))
+        return None
+
 
 class ArchiveStream:
-    def __init__(self, handler):
+    """File object streaming the archive to the client through the handler.
+
+    It runs in the archiving thread. The small writes, e.g. the compressor
+    output, are coalesced into a ring of ``SLAB_COUNT`` slabs of
+    ``SLAB_SIZE`` bytes handed to tornado as memoryviews, and the writes as
+    large as a slab are handed as they are. A slab is reused once the
+    flush which sent it reached the socket. The bytes handed and not sent
+    yet are bounded to ``handler_max_buffer_length`` chunks of
+    ``BUFFER_CHUNK_SIZE`` bytes.
+    """
+
+    def __init__(self, handler, tee=None):
         self.handler = handler
         self.position = 0
+        # Optional file object receiving a copy of the archive
+        self.tee = tee
+        self._slabs = []
+        self._slab = None
+        self._fill = 0
 
     def write(self, data):
-        if self.handler.canceled:
-            raise ValueError("File download canceled")
-        # timeout 600s for this while loop
-        time_out_cnt = 600 * 1000 / self.handler.archive_download_flush_delay
-        while len(self.handler._write_buffer) > self.handler.handler_max_buffer_length:
-            # write_buffer or handler is too large, wait for an flush cycle
-            time.sleep(self.handler.archive_download_flush_delay / 1000)
-            if self.handler.canceled:
-                raise ValueError("File download canceled")
-            time_out_cnt -= 1
-            if time_out_cnt <= 0:
-                raise ValueError("Time out for writing into tornado buffer")
+        if self.tee is not None:
+            self.tee.write(data)
+        if len(data) >= SLAB_SIZE and isinstance(data, bytes):
+            self.flush()
+            self._hand_off(data)
+        else:
+            view = memoryview(data).cast("B")
+            while view:
+                if self._slab is None:
+                    self._slab = self._next_slab()
+                size = min(len(view), SLAB_SIZE - self._fill)
+                self._slab[self._fill:self._fill + size] = view[:size]
+                self._fill += size
+                view = view[size:]
+                if self._fill == SLAB_SIZE:
+                    self.flush()
         self.position += len(data)
-        with self.handler.lock:
-            self.handler.write(data)
+        self.handler.job.bytes_written = self.position
         del data
 
     def tell(self):
         return self.position
 
     def flush(self):
-        # Note: Flushing is done elsewhere, in the main thread
-        # because `write()` is called in a background thread.
-        # self.handler.flush()
-        pass
+        """Hand the slab being filled to tornado.
+
+        The data is sent by the IOLoop, as this is called in the archiving thread.
+        """
+        if self._slab is None:
+            return
+        slab = self._slab[:self._fill]
+        self._slab = None
+        self._fill = 0
+        self._hand_off(slab, is_slab=True)
+
+    def _wait(self, predicate, buffer):
+        # Wait for the IOLoop to send the handed data (timeout 600s).
+        # The condition is notified each time a flush reaches the socket.
+        handler = self.handler
+        start = None if predicate() else time.monotonic()
+        ready = handler.flush_condition.wait_for(lambda: handler.canceled or predicate(), timeout=600)
+        if start is not None:
+            # The download stalled on the full ``buffer``
+            STALL_SECONDS.labels(buffer).observe(time.monotonic() - start)
+        if handler.canceled:
+            raise ValueError("File download canceled")
+        if not ready:
+            DOWNLOAD_TIMEOUTS.inc()
+            raise ValueError("Time out for writing into tornado buffer")
+
+    def _next_slab(self):
+        handler = self.handler
+        with handler.flush_condition:
+            # The slab of the same slot was handed SLAB_COUNT slabs ago
+            self._wait(lambda: handler._handed_slabs - handler._released_slabs < SLAB_COUNT, "slabs")
+            index = handler._handed_slabs % SLAB_COUNT
+        if index == len(self._slabs):
+            self._slabs.append(memoryview(bytearray(SLAB_SIZE)))
+        return self._slabs[index]
+
+    def _hand_off(self, chunk, is_slab=False):
+        handler = self.handler
+        with handler.flush_condition:
+            max_length = handler.handler_max_buffer_length
+            self._wait(
+                lambda: len(handler._write_buffer) <= max_length
+                and handler._handed_bytes - handler._released_bytes < max_length * BUFFER_CHUNK_SIZE,
+                "write_buffer",
+            )
+            # Bypass RequestHandler.write, which only accepts bytes
+            handler._write_buffer.append(chunk)
+            if is_slab:
+                handler._handed_slabs += 1
+            handler._handed_bytes += len(chunk)
+            BUFFERED_BYTES.inc(len(chunk))
+        handler.job.metrics.sent(len(chunk))
+        handler.request_flush()
+
+
+def rename_exclusive(source, target):
+    """Rename the file ``source`` to ``target``; raise FileExistsError instead of replacing ``target``."""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise FileExistsError("The file {} already exists".format(os.path.basename(target))) from None
+    except OSError:
+        # No hard links on this file system: the check is racy but for a short window
+        if os.path.lexists(target):
+            raise FileExistsError("The file {} already exists".format(os.path.basename(target))) from None
+        os.replace(source, target)
+        return
+    os.remove(source)
 
 
-def make_writer(handler, archive_format="zip"):
-    fileobj = ArchiveStream(handler)
+def make_writer(handler, archive_format="zip", compression_level=-1, adaptive_compression=False, tee=None, fileobj=None):
+    # Stream to the client through the handler unless another file object is given
+    if fileobj is None:
+        fileobj = ArchiveStream(handler, tee)
+    executor = handler.compression_executor
+    workers = handler.compression_workers
 
     if archive_format == "zip":
-        archive_file = zipfile.ZipFile(fileobj, mode="w", compression=zipfile.ZIP_DEFLATED)
-        archive_file.add = archive_file.write
+        archive_file = ZipStreamWriter(
+            fileobj, compression_level, executor=executor, workers=workers, adaptive=adaptive_compression
+        )
     elif archive_format in ["tgz", "tar.gz"]:
-        archive_file = tarfile.open(fileobj=fileobj, mode="w|gz")
+        archive_file = open_tar_writer(fileobj, "gz", compression_level, executor=executor, workers=workers)
     elif archive_format in ["tbz", "tbz2", "tar.bz", "tar.bz2"]:
-        archive_file = tarfile.open(fileobj=fileobj, mode="w|bz2")
+        archive_file = open_tar_writer(fileobj, "bz2", compression_level, executor=executor, workers=workers)
     elif archive_format in ["txz", "tar.xz"]:
-        archive_file = tarfile.open(fileobj=fileobj, mode="w|xz")
+        archive_file = open_tar_writer(fileobj, "xz", compression_level, executor=executor, workers=workers)
+    elif archive_format in ["tzst", "tar.zst"]:
+        archive_file = open_tar_writer(fileobj, "zst", compression_level, executor=executor, workers=workers)
+    elif archive_format in ["tlz4", "tar.lz4"]:
+        archive_file = open_tar_writer(fileobj, "lz4", compression_level, executor=executor, workers=workers)
     else:
         raise ValueError("'{}' is not a valid archive format.".format(archive_format))
     return archive_file
 
 
+def archive_compression(archive_path):
+    """Return "zip" or the compression of a tar archive, from the suffixes of ``archive_path``."""
+    archive_format = "".join(archive_path.suffixes)
+    if archive_format.endswith(".zip"):
+        return "zip"
+    for compression, suffixes in TAR_SUFFIXES.items():
+        if archive_format.endswith(suffixes):
+            return compression
+    raise ValueError("'{}' is not a valid archive format.".format(archive_format))
+
+
+def archive_format_name(archive_path):
+    """Return the canonical format of ``archive_path`` from its suffixes, e.g. "tar.gz" for ".tgz", or None."""
+    try:
+        compression = archive_compression(archive_path)
+    except ValueError:
+        return None
+    return compression if compression == "zip" else "tar." + compression
+
+
 def make_reader(archive_path):
 
-    archive_format = "".join(archive_path.suffixes)
+    compression = archive_compression(archive_path)
 
-    if archive_format.endswith(".zip"):
+    if compression == "zip":
         archive_file = zipfile.ZipFile(archive_path, mode="r")
-    elif any([archive_format.endswith(ext) for ext in [".tgz", ".tar.gz"]]):
-        archive_file = tarfile.open(archive_path, mode="r|gz")
-    elif any([archive_format.endswith(ext) for ext in [".tbz", ".tbz2", ".tar.bz", ".tar.bz2"]]):
-        archive_file = tarfile.open(archive_path, mode="r|bz2")
-    elif any([archive_format.endswith(ext) for ext in [".txz", ".tar.xz"]]):
-        archive_file = tarfile.open(archive_path, mode="r|xz")
+    elif compression in ("zst", "lz4"):
+        archive_file = open_tar_reader(archive_path, compression)
     else:
-        raise ValueError("'{}' is not a valid archive format.".format(archive_format))
+        # Tar archives are not opened in streaming mode ("r|gz") which stops after
+        # the first compressed stream; the archives produced with several
+        # compression workers are made of multiple bz2 or xz streams.
+        archive_file = tarfile.open(archive_path, mode="r:" + compression)
     return archive_file
 
 
+async def get_archive_path(handler, archive_path):
+    """Return the path of the archive file at the API path ``archive_path``, or reply 404 if it is hidden.
+
+    If the contents manager does not store the files on the local file
+    system, the API path is returned as a :class:`pathlib.PurePosixPath`.
+    """
+    cm = handler.contents_manager
+
+    if await ensure_async(cm.is_hidden(archive_path)) and not cm.allow_hidden:
+        handler.log.info("Refusing to serve hidden file, via 404 Error")
+        raise web.HTTPError(404)
+
+    if not is_local(cm):
+        return pathlib.PurePosixPath(archive_path.strip("/"))
+    return pathlib.Path(cm.root_dir) / url2path(archive_path)
+
+
 class DownloadArchiveHandler(JupyterHandler):
-    lock = threading.Lock()
+    def initialize(self):
+        # Guards the write buffer between the archiving thread and the IOLoop
+        self.lock = threading.Lock()
+        self._handed_slabs = 0
+        self._released_slabs = 0
+        self._flushing_slabs = 0
+        # Same for the bytes, reported as buffered until they reach the socket
+        self._handed_bytes = 0
+        self._released_bytes = 0
+        self._flushing_bytes = 0
+        # Set once the archive is being sent
+        self.flush_condition = None
 
     @property
     def stream_max_buffer_size(self):
@@ -108,30 +420,154 @@ class DownloadArchiveHandler(JupyterHandler):
     def archive_download_flush_delay(self):
         return self.settings["jupyter_archive"].archive_download_flush_delay
 
+    @property
+    def compression_level(self):
+        return self.settings["jupyter_archive"].compression_level
+
+    @property
+    def adaptive_compression(self):
+        return self.settings["jupyter_archive"].adaptive_compression
+
+    @property
+    def compression_workers(self):
+        return self.settings["jupyter_archive"].compression_workers
+
+    @property
+    def compression_executor(self):
+        return self.settings["jupyter_archive"].get_compression_executor()
+
+    @property
+    def archive_cache(self):
+        return self.settings["jupyter_archive"].get_archive_cache()
+
+    @property
+    def download_executor(self):
+        return self.settings["jupyter_archive"].get_download_executor()
+
+    @property
+    def scan_prefetch(self):
+        return self.settings["jupyter_archive"].scan_prefetch
+
+    @property
+    def scan_executor(self):
+        return self.settings["jupyter_archive"].get_scan_executor()
+
+    @property
+    def read_ahead_size(self):
+        return self.settings["jupyter_archive"].read_ahead_size
+
+    @property
+    def contents_prefetch(self):
+        return self.settings["jupyter_archive"].contents_prefetch
+
+    @property
+    def profile_dir(self):
+        return self.settings["jupyter_archive"].profile_dir
+
+    @property
+    def read_executor(self):
+        return self.settings["jupyter_archive"].get_read_executor()
+
     def flush(self, include_footers=False, force=False):
         # skip flush when stream_buffer is larger than stream_max_buffer_size
         stream_buffer = self.request.connection.stream._write_buffer
         if not force and stream_buffer and len(stream_buffer) > self.stream_max_buffer_size:
+            FLUSH_SKIPS.inc()
             return
         with self.lock:
-            return super(DownloadArchiveHandler, self).flush(include_footers)
+            self._flushing_slabs = self._handed_slabs
+            self._flushing_bytes = self._handed_bytes
+            if not self._headers_written or include_footers or self.request.method == "HEAD" or not self._write_buffer:
+                return super(DownloadArchiveHandler, self).flush(include_footers)
+            # Write the chunks one by one instead of joining them, so that the
+            # slabs reach the IOStream without being copied (but to frame them
+            # with the chunked encoding).
+            chunks = self._write_buffer
+            self._write_buffer = []
+            future = None
+            for chunk in chunks:
+                for transform in self._transforms:
+                    chunk = transform.transform_chunk(chunk, False)
+                future = self.request.connection.write(chunk)
+            return future
+
+    def request_flush(self):
+        # Called from the archiving thread; schedule a flush on the IOLoop
+        # unless one is already scheduled or in flight.
+        if not self._flush_requested and self._flush_future is None:
+            self._flush_requested = True
+            self._loop.add_callback(self._flush_buffer)
+
+    def _flush_buffer(self):
+        self._flush_requested = False
+        if self.canceled or self._flush_future is not None or not self._write_buffer:
+            return
+        future = self.flush()
+        if future is None:
+            # The IOStream buffer is full, try again a bit later.
+            self._flush_requested = True
+            self._loop.call_later(self.archive_download_flush_delay / 1000, self._flush_buffer)
+            return
+        self._flush_future = future
+        future.add_done_callback(functools.partial(self._on_flushed, self._flushing_slabs, self._flushing_bytes))
+
+    def _on_flushed(self, slabs, nbytes, future):
+        self._flush_future = None
+        if future.cancelled() or future.exception() is not None:
+            self.canceled = True
+        with self.flush_condition:
+            # The slabs sent by this flush can be filled again
+            self._released_slabs = max(self._released_slabs, slabs)
+            self._release_bytes(nbytes)
+            self.flush_condition.notify_all()
+        # Chunks may have been written while the flush was in flight.
+        self._flush_buffer()
+
+    def _release_bytes(self, nbytes):
+        # Called with the lock held
+        if nbytes > self._released_bytes:
+            BUFFERED_BYTES.dec(nbytes - self._released_bytes)
+            self._released_bytes = nbytes
+
+    def on_finish(self):
+        super().on_finish()
+        # The end of the archive is not followed by a flush callback
+        with self.lock:
+            self._release_bytes(self._handed_bytes)
 
     @web.authenticated
     async def get(self, archive_path, include_body=False):
 
         # /directories/ requests must originate from the same site
         self.check_xsrf_cookie()
-        cm = self.contents_manager
+        await self.serve_archive(archive_path)
 
-        if await ensure_async(cm.is_hidden(archive_path)) and not cm.allow_hidden:
-            self.log.info("Refusing to serve hidden file, via 404 Error")
-            raise web.HTTPError(404)
+    @web.authenticated
+    async def post(self, archive_path):
+        # The body is the manifest of a previous download: only the changes are archived
+        try:
+            previous = load_manifest(self.request.body)
+        except ValueError as error:
+            raise web.HTTPError(400, reason="Invalid manifest: {}".format(error))
+        await self.serve_archive(archive_path, previous)
 
-        archive_token = self.get_argument("archiveToken")
+    async def get_archive_options(self, archive_path):
+        """Return the archive options of the query arguments.
+
+        They are the archive format, whether to follow the symlinks and to
+        archive the hidden files, the compression level, the adaptive
+        compression, and the selected ``path`` and ``include`` and
+        ``exclude`` patterns.
+        """
+        cm = self.contents_manager
         archive_format = self.get_argument("archiveFormat", "zip")
         if archive_format not in SUPPORTED_FORMAT:
             self.log.error("Unsupported format {}.".format(archive_format))
             raise web.HTTPError(404)
+        compression = OPTIONAL_FORMAT.get(archive_format)
+        if compression is not None and not is_available(compression):
+            self.log.error("Format {} requires a library that is not installed.".format(archive_format))
+            raise web.HTTPError(400, reason="The {} format is not available on the server".format(archive_format))
         # Because urls can only pass strings, must check if string value is true
         # or false. If it is not either value, then it is an invalid argument
         # and raise http error 400.
@@ -147,112 +583,763 @@ class DownloadArchiveHandler(JupyterHandler):
             download_hidden = False
         else:
             raise web.HTTPError(400)
+        try:
+            compression_level = int(self.get_argument("compressionLevel", self.compression_level))
+        except ValueError:
+            raise web.HTTPError(400)
+        if not -1 <= compression_level <= 9:
+            raise web.HTTPError(400)
+        adaptive_default = "true" if self.adaptive_compression else "false"
+        if self.get_argument("adaptiveCompression", adaptive_default) == "true":
+            adaptive_compression = True
+        elif self.get_argument("adaptiveCompression", adaptive_default) == "false":
+            adaptive_compression = False
+        else:
+            raise web.HTTPError(400)
+
+        # Optional selection of files and directories of the folder, archived together
+        paths = self.get_arguments("path")
+        for path in paths:
+            parts = pathlib.PurePosixPath(path.replace("\\", "/")).parts
+            if not parts or parts[0] == "/" or ".." in parts:
+                raise web.HTTPError(400, reason="Invalid path {}".format(path))
+            path = url_path_join(archive_path, path)
+            if await ensure_async(cm.is_hidden(path)) and not cm.allow_hidden:
+                self.log.info("Refusing to serve hidden file, via 404 Error")
+                raise web.HTTPError(404)
+            if is_local(cm):
+                exists = (pathlib.Path(cm.root_dir) / url2path(path)).exists()
+            else:
+                exists = await ensure_async(cm.exists(path))
+            if not exists:
+                raise web.HTTPError(404, reason="No such file or directory: {}".format(path))
+        include = self.get_arguments("include")
+        exclude = self.get_arguments("exclude")
+        return (
+            archive_format,
+            follow_symlinks,
+            download_hidden,
+            compression_level,
+            adaptive_compression,
+            paths,
+            include,
+            exclude,
+        )
+
+    async def serve_archive(self, archive_path, previous=None):
+        """Reply with the archive of ``archive_path``.
 
+        With the ``previous`` manifest entries or the ``since`` query
+        argument, only the new and changed files are archived; see
+        :class:`~jupyter_archive.manifest.Manifest`.
+        """
+        cm = self.contents_manager
+
+        if await ensure_async(cm.is_hidden(archive_path)) and not cm.allow_hidden:
+            self.log.info("Refusing to serve hidden file, via 404 Error")
+            raise web.HTTPError(404)
+
+        archive_token = self.get_argument("archiveToken")
+        (
+            archive_format,
+            follow_symlinks,
+            download_hidden,
+            compression_level,
+            adaptive_compression,
+            paths,
+            include,
+            exclude,
+        ) = await self.get_archive_options(archive_path)
+        since = self.get_argument("since", None)
+        if since is not None:
+            try:
+                since = float(since)
+            except ValueError:
+                raise web.HTTPError(400)
+
+        # The API path of the folder if its files are only reachable through the contents manager
+        self.contents_path = None if is_local(cm) else archive_path.strip("/")
         archive_path = pathlib.Path(cm.root_dir) / url2path(archive_path)
         archive_filename = f"{archive_path.name}.{archive_format}"
+        format_name = archive_format_name(pathlib.PurePath(archive_filename))
         archive_filename = quote(archive_filename)
 
+        # The job is pending until a worker of the download pool runs it
+        self.job = start_job(self, "download", archive_path, status="pending", archive_format=format_name)
+        if self.job is None:
+            return
+
         self.log.info("Prepare {} for archiving and downloading.".format(archive_filename))
         self.set_header("content-type", "application/octet-stream")
         self.set_header("cache-control", "no-cache")
         self.set_header("content-disposition", "attachment; filename={}".format(archive_filename))
 
         self.canceled = False
-        self.flush_cb = ioloop.PeriodicCallback(self.flush, self.archive_download_flush_delay)
-        self.flush_cb.start()
+        self.flush_condition = threading.Condition(self.lock)
+        self._loop = ioloop.IOLoop.current()
+        self._flush_requested = False
+        self._flush_future = None
 
         try:
-            args = (
+            await self.download_archive(
                 archive_path,
+                archive_filename,
                 archive_format,
                 archive_token,
                 follow_symlinks,
                 download_hidden,
+                compression_level,
+                adaptive_compression,
+                paths,
+                include,
+                exclude,
+                since,
+                previous,
             )
-            await ioloop.IOLoop.current().run_in_executor(None, self.archive_and_download, *args)
-
+        except BaseException as error:
             if self.canceled:
-                self.log.info("Download canceled.")
+                self.job.finish("canceled")
+            else:
+                self.job.finish("failed", str(error))
+            raise
+        self.job.finish("canceled" if self.canceled else "finished")
+
+    async def download_archive(
+        self,
+        archive_path,
+        archive_filename,
+        archive_format,
+        archive_token,
+        follow_symlinks,
+        download_hidden,
+        compression_level,
+        adaptive_compression,
+        paths=(),
+        include=(),
+        exclude=(),
+        since=None,
+        previous=None,
+    ):
+        # Archive on a dedicated pool to leave the default executor to the kernels and contents
+        executor = self.download_executor
+        archive_and_download = profiled(self.archive_and_download, self.profile_dir, "download")
+        # Pre-walk the directory to report the progress against its total size; the
+        # stat results are reused for the archive members. Like zipfile and tarfile,
+        # zip archives store the targets of the symlinks and tar archives the links.
+        # A selection of paths is archived relative to the directory instead.
+        scan_args = (
+            follow_symlinks,
+            download_hidden,
+            archive_format == "zip",
+            self.scan_executor,
+            self.scan_prefetch,
+            PathFilter(archive_path, include, exclude),
+        )
+        if self.contents_path is not None:
+            self.job.run()
+            files = await self.walk_contents(paths, download_hidden, scan_args[-1])
+        else:
+            if paths:
+                scan_args = (scan_paths, archive_path, paths, *scan_args)
             else:
-                # Here, we need to flush forcibly to move all data from _write_buffer to stream._write_buffer
-                self.flush(force=True)
-                self.log.info("Finished downloading {}.".format(archive_filename))
+                scan_args = (scan_files, archive_path, *scan_args)
+            files = await self._loop.run_in_executor(executor, self.run_scan, *scan_args)
+
+        manifest = None
+        if since is not None or previous is not None:
+            # Delta archive with a manifest of the folder, at its root
+            manifest_arcname = MANIFEST_NAME if paths else "{}/{}".format(archive_path.name, MANIFEST_NAME)
+            manifest = Manifest(manifest_arcname, since)
+            files = await self._loop.run_in_executor(executor, manifest.select, files, previous)
+        self.job.set_total(len(files), sum(st.st_size for *_, st in files))
+
+        # Delta archives depend on the client manifest, they are not cached
+        cache = self.archive_cache if manifest is None else None
+        cache_entry = None
+        if cache is not None:
+            # The archive is the same as long as the files and options are
+            fingerprint = await self._loop.run_in_executor(executor, cache_fingerprint, files)
+            cache_key = cache.key(
+                str(archive_path),
+                archive_format,
+                follow_symlinks,
+                download_hidden,
+                compression_level,
+                adaptive_compression,
+                self.compression_workers,
+                paths,
+                include,
+                exclude,
+                fingerprint,
+            )
+            # Archives are reproducible, so the key identifies their bytes
+            etag = '"{}"'.format(cache_key)
+            self.set_header("Etag", etag)
+            self.set_header("Accept-Ranges", "bytes")
+            request_range = self.get_request_range(etag)
+
+            args = (
+                files,
+                archive_format,
+                compression_level,
+                adaptive_compression,
+            )
+            cached_path = cache.get(cache_key)
+            if cached_path is None and request_range is not None:
+                # Resuming a download: build the whole archive before sending the requested bytes
+                self.log.info("Prepare {} in the archive cache.".format(archive_filename))
+                cache_entry = cache.open(cache_key)
+                try:
+                    await self._loop.run_in_executor(executor, archive_and_download, *args, None, cache_entry)
+                    cache_entry.close()
+                    if self.canceled:
+                        # The archive is incomplete
+                        self.log.info("Download canceled.")
+                        cache_entry.discard()
+                        return
+                    await self.send_cached_archive(cache_entry.temporary_path, request_range, archive_token)
+                except Exception:
+                    cache_entry.discard()
+                    raise
+                await self.commit_cache_entry(cache_entry)
+                self.finish()
+                return
+            if cached_path is not None:
+                self.log.info("Serving {} from the archive cache.".format(archive_filename))
+                self.job.advance(len(files), self.job.bytes_total)
+                await self.send_cached_archive(cached_path, request_range, archive_token)
+                self.finish()
+                return
+            cache_entry = cache.open(cache_key)
+
+        members = None
+        if archive_format == "zip" and compression_level == 0 and manifest is None and self.contents_path is None:
+            # Stored files keep their size: the archive size is known from a stat walk
+            members = await self._loop.run_in_executor(executor, zip_members, files)
+            self.set_header("Content-Length", stored_size(members))
+
+        args = (
+            files,
+            archive_format,
+            compression_level,
+            adaptive_compression,
+            cache_entry,
+            None,
+            members,
+            manifest,
+        )
+        try:
+            await self._loop.run_in_executor(executor, archive_and_download, *args)
         except Exception:
+            if cache_entry is not None:
+                cache_entry.discard()
             raise
-        finally:
-            self.flush_cb.stop()
+
+        if self.canceled:
+            self.log.info("Download canceled.")
+            if cache_entry is not None:
+                cache_entry.discard()
+        else:
+            # Here, we need to flush forcibly to move all data from _write_buffer to stream._write_buffer
+            self.flush(force=True)
+            if cache_entry is not None:
+                await self.commit_cache_entry(cache_entry)
+            self.log.info("Finished downloading {}.".format(archive_filename))
 
         self.set_cookie("archiveToken", archive_token)
         self.finish()
 
+    async def commit_cache_entry(self, cache_entry):
+        """Move the archive sent into the cache.
+
+        The job ends first: with a Content-Length, the client has the whole
+        response and may reuse its ``archiveToken`` before the commit is done.
+        """
+        self.job.finish()
+        await self._loop.run_in_executor(self.download_executor, cache_entry.commit)
+
+    async def walk_contents(self, paths, download_hidden, path_filter):
+        """List the files to archive through the contents manager, like `scan_files` or `scan_paths`."""
+        cm = self.contents_manager
+        root = str(pathlib.Path(cm.root_dir))
+        if not paths:
+            # The archive members are relative to the parent of the folder
+            self.contents_root = self.contents_path.rpartition("/")[0]
+            return await walk_contents(cm, self.contents_path, self.contents_root, download_hidden, path_filter, root)
+        self.contents_root = self.contents_path
+        files = []
+        seen = set()
+        for path in paths:
+            path = url_path_join(self.contents_path, path.replace("\\", "/")).strip("/")
+            for file_ in await walk_contents(cm, path, self.contents_root, download_hidden, path_filter, root):
+                if file_[1] not in seen:
+                    seen.add(file_[1])
+                    files.append(file_)
+        return files
+
+    def run_scan(self, scan, *args):
+        """Run the job and list the files to archive with ``scan``, once a worker of the download pool is free."""
+        self.job.run()
+        return scan(*args)
+
+    def get_request_range(self, etag):
+        """Parse the Range header into ``(start, end)``; ``end`` is excluded and
+        a negative ``start`` counts from the end.
+
+        Return None if there is no valid single range or if the If-Range
+        header does not match ``etag``.
+        """
+        range_header = self.request.headers.get("Range")
+        if_range = self.request.headers.get("If-Range")
+        if not range_header or (if_range is not None and if_range != etag):
+            return None
+        unit, _, value = range_header.partition("=")
+        start, sep, end = value.strip().partition("-")
+        if unit.strip() != "bytes" or not sep or "," in value:
+            return None
+        try:
+            if not start:
+                # Suffix range: the last `end` bytes; none cannot be satisfied
+                length = int(end)
+                return (-length, None) if length > 0 else (0, 0)
+            return int(start), int(end) + 1 if end else None
+        except ValueError:
+            return None
+
+    async def send_cached_archive(self, path, request_range=None, archive_token=None):
+        # Like tornado's StaticFileHandler, send the file in large chunks
+        # waiting for each one to reach the socket. The archiveToken cookie
+        # is set with the headers, sent by the first flush.
+        size = os.path.getsize(path)
+        start, end = 0, size
+        if request_range is not None:
+            start, end = request_range
+            if start < 0:
+                start = max(0, size + start)
+            end = size if end is None else min(end, size)
+            if start >= end:
+                self.set_status(416)  # Range Not Satisfiable
+                self.set_header("Content-Range", "bytes */{}".format(size))
+                self.clear_header("Content-Disposition")
+                return
+            if end - start != size:
+                self.set_status(206)  # Partial Content
+                self.set_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, size))
+        self.set_header("Content-Length", end - start)
+        if archive_token is not None:
+            self.set_cookie("archiveToken", archive_token)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0 and not self.canceled:
+                chunk = f.read(min(CACHE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self.write(chunk)
+                self.job.metrics.sent(len(chunk))
+                try:
+                    await self.flush(force=True)
+                except iostream.StreamClosedError:
+                    self.canceled = True
+
     def archive_and_download(
         self,
-        archive_path,
+        files,
         archive_format,
-        archive_token,
-        follow_symlinks,
-        download_hidden,
+        compression_level=-1,
+        adaptive_compression=False,
+        cache_entry=None,
+        fileobj=None,
+        members=None,
+        manifest=None,
     ):
+        """Write the archive of the ``(filename, arcname, stat)`` listed by `scan_files`.
 
-        with make_writer(self, archive_format) as archive:
-            prefix = len(str(archive_path.parent)) + len(os.path.sep)
-            for root, dirs, files in os.walk(archive_path, followlinks=follow_symlinks):
-                # This ensures that if download_hidden is false, then the
-                # hidden files are skipped when walking the directory.
-                if not download_hidden:
-                    files = [f for f in files if not f[0] == "."]
-                    dirs[:] = [d for d in dirs if not d[0] == "."]
-                for file_ in files:
-                    file_name = os.path.join(root, file_)
-                    if not self.canceled:
-                        self.log.debug("{}\n".format(file_name))
-                        archive.add(file_name, os.path.join(root[prefix:], file_))
+        ``members`` are the zip members made beforehand by `zip_members`. The
+        files are hashed while they are archived into ``manifest``, a
+        :class:`~jupyter_archive.manifest.Manifest` added at the end.
+        """
+        if self.contents_path is not None:
+            contents = ContentsReader(
+                files,
+                self.contents_manager,
+                self.contents_root,
+                self._loop.asyncio_loop,
+                self.read_ahead_size,
+                self.contents_prefetch,
+            )
+        else:
+            # Tar archives store the hard links once, their content is not read again
+            contents = iter_contents(
+                files, self.read_executor, self.read_ahead_size, hardlinks=archive_format != "zip"
+            )
+        stream = fileobj if fileobj is not None else ArchiveStream(self, cache_entry)
+        with closing(contents), make_writer(
+            self, archive_format, compression_level, adaptive_compression, fileobj=stream
+        ) as archive:
+            for index, (file_name, arcname, st, content) in enumerate(contents):
+                if self.canceled:
+                    break
+                self.log.debug("{}\n".format(file_name))
+                reader = None
+                if manifest is not None and stat.S_ISREG(st.st_mode):
+                    reader = content = HashingReader(content if content is not None else open(file_name, "rb"))
+                try:
+                    if members is not None:
+                        archive.add(file_name, zinfo=members[index], fileobj=content, fixed_size=True)
                     else:
-                        break
+                        add_file(archive, file_name, arcname, st, content)
+                finally:
+                    if reader is not None:
+                        reader.close()
+                if reader is not None and reader.size == st.st_size:
+                    manifest.files[manifest.key(arcname)]["hash"] = reader.hexdigest()
+                self.job.advance(1, st.st_size)
+            if manifest is not None and not self.canceled:
+                add_bytes(archive, manifest.arcname, manifest.dumps())
+        if not self.canceled:
+            # Hand the end of the archive to the IOLoop
+            stream.flush()
 
     def on_connection_close(self):
         super().on_connection_close()
         self.canceled = True
-        self.flush_cb.stop()
+        if self.flush_condition is not None:
+            with self.flush_condition:
+                self.flush_condition.notify_all()
+
+
+class CompressArchiveHandler(DownloadArchiveHandler):
+    """Archive a folder into a file on the server, next to it, in the background.
+
+    It takes the query arguments of ``/directories/``; the archive is written
+    by the download pool to a temporary file renamed once complete.
+    """
+
+    SUPPORTED_METHODS = ("POST",)
+
+    @property
+    def canceled(self):
+        # The job goes on once the request is answered; it is canceled through /archive-jobs/
+        return self.job.cancel_requested
+
+    def on_connection_close(self):
+        super(DownloadArchiveHandler, self).on_connection_close()
+
+    @web.authenticated
+    async def post(self, archive_path):
+        """Start archiving the folder and reply with the job; see ArchiveJobsHandler.
+
+        The archive is ``<folder>.<archiveFormat>`` in the parent folder
+        unless set by the ``name`` and ``destination`` query arguments.
+        """
+        cm = self.contents_manager
+        if not is_local(cm):
+            raise web.HTTPError(400, reason="The archives can only be written to a local file system")
+        folder = await get_archive_path(self, archive_path)
+        if not folder.exists():
+            raise web.HTTPError(404, reason="No such file or directory: {}".format(archive_path))
+        if not folder.is_dir():
+            raise web.HTTPError(400, reason="Not a directory: {}".format(archive_path))
+        options = await self.get_archive_options(archive_path)
+        archive_format = options[0]
+
+        destination = self.get_argument("destination", None)
+        if destination is None:
+            destination = folder.parent
+        else:
+            parts = pathlib.PurePosixPath(destination.replace("\\", "/")).parts
+            if parts[:1] == ("/",) or ".." in parts:
+                raise web.HTTPError(400, reason="Invalid destination {}".format(destination))
+            destination = await get_archive_path(self, destination)
+            if not destination.is_dir():
+                raise web.HTTPError(404, reason="No such directory: {}".format(self.get_argument("destination")))
+        name = self.get_argument("name", f"{folder.name}.{archive_format}")
+        if name in ("", ".", "..") or "/" in name or "\\" in name:
+            raise web.HTTPError(400, reason="Invalid name {}".format(name))
+        target = destination / name
+        if target.exists():
+            raise web.HTTPError(409, reason="The file {} already exists".format(name))
+
+        self.job = start_job(self, "compress", folder, "pending", archive_format_name(pathlib.PurePath(name)))
+        if self.job is None:
+            return
+        self.contents_path = None
+        self._loop = ioloop.IOLoop.current()
+        self.download_executor.submit(self.run_job, folder, target, *options)
+
+        self.set_status(202)
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Location", url_path_join(self.base_url, "archive-jobs", self.job.id))
+        reply = self.job.to_dict()
+        reply["archive"] = target.relative_to(cm.root_dir).as_posix()
+        self.finish(json.dumps(reply))
+
+    def run_job(
+        self,
+        folder,
+        target,
+        archive_format,
+        follow_symlinks,
+        download_hidden,
+        compression_level,
+        adaptive_compression,
+        paths,
+        include,
+        exclude,
+    ):
+        """Run the job archiving ``folder`` into the file ``target``; nothing is left if it fails or is canceled."""
+        job = self.job
+        if job.cancel_requested:
+            job.finish("canceled")
+            return
+        job.run()
+        self.log.info("Begin archiving {} to {}.".format(folder, target))
+        scan_args = (
+            follow_symlinks,
+            download_hidden,
+            archive_format == "zip",
+            self.scan_executor,
+            self.scan_prefetch,
+            PathFilter(folder, include, exclude),
+        )
+        temporary_path = None
+        try:
+            if paths:
+                files = scan_paths(folder, paths, *scan_args)
+            else:
+                files = scan_files(folder, *scan_args)
+            job.set_total(len(files), sum(st.st_size for *_, st in files))
+            # Hidden from the file browser until it is renamed; created after the
+            # scan so that an archive written into the folder does not contain itself.
+            fd, temporary_path = tempfile.mkstemp(prefix=".{}-".format(target.name), suffix=".part", dir=target.parent)
+            os.chmod(temporary_path, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                archive_and_download = profiled(self.archive_and_download, self.profile_dir, "compress")
+                archive_and_download(files, archive_format, compression_level, adaptive_compression, fileobj=f)
+                if not job.cancel_requested:
+                    os.fsync(f.fileno())
+            if not job.cancel_requested:
+                job.bytes_written = os.path.getsize(temporary_path)
+                # The target may have been created since the request was accepted
+                rename_exclusive(temporary_path, target)
+        except BaseException as error:
+            self.log.error("Archiving {} to {} failed.".format(folder, target), exc_info=True)
+            if temporary_path is not None and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            job.finish("failed", str(error))
+            raise
+        if job.cancel_requested:
+            self.log.info("Archiving {} canceled.".format(folder))
+            os.remove(temporary_path)
+            job.finish("canceled")
+        else:
+            self.log.info("Finished archiving {} to {}.".format(folder, target))
+            job.metrics.bytes_out.inc(job.bytes_written)
+            job.finish()
 
 
 class ExtractArchiveHandler(JupyterHandler):
+    @property
+    def extraction_workers(self):
+        return self.settings["jupyter_archive"].extraction_workers
+
+    @property
+    def extraction_executor(self):
+        return self.settings["jupyter_archive"].get_extraction_executor()
+
+    @property
+    def max_extraction_size(self):
+        return self.settings["jupyter_archive"].max_extraction_size
+
+    @property
+    def max_extraction_members(self):
+        return self.settings["jupyter_archive"].max_extraction_members
+
+    @property
+    def max_compression_ratio(self):
+        return self.settings["jupyter_archive"].max_compression_ratio
+
+    @property
+    def contents_prefetch(self):
+        return self.settings["jupyter_archive"].contents_prefetch
+
+    @property
+    def profile_dir(self):
+        return self.settings["jupyter_archive"].profile_dir
+
+    @property
+    def extraction_job_executor(self):
+        return self.settings["jupyter_archive"].get_extraction_job_executor()
+
+    @property
+    def index_cache(self):
+        return self.settings["jupyter_archive"].get_index_cache()
+
+    async def get_archive_path(self, archive_path):
+        return await get_archive_path(self, archive_path)
+
+    async def get_extraction_options(self):
+        """Return the ``member`` names to extract, the ``destination`` directory and whether it is ``incremental``.
+
+        The names and the destination are None if not given.
+        """
+        names = self.get_arguments("member") or None
+        if self.get_argument("incremental", "false") == "true":
+            incremental = True
+        elif self.get_argument("incremental", "false") == "false":
+            incremental = False
+        else:
+            raise web.HTTPError(400)
+        if incremental and not is_local(self.contents_manager):
+            raise web.HTTPError(400, reason="Incremental extraction needs the files on the local file system")
+        destination = self.get_argument("destination", None)
+        if destination is not None:
+            parts = pathlib.PurePosixPath(destination.replace("\\", "/")).parts
+            if parts[:1] == ("/",) or ".." in parts:
+                raise web.HTTPError(400, reason="Invalid destination {}".format(destination))
+            destination = await get_archive_path(self, destination)
+            if is_local(self.contents_manager):
+                exists = destination.is_dir()
+            else:
+                exists = await ensure_async(self.contents_manager.dir_exists(api_path(destination)))
+            if not exists:
+                raise web.HTTPError(404, reason="No such directory: {}".format(self.get_argument("destination")))
+        return names, destination, incremental
+
     @web.authenticated
     async def get(self, archive_path, include_body=False):
 
         # /extract-archive/ requests must originate from the same site
         self.check_xsrf_cookie()
-        cm = self.contents_manager
+        archive_path = await self.get_archive_path(archive_path)
+        names, destination, incremental = await self.get_extraction_options()
 
-        if await ensure_async(cm.is_hidden(archive_path)) and not cm.allow_hidden:
-            self.log.info("Refusing to serve hidden file, via 404 Error")
-            raise web.HTTPError(404)
+        self._loop = ioloop.IOLoop.current()
+        # The optional token lets the client follow the extraction on /archive-jobs/
+        job = start_job(self, "extract", archive_path, "pending", archive_format_name(archive_path))
+        if job is None:
+            return
+        await ioloop.IOLoop.current().run_in_executor(
+            self.extraction_job_executor, self.run_job, archive_path, job, names, destination, incremental
+        )
+        if job.status == "canceled":
+            raise web.HTTPError(409, reason="The extraction was canceled")
 
-        archive_path = pathlib.Path(cm.root_dir) / url2path(archive_path)
+        self.finish()
 
-        await ioloop.IOLoop.current().run_in_executor(None, self.extract_archive, archive_path)
+    @web.authenticated
+    async def post(self, archive_path):
+        """Start the extraction in the background and reply with its job; see ArchiveJobsHandler."""
+        archive_path = await self.get_archive_path(archive_path)
+        names, destination, incremental = await self.get_extraction_options()
 
-        self.finish()
+        self._loop = ioloop.IOLoop.current()
+        job = start_job(self, "extract", archive_path, "pending", archive_format_name(archive_path))
+        if job is None:
+            return
+        self.extraction_job_executor.submit(self.run_job, archive_path, job, names, destination, incremental)
+
+        self.set_status(202)
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Location", url_path_join(self.base_url, "archive-jobs", job.id))
+        self.finish(json.dumps(job.to_dict()))
+
+    def run_job(self, archive_path, job, names=None, destination=None, incremental=False):
+        """Run the extraction ``job``; its output is removed if it fails or is canceled."""
+        if job.cancel_requested:
+            job.finish("canceled")
+            return
+        job.run()
+        if is_local(self.contents_manager):
+            created = CreatedPaths(destination or archive_path.parent)
+        else:
+            created = CreatedContents(self.contents_manager, self._loop.asyncio_loop)
+        try:
+            extract_archive = profiled(self.extract_archive, self.profile_dir, "extract")
+            archive_size = extract_archive(archive_path, job, created, names, destination, incremental)
+        except BaseException as error:
+            self.log.error("Extraction of {} failed, removing its output.".format(archive_path), exc_info=True)
+            created.rollback()
+            job.finish("failed", error.reason if isinstance(error, web.HTTPError) else str(error))
+            raise
+        if job.cancel_requested:
+            self.log.info("Extraction of {} canceled, removing its output.".format(archive_path))
+            created.rollback()
+            job.finish("canceled")
+        else:
+            job.metrics.bytes_in.inc(archive_size)
+            job.finish()
+
+    def extraction_quota(self, archive_size, free_space=None):
+        return ExtractionQuota(
+            archive_size, self.max_extraction_size, self.max_extraction_members, self.max_compression_ratio, free_space
+        )
 
-    def extract_archive(self, archive_path):
+    def extract_archive(self, archive_path, job=None, created=None, names=None, destination=None, incremental=False):
+        """Extract the archive, or its members selected by ``names``, next to it or into ``destination``.
 
-        archive_destination = archive_path.parent
+        With ``incremental``, the files which did not change are skipped; see
+        :func:`~jupyter_archive.extract.extract_incremental`. Return the size
+        of the archive.
+        """
+
+        archive_destination = destination or archive_path.parent
         self.log.info("Begin extraction of {} to {}.".format(archive_path, archive_destination))
 
+        workers = self.extraction_workers
         try:
-            with make_reader(archive_path) as archive:
-                if isinstance(archive, tarfile.TarFile):
-                    # The "data" filter rejects unsafe members (absolute paths,
-                    # path traversal and symlinks/hardlinks escaping the destination).
-                    # See https://docs.python.org/3/library/tarfile.html#extraction-filters
-                    archive.extractall(archive_destination, filter="data")
+            compression = archive_compression(archive_path)
+            if not is_local(self.contents_manager):
+                archive_size = self.extract_contents(archive_path, job, created, names, archive_destination)
+            else:
+                archive_size = os.path.getsize(archive_path)
+                quota = self.extraction_quota(archive_size, shutil.disk_usage(archive_destination).free)
+                if incremental:
+                    with make_reader(archive_path) as archive:
+                        extract_incremental(archive, archive_destination, job, created, names, quota)
+                elif compression == "zip":
+                    extract_zip(
+                        archive_path, archive_destination, self.extraction_executor, workers, job, created, names, quota
+                    )
+                elif names is not None:
+                    # Only the selected members are decompressed, from the index of the archive
+                    index = tar_index(archive_path, compression, self.index_cache)
+                    extract_tar_members(archive_path, index, names, archive_destination, job, created, quota)
                 else:
-                    archive.extractall(archive_destination)
+                    with make_reader(archive_path) as archive:
+                        # The "data" filter rejects unsafe members (absolute paths,
+                        # path traversal and symlinks/hardlinks escaping the destination).
+                        # See https://docs.python.org/3/library/tarfile.html#extraction-filters
+                        extract_tar(archive, archive_destination, workers > 1, job, created, quota)
         except tarfile.FilterError as error:
             self.log.error("The archive file includes an unsafe member: %s", error.tarinfo.name)
             raise web.HTTPError(400, reason="The archive file includes an unsafe member")
+        except KeyError as error:
+            raise web.HTTPError(404, reason="No such member: {}".format(error.args[0]))
+        except ExtractionLimitError as error:
+            self.log.error("Extraction of {} stopped: {}".format(archive_path, error))
+            raise web.HTTPError(400, reason=str(error))
 
         self.log.info("Finished extracting {} to {}.".format(archive_path, archive_destination))
+        return archive_size
+
+    def extract_contents(self, archive_path, job, created, names, destination):
+        """Extract an archive through the contents manager, which does not store the files locally.
+
+        The archive is fetched to a temporary file and its members are saved
+        by batches of ``contents_prefetch`` files. Return the size of the archive.
+        """
+        loop = self._loop.asyncio_loop
+        with ContentsArchive(self.contents_manager, api_path(archive_path), loop) as archive_file:
+            archive_size = os.path.getsize(archive_file.local_path)
+            writer = ContentsWriter(self.contents_manager, loop, self.contents_prefetch, created)
+            with make_reader(pathlib.Path(archive_file.local_path)) as archive:
+                quota = self.extraction_quota(archive_size)
+                extract_contents(archive, writer, api_path(destination), job, names, quota)
+        return archive_size
 
     def write_error(self, status_code, **kwargs):
         # Return error response as JSON
@@ -275,12 +1362,99 @@ class ExtractArchiveHandler(JupyterHandler):
         self.finish(json.dumps(reply))
 
 
+class ArchiveContentsHandler(JupyterHandler):
+    """List the members of an archive without extracting it."""
+
+    @property
+    def index_cache(self):
+        return self.settings["jupyter_archive"].get_index_cache()
+
+    @property
+    def extraction_job_executor(self):
+        return self.settings["jupyter_archive"].get_extraction_job_executor()
+
+    @web.authenticated
+    async def get(self, archive_path):
+        cm = self.contents_manager
+        archive_path = await get_archive_path(self, archive_path)
+        if is_local(cm):
+            exists = archive_path.is_file()
+        else:
+            exists = await ensure_async(cm.file_exists(api_path(archive_path)))
+        if not exists:
+            raise web.HTTPError(404)
+        try:
+            compression = archive_compression(archive_path)
+        except ValueError as error:
+            raise web.HTTPError(400, reason=str(error))
+
+        loop = ioloop.IOLoop.current()
+        if is_local(cm):
+            function, args = list_members, (archive_path, compression, self.index_cache)
+        else:
+            function, args = self.list_contents_members, (archive_path, compression, loop.asyncio_loop)
+        try:
+            members = await loop.run_in_executor(self.extraction_job_executor, function, *args)
+        except (tarfile.TarError, zipfile.BadZipFile, OSError, EOFError, zlib.error) as error:
+            raise web.HTTPError(400, reason="Invalid archive: {}".format(error))
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(members))
+
+    def list_contents_members(self, archive_path, compression, loop):
+        # The archive is fetched through the contents manager; its index is not cached
+        with ContentsArchive(self.contents_manager, api_path(archive_path), loop) as archive_file:
+            return list_members(archive_file.local_path, compression)
+
+
+class ArchiveJobsHandler(JupyterHandler):
+    """Report the progress of the archive downloads, compressions and extractions of the user."""
+
+    @property
+    def job_registry(self):
+        return self.settings["jupyter_archive"].jobs
+
+    def get_job(self, job_id):
+        """Return the job ``job_id`` of the user, or raise 404."""
+        job = self.job_registry.get(job_id)
+        if job is None or job.user != job_user(self):
+            raise web.HTTPError(404, reason="Unknown job {}".format(job_id))
+        return job
+
+    @web.authenticated
+    def get(self, job_id=None):
+        self.set_header("Content-Type", "application/json")
+        self.set_header("cache-control", "no-cache")
+        if job_id:
+            self.finish(json.dumps(self.get_job(job_id).to_dict()))
+        else:
+            user = job_user(self)
+            self.finish(json.dumps([job.to_dict() for job in self.job_registry.list() if job.user == user]))
+
+    @web.authenticated
+    def delete(self, job_id=None):
+        """Cancel an extraction or a compression; downloads are canceled by closing their connection."""
+        if not job_id:
+            raise web.HTTPError(405)
+        job = self.get_job(job_id)
+        if job.kind not in ("extract", "compress"):
+            raise web.HTTPError(400, reason="Only the extractions and compressions can be canceled")
+        if job.status in ("pending", "running"):
+            job.cancel()
+            self.set_status(202)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(job.to_dict()))
+
+
 def setup_handlers(web_app):
     host_pattern = ".*$"
     base_url = web_app.settings["base_url"]
 
     handlers = [
         (url_path_join(base_url, r"/directories/(.*)"), DownloadArchiveHandler),
+        (url_path_join(base_url, r"/compress-archive/(.*)"), CompressArchiveHandler),
         (url_path_join(base_url, r"/extract-archive/(.*)"), ExtractArchiveHandler),
+        (url_path_join(base_url, r"/archive-contents/(.*)"), ArchiveContentsHandler),
+        (url_path_join(base_url, r"/archive-jobs/?"), ArchiveJobsHandler),
+        (url_path_join(base_url, r"/archive-jobs/([^/]+)"), ArchiveJobsHandler),
     ]
     web_app.add_handlers(host_pattern, handlers)
@@ -0,0 +1,440 @@
+import base64
+import bisect
+import gzip
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+
+from .tarstream import open_decompressed
+from .zipstream import DICT_SIZE
+
+INDEX_VERSION = 1
+# Decompressed bytes between two access points of a gzip archive: at most
+# this much data is decompressed in vain to read a member.
+CHECKPOINT_SPACING = 16 * 1024 * 1024
+# Decompressed bytes compared after an access point candidate before keeping it
+CHECK_SIZE = 64 * 1024
+
+_READ_SIZE = 1024 * 1024
+# Empty stored block ending a sync flush
+_SYNC_MARKER = b"\x00\x00\xff\xff"
+_FEXTRA = 4
+_FNAME = 8
+_FCOMMENT = 16
+_FHCRC = 2
+
+_TAR_TYPES = {
+    tarfile.REGTYPE: "file",
+    tarfile.AREGTYPE: "file",
+    tarfile.CONTTYPE: "file",
+    tarfile.DIRTYPE: "directory",
+    tarfile.SYMTYPE: "symlink",
+    tarfile.LNKTYPE: "link",
+}
+
+
+class _GzipStream:
+    """Decompressed data of a gzip file, from the access point ``checkpoint`` or its start.
+
+    An access point is an ``(offset, position, window)`` tuple: the offset of
+    a deflate block boundary in the file, the position of its data in the
+    decompressed stream and the 32 KiB decompressed before it. With
+    ``spacing``, the access points met every ``spacing`` decompressed bytes
+    are recorded in ``checkpoints``: the starts of the gzip members and the
+    ends of the sync flushes written between the blocks compressed in
+    parallel (by :class:`~jupyter_archive.tarstream.CompressedStream` or
+    pigz). A sync flush is found from its marker, which may also appear in
+    the compressed data: a candidate is kept once the data decompressed
+    from it matches the stream for ``CHECK_SIZE`` bytes.
+
+    Like :mod:`gzip`, the gzip members are read one after the other; the
+    CRC-32 of the data is not checked.
+    """
+
+    def __init__(self, fileobj, checkpoint=None, spacing=0):
+        offset, position, window = checkpoint if checkpoint is not None else (0, 0, None)
+        self._file = fileobj
+        self._file.seek(offset)
+        self._input = b""
+        self._input_offset = offset
+        self._spacing = spacing
+        self._trial = None
+        self._window = b""
+        self._buffer = bytearray()
+        self.checkpoints = []
+        self.position = position
+        self._output = self._iter_output(window)
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            chunk = next(self._output, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size is None or size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def _fill(self, size):
+        while len(self._input) < size:
+            data = self._file.read(_READ_SIZE)
+            if not data:
+                return False
+            self._input += data
+        return True
+
+    def _consume(self, size):
+        self._input = self._input[size:]
+        self._input_offset += size
+
+    def _unconsume(self, data):
+        self._input = data + self._input
+        self._input_offset -= len(data)
+
+    def _read_header(self):
+        # Skip the gzip member header; return False at the end of the file
+        while True:
+            if not self._fill(1):
+                return False
+            if self._input[0]:
+                break
+            # Like gzip, accept the zero padding after the last member
+            stripped = self._input.lstrip(b"\0")
+            self._consume(len(self._input) - len(stripped))
+        if not self._fill(10):
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        if self._input[:3] != b"\037\213\010":
+            raise gzip.BadGzipFile("Not a gzipped file ({!r})".format(self._input[:2]))
+        flags = self._input[3]
+        size = 10
+        if flags & _FEXTRA:
+            if not self._fill(size + 2):
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            size += 2 + int.from_bytes(self._input[size:size + 2], "little")
+        for flag in (_FNAME, _FCOMMENT):
+            if flags & flag:
+                while self._input.find(b"\0", size) < 0:
+                    if not self._fill(len(self._input) + 1):
+                        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                size = self._input.find(b"\0", size) + 1
+        if flags & _FHCRC:
+            size += 2
+        if not self._fill(size):
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        self._consume(size)
+        return True
+
+    def _iter_output(self, window):
+        # The window is None to start with a gzip header
+        while True:
+            if window is None:
+                if not self._read_header():
+                    return
+                window = b""
+                if self._spacing and (not self.checkpoints or self._is_due()):
+                    self.checkpoints.append((self._input_offset, self.position, b""))
+            if window:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=window)
+            else:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._window = window
+            window = None
+
+            while not decompressor.eof:
+                if not self._fill(1):
+                    raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                data = self._input
+                end = len(data)
+                if self._spacing:
+                    marker = data.find(_SYNC_MARKER)
+                    if marker >= 0:
+                        end = marker + len(_SYNC_MARKER)
+                self._consume(end)
+                tail = data[:end] if end < len(data) else data
+                while tail and not decompressor.eof:
+                    output = decompressor.decompress(tail, _READ_SIZE)
+                    if self._trial is not None:
+                        self._check_trial(tail, output, decompressor.eof)
+                    tail = decompressor.unconsumed_tail
+                    self.position += len(output)
+                    if self._spacing:
+                        if len(output) >= DICT_SIZE:
+                            self._window = output[-DICT_SIZE:]
+                        else:
+                            self._window = (self._window + output)[-DICT_SIZE:]
+                    if output:
+                        yield output
+                if decompressor.eof:
+                    self._unconsume(decompressor.unused_data)
+                elif end < len(data) and self._trial is None and self._is_due():
+                    # The end of a sync flush, unless the marker is part of the compressed data
+                    self._start_trial()
+
+            # CRC-32 and size of the member
+            if not self._fill(8):
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            self._consume(8)
+
+    def _is_due(self):
+        return self.position - self.checkpoints[-1][1] >= self._spacing
+
+    def _start_trial(self):
+        if self._window:
+            trial = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self._window)
+        else:
+            trial = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._trial = (trial, (self._input_offset, self.position, self._window), 0)
+
+    def _check_trial(self, data, output, eof):
+        # Decompress the same data from the candidate access point
+        trial, checkpoint, checked = self._trial
+        try:
+            trial_output = trial.decompress(data, _READ_SIZE)
+        except zlib.error:
+            self._trial = None
+            return
+        if trial_output != output:
+            self._trial = None
+            return
+        checked += len(output)
+        if checked >= CHECK_SIZE or eof:
+            self.checkpoints.append(checkpoint)
+            self._trial = None
+        else:
+            self._trial = (trial, checkpoint, checked)
+
+
+class IndexedReader:
+    """Seekable file object reading the decompressed data of a tar archive from its index.
+
+    A read after a seek decompresses the data from the last access point
+    of the index before the new position; without access points, i.e. for
+    other compressions than gzip, from the start of the file.
+    """
+
+    def __init__(self, path, index):
+        self._path = path
+        self._compression = index["compression"]
+        self._checkpoints = [
+            (offset, position, zlib.decompress(base64.b64decode(window)))
+            for offset, position, window in index["checkpoints"]
+        ]
+        self._positions = [position for _, position, _ in self._checkpoints]
+        self._file = open(path, "rb") if self._compression == "gz" else None
+        self._stream = None
+        self._stream_position = 0
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can only seek from the start or the current position")
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        self._move()
+        data = self._stream.read(size)
+        self._position += len(data)
+        self._stream_position += len(data)
+        return data
+
+    def close(self):
+        self._close_stream()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _close_stream(self):
+        if self._stream is not None and self._file is None:
+            self._stream.close()
+        self._stream = None
+
+    def _move(self):
+        # Decompress from the best access point up to the position
+        index = bisect.bisect_right(self._positions, self._position) - 1
+        checkpoint = self._checkpoints[index] if index >= 0 else None
+        start = checkpoint[1] if checkpoint is not None else 0
+        if self._stream is None or not start <= self._stream_position <= self._position:
+            self._close_stream()
+            if self._file is not None:
+                self._stream = _GzipStream(self._file, checkpoint)
+            else:
+                self._stream = open_decompressed(self._path, self._compression)
+                start = 0
+            self._stream_position = start
+        while self._stream_position < self._position:
+            skipped = len(self._stream.read(min(_READ_SIZE, self._position - self._stream_position)))
+            if not skipped:
+                break
+            self._stream_position += skipped
+
+
+def _tar_entry(tarinfo):
+    return {
+        "name": tarinfo.name,
+        "type": _TAR_TYPES.get(tarinfo.type, "other"),
+        "size": tarinfo.size if tarinfo.isreg() else 0,
+        "mtime": tarinfo.mtime,
+        "linkname": tarinfo.linkname,
+        "offset": tarinfo.offset,
+    }
+
+
+def build_tar_index(path, compression):
+    """Index the members of a tar archive compressed with ``compression``.
+
+    The archive is decompressed once to list the members with the offset of
+    their header in the decompressed stream; gzip archives also get access
+    points, see :class:`_GzipStream`.
+    """
+    if compression == "gz":
+        with open(path, "rb") as f:
+            stream = _GzipStream(f, spacing=CHECKPOINT_SPACING)
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                members = [_tar_entry(tarinfo) for tarinfo in archive]
+        checkpoints = [
+            [offset, position, base64.b64encode(zlib.compress(window)).decode("ascii")]
+            for offset, position, window in stream.checkpoints
+        ]
+    else:
+        with open_decompressed(path, compression) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                members = [_tar_entry(tarinfo) for tarinfo in archive]
+        checkpoints = []
+    return {"version": INDEX_VERSION, "compression": compression, "members": members, "checkpoints": checkpoints}
+
+
+def tar_index(path, compression, cache=None):
+    """Return the index of a tar archive, from ``cache`` if it was built before.
+
+    ``cache`` is an :class:`~jupyter_archive.cache.ArchiveCache`; the index
+    is built again when the archive changes.
+    """
+    if cache is None:
+        return build_tar_index(path, compression)
+    st = os.stat(path)
+    key = cache.key(INDEX_VERSION, str(path), compression, st.st_size, st.st_mtime_ns, st.st_ino)
+    cached = cache.get(key)
+    if cached is not None:
+        try:
+            with open(cached, "rb") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    index = build_tar_index(path, compression)
+    entry = cache.open(key)
+    try:
+        entry.write(json.dumps(index).encode("utf-8"))
+        entry.commit()
+    except BaseException:
+        entry.discard()
+        raise
+    return index
+
+
+def _zip_entry(zinfo):
+    return {
+        "name": zinfo.filename,
+        "type": "directory" if zinfo.is_dir() else "file",
+        "size": zinfo.file_size,
+        "compressed_size": zinfo.compress_size,
+        "mtime": time.mktime(zinfo.date_time + (0, 0, -1)),
+    }
+
+
+def list_members(path, compression, cache=None):
+    """List the members of an archive with their name, type, size, compressed size and mtime.
+
+    Zip archives are listed from their central directory; tar archives
+    from their index (see :func:`tar_index`), without a compressed size.
+    """
+    if compression == "zip":
+        with zipfile.ZipFile(path) as archive:
+            return [_zip_entry(zinfo) for zinfo in archive.infolist()]
+    members = []
+    for entry in tar_index(path, compression, cache)["members"]:
+        members.append({
+            "name": entry["name"],
+            "type": entry["type"],
+            "size": entry["size"],
+            "compressed_size": None,
+            "mtime": entry["mtime"],
+        })
+    return members
+
+
+def read_member(archive, offset):
+    """Read the member of the tar ``archive`` whose header is at ``offset``, as in the index."""
+    archive.fileobj.seek(offset)
+    return archive.tarinfo.fromtarfile(archive)
+
+
+def select_members(names, selection):
+    """Return the set of the ``names`` of archive members in ``selection``.
+
+    A selected directory brings its content; a KeyError is raised for a
+    selected name which is not in the archive.
+    """
+    selected = set()
+    for item in selection:
+        item = item.rstrip("/")
+        prefix = item + "/"
+        matches = [name for name in names if name.rstrip("/") == item or name.startswith(prefix)]
+        if not matches:
+            raise KeyError(item)
+        selected.update(matches)
+    return selected
+
+
+class MemberSelection:
+    """Members of an archive in ``selection``, matched while iterating over them.
+
+    It selects the same members as :func:`select_members`, for the tar
+    archives read in streaming mode which cannot list their members
+    beforehand.
+    """
+
+    def __init__(self, selection):
+        self.items = [item.rstrip("/") for item in selection]
+        self.matched = set()
+
+    def __contains__(self, name):
+        selected = False
+        for item in self.items:
+            if name.rstrip("/") == item or name.startswith(item + "/"):
+                self.matched.add(item)
+                selected = True
+        return selected
+
+    def check(self):
+        """Raise a KeyError for a selected name which matched no member."""
+        for item in self.items:
+            if item not in self.matched:
+                raise KeyError(item)
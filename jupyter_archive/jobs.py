@@ -0,0 +1,176 @@
+import threading
+import time
+import uuid
+
+from .metrics import JobMetrics
+
+# Time in seconds during which the finished jobs are still reported
+JOB_RETENTION = 3600
+
+
+class JobLimitError(Exception):
+    """Raised when a job cannot start as too many jobs are running or waiting."""
+
+    def __init__(self, message, per_user=False):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+class JobConflictError(Exception):
+    """Raised when a job cannot start as its id is the one of an active job."""
+
+
+class Job:
+    """Progress of an archive download, compression or extraction.
+
+    The totals are estimates known before the job starts (e.g. from a walk of
+    the directory to archive); they are None when they cannot be known
+    without doing the work twice.
+    """
+
+    def __init__(self, job_id, kind, path, status="running", user=None, archive_format=None):
+        self.id = job_id
+        self.kind = kind
+        self.path = path
+        self.user = user
+        self.format = archive_format
+        self.status = status
+        self.cancel_requested = False
+        self.error = None
+        self.files_processed = 0
+        # Files left as they were by an incremental extraction, among those processed
+        self.files_skipped = 0
+        self.files_total = None
+        self.bytes_processed = 0
+        self.bytes_total = None
+        # Bytes of archive sent to the client
+        self.bytes_written = 0
+        self.started = time.time()
+        self._start = time.monotonic()
+        self._end = None
+        self._lock = threading.Lock()
+        self.metrics = JobMetrics(kind, archive_format)
+        # Downloads and compressions read the files, extractions write them
+        self._processed = self.metrics.bytes_out if kind == "extract" else self.metrics.bytes_in
+
+    def set_total(self, files, nbytes):
+        self.files_total = files
+        self.bytes_total = nbytes
+
+    def advance(self, files=0, nbytes=0):
+        """Record ``files`` files and ``nbytes`` bytes as processed; thread-safe."""
+        with self._lock:
+            self.files_processed += files
+            self.bytes_processed += nbytes
+        if nbytes:
+            self._processed.inc(nbytes)
+
+    def skip(self, files=0, nbytes=0):
+        """Record ``files`` files of ``nbytes`` bytes as processed without reading or writing them; thread-safe."""
+        with self._lock:
+            self.files_processed += files
+            self.files_skipped += files
+            self.bytes_processed += nbytes
+
+    def run(self):
+        """Mark a pending job as running."""
+        if self.status == "pending":
+            self.metrics.run()
+        self.status = "running"
+        self._start = time.monotonic()
+
+    def cancel(self):
+        """Ask the job to stop; it ends once the work in progress stopped."""
+        self.cancel_requested = True
+
+    def finish(self, status="finished", error=None):
+        """End the job with ``status``, one of "finished", "canceled" or "failed"."""
+        if self._end is not None:
+            return
+        self.status = status
+        self.error = error
+        self._end = time.monotonic()
+        self.metrics.finish(status, self.elapsed)
+
+    @property
+    def active(self):
+        return self.status in ("pending", "running")
+
+    @property
+    def elapsed(self):
+        return (self._end or time.monotonic()) - self._start
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        throughput = self.bytes_processed / elapsed if elapsed > 0 else None
+        eta = None
+        if self.status == "running" and self.bytes_total is not None and throughput:
+            eta = max(0, self.bytes_total - self.bytes_processed) / throughput
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "path": self.path,
+            "format": self.format,
+            "user": self.user,
+            "status": self.status,
+            "cancel_requested": self.cancel_requested,
+            "error": self.error,
+            "started": self.started,
+            "elapsed": elapsed,
+            "files_processed": self.files_processed,
+            "files_skipped": self.files_skipped,
+            "files_total": self.files_total,
+            "bytes_processed": self.bytes_processed,
+            "bytes_total": self.bytes_total,
+            "bytes_written": self.bytes_written,
+            "throughput": throughput,
+            "eta": eta,
+        }
+
+
+class JobRegistry:
+    """Jobs of the server, reported until ``retention`` seconds after they end."""
+
+    def __init__(self, retention=JOB_RETENTION):
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(
+        self, kind, path, job_id=None, status="running", user=None, max_jobs=0, max_user_jobs=0, archive_format=None
+    ):
+        """Register a new job; its id is ``job_id`` if given, e.g. the client archive token.
+
+        Raise :class:`JobConflictError` if ``job_id`` is the id of an active
+        job, which it would hide from the limits. Raise
+        :class:`JobLimitError` if there are already ``max_jobs`` active jobs,
+        or ``max_user_jobs`` active jobs of ``user``; 0 means no limit.
+        """
+        with self._lock:
+            self._prune()
+            other = self._jobs.get(job_id) if job_id else None
+            if other is not None and other.active:
+                raise JobConflictError("The archive job {} is already running.".format(job_id))
+            active = [other for other in self._jobs.values() if other.active]
+            if max_jobs > 0 and len(active) >= max_jobs:
+                raise JobLimitError("Too many archive jobs are running, try again later.")
+            if max_user_jobs > 0 and sum(other.user == user for other in active) >= max_user_jobs:
+                raise JobLimitError("Too many archive jobs of the user are running, try again later.", per_user=True)
+            job = Job(job_id or uuid.uuid4().hex, kind, path, status, user, archive_format)
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            self._prune()
+            return list(self._jobs.values())
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job._end is not None and now - job._end > self.retention:
+                del self._jobs[job_id]
@@ -0,0 +1,134 @@
+import json
+import os
+import stat
+import time
+import zlib
+
+# Name of the manifest member of the delta archives, at the root of the archived folder
+MANIFEST_NAME = ".jupyter-archive-manifest.json"
+MANIFEST_VERSION = 1
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _crc32_hex(crc):
+    return "crc32:{:08x}".format(crc & 0xFFFFFFFF)
+
+
+def file_hash(filename):
+    """Hash of the content of a file, as written in the manifests."""
+    crc = 0
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return _crc32_hex(crc)
+
+
+def load_manifest(data):
+    """Return the files listed by a manifest, as a dict from their arcname to their entry.
+
+    ``data`` is the JSON manifest of a previous download, optionally wrapped
+    in a ``{"manifest": ...}`` object; raise ValueError if it is not valid.
+    """
+    manifest = json.loads(data)
+    if isinstance(manifest, dict) and "manifest" in manifest:
+        manifest = manifest["manifest"]
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict):
+        raise ValueError("The manifest has no files.")
+    for arcname, entry in manifest["files"].items():
+        if not isinstance(entry, dict) or not isinstance(entry.get("size"), int):
+            raise ValueError("Invalid manifest entry for {}.".format(arcname))
+    return manifest["files"]
+
+
+class HashingReader:
+    """File object hashing the content read from ``fileobj``."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self._crc = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self._crc = zlib.crc32(data, self._crc)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        close = getattr(self.fileobj, "close", None)
+        if close is not None:
+            close()
+
+    def hexdigest(self):
+        return _crc32_hex(self._crc)
+
+
+class Manifest:
+    """Content of the archived folder when a delta archive is made.
+
+    It lists all the files with their size, mtime and hash, whether they
+    are in the archive or not, and the files deleted since the previous
+    manifest; it is added to the archive as ``arcname`` so that the next
+    download only sends the changes.
+    """
+
+    def __init__(self, arcname, since=None):
+        self.arcname = arcname
+        self.since = since
+        self.files = {}
+        self.deleted = []
+
+    @staticmethod
+    def key(arcname):
+        return arcname.replace(os.sep, "/")
+
+    def select(self, files, previous=None):
+        """Return the ``(filename, arcname, stat)`` of ``files`` which are new or changed.
+
+        They are compared to the ``previous`` manifest entries if given, from
+        their size and mtime, and their hash when only the mtime changed;
+        otherwise the files modified after ``since`` are selected.
+        """
+        changed = []
+        for file_name, arcname, st in files:
+            key = self.key(arcname)
+            if key == self.arcname:
+                # Left by a previous extraction of a delta archive
+                continue
+            entry = {"size": st.st_size, "mtime": st.st_mtime, "hash": None}
+            self.files[key] = entry
+            if previous is not None:
+                old = previous.get(key)
+                if old is not None and old.get("size") == st.st_size:
+                    if old.get("mtime") == st.st_mtime:
+                        entry["hash"] = old.get("hash")
+                        continue
+                    if old.get("hash") and stat.S_ISREG(st.st_mode) and file_name is not None:
+                        # Touched but maybe not modified (the files of a
+                        # contents manager have no local file to hash)
+                        try:
+                            entry["hash"] = file_hash(file_name)
+                        except OSError:
+                            pass
+                        if entry["hash"] == old["hash"]:
+                            continue
+            elif self.since is not None and st.st_mtime <= self.since:
+                continue
+            changed.append((file_name, arcname, st))
+        if previous is not None:
+            self.deleted = sorted(key for key in previous if key not in self.files)
+        return changed
+
+    def dumps(self):
+        return json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "created": time.time(),
+                "since": self.since,
+                "files": self.files,
+                "deleted": self.deleted,
+            },
+            indent=1,
+            sort_keys=True,
+        ).encode("utf-8")
@@ -0,0 +1,94 @@
+"""
+Prometheus metrics of the archive downloads and extractions
+
+They are registered in the default registry of prometheus_client, which
+jupyter_server exposes on its /metrics endpoint. Read
+https://prometheus.io/docs/practices/naming/ for naming conventions.
+"""
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Buckets in seconds of the job durations, from small folders to large archives
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, float("inf"))
+
+JOB_DURATION_SECONDS = Histogram(
+    "jupyter_archive_job_duration_seconds",
+    "Duration in seconds of the archive downloads and extractions, once they left the queue",
+    ["kind", "format", "status"],
+    buckets=DURATION_BUCKETS,
+)
+JOB_QUEUE_SECONDS = Histogram(
+    "jupyter_archive_job_queue_seconds",
+    "Time in seconds the archive downloads and extractions waited for a worker",
+    ["kind"],
+    buckets=DURATION_BUCKETS,
+)
+ACTIVE_JOBS = Gauge(
+    "jupyter_archive_active_jobs",
+    "Number of archive downloads and extractions running or waiting",
+    ["kind"],
+)
+FIRST_BYTE_SECONDS = Histogram(
+    "jupyter_archive_download_first_byte_seconds",
+    "Time in seconds from the download request to the first archive bytes handed to tornado",
+    ["format"],
+)
+BYTES_IN = Counter(
+    "jupyter_archive_bytes_in",
+    "Bytes read: the files archived by the downloads and the archives extracted",
+    ["kind", "format"],
+)
+BYTES_OUT = Counter(
+    "jupyter_archive_bytes_out",
+    "Bytes produced: the archives sent by the downloads and the files extracted",
+    ["kind", "format"],
+)
+BUFFERED_BYTES = Gauge(
+    "jupyter_archive_download_buffered_bytes",
+    "Bytes of archive handed to tornado which did not reach the socket yet",
+)
+STALL_SECONDS = Histogram(
+    "jupyter_archive_download_stall_seconds",
+    "Time in seconds the archiving threads waited for tornado to send the data, by full buffer",
+    ["buffer"],
+)
+FLUSH_SKIPS = Counter(
+    "jupyter_archive_download_flush_skips",
+    "Flushes put off as the IOStream buffer was larger than stream_max_buffer_size",
+)
+DOWNLOAD_TIMEOUTS = Counter(
+    "jupyter_archive_download_timeouts",
+    "Downloads stopped as tornado did not send the data in time",
+)
+
+
+class JobMetrics:
+    """Metrics of a job, with the labels of its kind and archive format.
+
+    The job counts as active from its creation until :meth:`finish`.
+    """
+
+    def __init__(self, kind, archive_format=None):
+        self.kind = kind
+        self.format = archive_format or ""
+        self.created = time.monotonic()
+        self.bytes_in = BYTES_IN.labels(kind, self.format)
+        self.bytes_out = BYTES_OUT.labels(kind, self.format)
+        self._first_byte = kind != "download"
+        ACTIVE_JOBS.labels(kind).inc()
+
+    def run(self):
+        """Record the time the job waited in the queue."""
+        JOB_QUEUE_SECONDS.labels(self.kind).observe(time.monotonic() - self.created)
+
+    def sent(self, nbytes):
+        """Record ``nbytes`` bytes of archive sent, the first ones since the request."""
+        if not self._first_byte:
+            self._first_byte = True
+            FIRST_BYTE_SECONDS.labels(self.format).observe(time.monotonic() - self.created)
+        self.bytes_out.inc(nbytes)
+
+    def finish(self, status, duration):
+        ACTIVE_JOBS.labels(self.kind).dec()
+        JOB_DURATION_SECONDS.labels(self.kind, self.format, status).observe(duration)
@@ -0,0 +1,30 @@
+import cProfile
+import functools
+import os
+import tempfile
+
+
+def profiled(function, directory, kind):
+    """Wrap ``function`` to profile each of its calls with cProfile.
+
+    The statistics of each call are dumped in ``directory`` as
+    ``<kind>-<random>.prof``, to be read with :mod:`pstats` or e.g. snakeviz;
+    ``function`` is returned as is if ``directory`` is empty. cProfile only
+    sees the calling thread: the work handed to other threads is not in the
+    statistics.
+    """
+    if not directory:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            os.makedirs(directory, exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix=kind + "-", suffix=".prof", dir=directory)
+            os.close(fd)
+            profile.dump_stats(path)
+
+    return wrapper
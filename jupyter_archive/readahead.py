@@ -0,0 +1,208 @@
+import io
+import stat
+import sys
+from collections import deque
+
+# Size of the chunks read from the large files; the same as the zip blocks so
+# that the writer takes them without copying them.
+CHUNK_SIZE = 1024 * 1024
+# Files up to this size are read whole, several at a time.
+SMALL_FILE_SIZE = 256 * 1024
+# Max number of small files read by a single task.
+MAX_BATCH_FILES = 256
+
+
+def read_files(filenames):
+    """Read whole small files; a file which cannot be read is replaced by its ``OSError``."""
+    contents = []
+    for filename in filenames:
+        try:
+            with open(filename, "rb") as f:
+                contents.append(f.read())
+        except OSError as error:
+            contents.append(error)
+    return contents
+
+
+def read_chunk(filename, offset, length):
+    """Read ``length`` bytes of a file at ``offset``, fewer at the end of the file, or up to its end if None."""
+    # Unbuffered, the data is read straight into the returned bytes
+    with open(filename, "rb", buffering=0) as f:
+        f.seek(offset)
+        if length is None:
+            return [f.readall()]
+        data = f.read(length)
+        # A raw read may return less than asked before the end of the file
+        while len(data) < length:
+            more = f.read(length - len(data))
+            if not more:
+                break
+            data += more
+    return [data]
+
+
+def content_sizes(files, hardlinks=False):
+    """Return the size of the content to read for each ``(filename, arcname, stat)``.
+
+    It is None for the files without content: not regular files and, with
+    ``hardlinks``, the hard links to a file listed before as tar stores them.
+    """
+    sizes = []
+    inodes = set()
+    for _, _, st in files:
+        if not stat.S_ISREG(st.st_mode):
+            sizes.append(None)
+            continue
+        if hardlinks and st.st_nlink > 1 and st.st_ino:
+            inode = (st.st_ino, st.st_dev)
+            if inode in inodes:
+                sizes.append(None)
+                continue
+            inodes.add(inode)
+        sizes.append(st.st_size)
+    return sizes
+
+
+class _ChunkReader:
+    """File object reading the content of a large file from the chunks read ahead."""
+
+    def __init__(self, read_ahead, n_chunks):
+        self._read_ahead = read_ahead
+        self._remaining = n_chunks
+        self._chunk = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize
+        parts = []
+        while size > 0:
+            if self._offset >= len(self._chunk):
+                if not self._remaining:
+                    break
+                self._chunk = self._read_ahead._next_content()
+                self._offset = 0
+                self._remaining -= 1
+                continue
+            if self._offset == 0 and size >= len(self._chunk):
+                part = self._chunk
+            else:
+                part = self._chunk[self._offset:self._offset + size]
+            self._offset += len(part)
+            size -= len(part)
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def skip(self):
+        """Drop the chunks not read, e.g. if the file was not archived."""
+        while self._remaining:
+            self._read_ahead._next_content()
+            self._remaining -= 1
+        self._chunk = b""
+
+
+class ReadAhead:
+    """Iterate over the files to archive with their content read ahead on ``executor``.
+
+    ``files`` are the ``(filename, arcname, stat)`` listed by
+    :func:`~jupyter_archive.scanner.scan_files`; they are yielded with a file
+    object reading their content, or None if they have none (see
+    :func:`content_sizes`). The reads are tasks run in order on the
+    ``executor`` threads, ahead of the archiving thread but within
+    ``max_size`` bytes: the small files are read whole by batches and the
+    large ones by chunks of ``CHUNK_SIZE`` bytes.
+
+    The contents are read to the end of the files, whatever the size
+    listed: the tar writer keeps the size of its header, and fails if a
+    file shrank, while the zip writer archives the bytes read.
+    """
+
+    def __init__(self, files, executor, max_size, hardlinks=False):
+        self._files = files
+        self._sizes = content_sizes(files, hardlinks)
+        self._executor = executor
+        self._max_size = max_size
+        self._pending = deque()
+        self._pending_size = 0
+        self._contents = deque()
+        self._tasks = self._iter_tasks()
+        self._next_task = next(self._tasks, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        reader = None
+        for (file_name, arcname, st), size in zip(self._files, self._sizes):
+            if reader is not None:
+                reader.skip()
+                reader = None
+            if size is None:
+                yield file_name, arcname, st, None
+            elif size <= SMALL_FILE_SIZE:
+                content = self._next_content()
+                if isinstance(content, OSError):
+                    raise content
+                yield file_name, arcname, st, io.BytesIO(content)
+            else:
+                reader = _ChunkReader(self, -(-size // CHUNK_SIZE))
+                yield file_name, arcname, st, reader
+
+    def close(self):
+        """Cancel the reads not started yet."""
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pending_size = 0
+        self._next_task = None
+
+    def _iter_tasks(self):
+        # The reads of the contents, in order, as (size, function, args)
+        batch = []
+        batch_size = 0
+        for (file_name, _, _), size in zip(self._files, self._sizes):
+            if size is None:
+                continue
+            if size <= SMALL_FILE_SIZE:
+                batch.append(file_name)
+                batch_size += size
+                if batch_size >= CHUNK_SIZE or len(batch) >= MAX_BATCH_FILES:
+                    yield batch_size, read_files, (batch,)
+                    batch = []
+                    batch_size = 0
+                continue
+            if batch:
+                yield batch_size, read_files, (batch,)
+                batch = []
+                batch_size = 0
+            for offset in range(0, size, CHUNK_SIZE):
+                length = min(CHUNK_SIZE, size - offset)
+                # The last chunk goes to the end of the file, in case it grew
+                last = offset + CHUNK_SIZE >= size
+                yield length, read_chunk, (file_name, offset, None if last else length)
+        if batch:
+            yield batch_size, read_files, (batch,)
+
+    def _submit(self):
+        # Start the next reads within the memory budget, at least one
+        while self._next_task is not None and (
+            not self._pending or self._pending_size + self._next_task[0] <= self._max_size
+        ):
+            size, function, args = self._next_task
+            self._pending.append((size, self._executor.submit(function, *args)))
+            self._pending_size += size
+            self._next_task = next(self._tasks, None)
+
+    def _next_content(self):
+        if not self._contents:
+            self._submit()
+            size, future = self._pending.popleft()
+            self._pending_size -= size
+            self._contents.extend(future.result())
+            self._submit()
+        return self._contents.popleft()
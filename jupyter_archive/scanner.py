@@ -0,0 +1,172 @@
+import fnmatch
+import os
+
+
+class PathFilter:
+    """Select the files to archive with glob patterns on their path relative to ``root``.
+
+    A pattern without "/" matches the name of a file or of one of its parent
+    directories, e.g. ``*.py`` or ``node_modules``; a pattern with "/"
+    matches the start of the path, e.g. ``src/*.py``. A file is archived if
+    it matches one of the ``include`` patterns, if any, and none of the
+    ``exclude`` patterns.
+    """
+
+    def __init__(self, root, include=(), exclude=()):
+        self.root = str(root)
+        self.include = list(include)
+        self.exclude = list(exclude)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    @staticmethod
+    def _match(parts, patterns):
+        for pattern in patterns:
+            if "/" in pattern:
+                pattern = pattern.strip("/")
+                if any(fnmatch.fnmatchcase("/".join(parts[:n]), pattern) for n in range(1, len(parts) + 1)):
+                    return True
+            elif any(fnmatch.fnmatchcase(part, pattern) for part in parts):
+                return True
+        return False
+
+    def _parts(self, path):
+        # The paths are listed from the root
+        return path[len(self.root) + len(os.sep):].replace(os.sep, "/").split("/")
+
+    def excludes(self, path):
+        """Whether ``path``, a file or a directory to skip with its content, matches an ``exclude`` pattern."""
+        return bool(self.exclude) and self._match(self._parts(path), self.exclude)
+
+    def includes(self, path):
+        """Whether the file ``path`` is to be archived."""
+        parts = self._parts(path)
+        if self.exclude and self._match(parts, self.exclude):
+            return False
+        return not self.include or self._match(parts, self.include)
+
+
+def _scan_directory(path, download_hidden, dereference, path_filter=None):
+    # Return the sorted `(path, stat)` of the files and the sorted subdirectories
+    # of `path` as os.walk would list them, or None if it cannot be read.
+    files = []
+    directories = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # This ensures that if download_hidden is false, then the
+                # hidden files are skipped when walking the directory.
+                if not download_hidden and entry.name[0] == ".":
+                    continue
+                if path_filter and path_filter.excludes(entry.path):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    directories.append((entry.name, entry.path, entry.is_symlink()))
+                    continue
+                if path_filter and not path_filter.includes(entry.path):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=dereference)
+                except OSError:
+                    # e.g. a broken symlink
+                    st = entry.stat(follow_symlinks=False)
+                files.append((entry.name, entry.path, st))
+    except OSError:
+        return None
+    files.sort()
+    directories.sort()
+    return files, directories
+
+
+def scan_files(
+    archive_path,
+    follow_symlinks=True,
+    download_hidden=False,
+    dereference=True,
+    executor=None,
+    prefetch=0,
+    path_filter=None,
+    arcname_root=None,
+):
+    """List the ``(filename, arcname, stat)`` of the files to archive, in a reproducible order.
+
+    The files are listed in the order of a sorted :func:`os.walk` but with
+    :func:`os.scandir`, and each one is stat'ed once: its ``stat`` result
+    (``lstat`` unless ``dereference``) is meant to build the archive member.
+    With an ``executor``, the next ``prefetch`` directories to visit are
+    scanned ahead in parallel, to hide the latency of network file systems.
+
+    The files are selected by ``path_filter``, a :class:`PathFilter`. The
+    arcnames are relative to ``arcname_root``, by default the parent of
+    ``archive_path``.
+    """
+    if arcname_root is None:
+        arcname_root = archive_path.parent
+    prefix = len(str(arcname_root)) + len(os.path.sep)
+    files = []
+    # Directories to visit, the next one last
+    stack = [str(archive_path)]
+    pending = {}
+    try:
+        while stack:
+            path = stack.pop()
+            future = pending.pop(path, None)
+            if future is not None:
+                scanned = future.result()
+            else:
+                scanned = _scan_directory(path, download_hidden, dereference, path_filter)
+            if scanned is None:
+                continue
+            directory_files, directories = scanned
+            stack.extend(path for _, path, is_symlink in reversed(directories) if follow_symlinks or not is_symlink)
+            if executor is not None:
+                for path in stack[-prefetch:]:
+                    if path not in pending:
+                        pending[path] = executor.submit(
+                            _scan_directory, path, download_hidden, dereference, path_filter
+                        )
+            files.extend((file_path, file_path[prefix:], st) for _, file_path, st in directory_files)
+    finally:
+        for future in pending.values():
+            future.cancel()
+    return files
+
+
+def scan_paths(
+    root,
+    paths,
+    follow_symlinks=True,
+    download_hidden=False,
+    dereference=True,
+    executor=None,
+    prefetch=0,
+    path_filter=None,
+):
+    """Like :func:`scan_files` for a selection of ``paths``, files or directories relative to ``root``.
+
+    The arcnames are relative to ``root``; a file selected twice, e.g. with
+    its directory, is listed once.
+    """
+    files = []
+    seen = set()
+    for path in paths:
+        path = root / path
+        if path.is_dir():
+            listed = scan_files(
+                path, follow_symlinks, download_hidden, dereference, executor, prefetch, path_filter, root
+            )
+        elif path_filter and not path_filter.includes(str(path)):
+            continue
+        else:
+            st = os.stat(path) if dereference else os.lstat(path)
+            listed = [(str(path), os.path.relpath(path, root), st)]
+        for file_ in listed:
+            if file_[0] not in seen:
+                seen.add(file_[0])
+                files.append(file_)
+    return files
@@ -0,0 +1,333 @@
+import bz2
+import functools
+import gzip
+import lzma
+import os
+import stat
+import struct
+import tarfile
+import zlib
+from collections import deque
+
+from .zipstream import DICT_SIZE, crc32_combine, deflate_block
+
+try:
+    # Python 3.14+
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
+# Size of the uncompressed blocks compressed independently by the workers.
+BLOCK_SIZES = {
+    "gz": 1024 * 1024,
+    "bz2": 900 * 1024,
+    "xz": 4 * 1024 * 1024,
+}
+# Default levels, the same as tarfile's
+DEFAULT_LEVELS = {
+    "gz": 9,
+    "bz2": 9,
+    "xz": 6,
+    "zst": 3,
+    "lz4": 0,
+}
+
+# Header without file name nor timestamp so that the output is reproducible
+_GZIP_HEADER = b"\037\213\010\000" + struct.pack("<L", 0) + b"\002\377"
+
+
+def is_available(compression):
+    """Whether the library needed by the compression is installed."""
+    if compression == "zst":
+        return zstd is not None or zstandard is not None
+    elif compression == "lz4":
+        return lz4 is not None
+    return compression in DEFAULT_LEVELS
+
+
+def compress_block(compression, data, zdict=b"", level=-1, last=True):
+    """Compress a block of a tar stream; return the compressed data, its CRC-32 and its length.
+
+    gzip blocks are raw deflate blocks to be concatenated in a single member;
+    bz2 and xz blocks are complete streams (and have no CRC-32).
+    """
+    if compression == "gz":
+        return deflate_block(data, zdict, level, last)
+    elif compression == "bz2":
+        return bz2.compress(data, level), 0, len(data)
+    elif compression == "xz":
+        return lzma.compress(data, preset=level), 0, len(data)
+    raise ValueError("'{}' is not a valid compression.".format(compression))
+
+
+class CompressedStream:
+    """Non-seekable file object compressing the data written into ``fileobj``.
+
+    Without ``executor``, the data is compressed in the calling thread as a
+    single stream. Otherwise it is split in blocks compressed concurrently on
+    ``executor`` and written in order, pigz-style: gzip blocks are
+    concatenated in one member while bz2 and xz blocks are written as
+    consecutive streams, which the standard tools (and Python's ``bz2`` and
+    ``lzma`` modules) decompress as a whole.
+
+    zstd uses its own ``workers`` threads instead of ``executor`` and lz4,
+    fast enough on a single core, always runs in the calling thread.
+    """
+
+    def __init__(self, fileobj, compression, compresslevel=None, executor=None, workers=1):
+        if compression not in DEFAULT_LEVELS:
+            raise ValueError("'{}' is not a valid compression.".format(compression))
+        if not is_available(compression):
+            raise ValueError("The '{}' compression library is not installed.".format(compression))
+        if compression not in BLOCK_SIZES:
+            executor = None
+        self.fileobj = fileobj
+        self.compression = compression
+        if compresslevel is None or compresslevel < 0:
+            compresslevel = DEFAULT_LEVELS[compression]
+        elif compression == "bz2":
+            # bzip2 has no level 0
+            compresslevel = max(1, compresslevel)
+        self.compresslevel = compresslevel
+        self._executor = executor
+        self._max_pending = 2 * workers
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._zdict = b""
+        self._crc = 0
+        self._size = 0
+        self._closed = False
+
+        if executor is None:
+            if compression == "gz":
+                self._compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+            elif compression == "bz2":
+                self._compressor = bz2.BZ2Compressor(self.compresslevel)
+            elif compression == "xz":
+                self._compressor = lzma.LZMACompressor(preset=self.compresslevel)
+            elif compression == "zst":
+                self._compressor = _zstd_compressor(self.compresslevel, workers)
+            else:
+                self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=self.compresslevel)
+                self.fileobj.write(self._compressor.begin())
+        if compression == "gz":
+            self.fileobj.write(_GZIP_HEADER)
+
+    def write(self, data):
+        if self._executor is None:
+            if self.compression == "gz":
+                self._crc = zlib.crc32(data, self._crc)
+                self._size += len(data)
+            compressed = self._compressor.compress(data)
+            if compressed:
+                self.fileobj.write(compressed)
+            return
+
+        self._buffer += data
+        block_size = BLOCK_SIZES[self.compression]
+        while len(self._buffer) >= block_size:
+            block = bytes(self._buffer[:block_size])
+            del self._buffer[:block_size]
+            self._submit(block, last=False)
+            self._drain(self._max_pending)
+
+    def close(self):
+        """Compress the remaining data and write the end of the stream."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._executor is None:
+            self.fileobj.write(self._compressor.flush())
+        else:
+            if self._buffer or self.compression == "gz":
+                # The final gzip block must be written, even empty, to end the deflate stream
+                self._submit(bytes(self._buffer), last=True)
+                self._buffer = bytearray()
+            self._drain(0)
+        if self.compression == "gz":
+            self.fileobj.write(struct.pack("<LL", self._crc, self._size & 0xFFFFFFFF))
+
+    def abort(self):
+        """Drop the data not compressed yet."""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._closed = True
+
+    def _submit(self, block, last):
+        zdict = self._zdict
+        if self.compression == "gz":
+            self._zdict = block[-DICT_SIZE:] if len(block) >= DICT_SIZE else (zdict + block)[-DICT_SIZE:]
+        self._pending.append(
+            self._executor.submit(compress_block, self.compression, block, zdict, self.compresslevel, last)
+        )
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            compressed, crc, size = self._pending.popleft().result()
+            self.fileobj.write(compressed)
+            self._crc = crc32_combine(self._crc, crc, size)
+            self._size += size
+
+
+def _zstd_compressor(level, workers):
+    if zstd is not None:
+        options = {zstd.CompressionParameter.nb_workers: workers} if workers > 1 else None
+        return zstd.ZstdCompressor(level, options=options)
+    return zstandard.ZstdCompressor(level=level, threads=workers if workers > 1 else 0).compressobj()
+
+
+@functools.lru_cache(maxsize=None)
+def _uname(uid):
+    try:
+        return pwd.getpwuid(uid)[0]
+    except KeyError:
+        return ""
+
+
+@functools.lru_cache(maxsize=None)
+def _gname(gid):
+    try:
+        return grp.getgrgid(gid)[0]
+    except KeyError:
+        return ""
+
+
+def tarinfo_from_stat(archive, name, arcname, st):
+    """Like :meth:`tarfile.TarFile.gettarinfo`, from the ``os.lstat`` result ``st`` of the file.
+
+    Return None for the files which cannot be archived, e.g. sockets.
+    """
+    if arcname is None:
+        arcname = name
+    arcname = os.path.splitdrive(arcname)[1].replace(os.sep, "/").lstrip("/")
+    tarinfo = archive.tarinfo()
+    tarinfo.tarfile = archive
+
+    linkname = ""
+    mode = st.st_mode
+    if stat.S_ISREG(mode):
+        inode = (st.st_ino, st.st_dev)
+        if not archive.dereference and st.st_nlink > 1 and inode in archive.inodes and arcname != archive.inodes[inode]:
+            # A hard link to a file already in the archive
+            type = tarfile.LNKTYPE
+            linkname = archive.inodes[inode]
+        else:
+            type = tarfile.REGTYPE
+            if inode[0]:
+                archive.inodes[inode] = arcname
+    elif stat.S_ISDIR(mode):
+        type = tarfile.DIRTYPE
+    elif stat.S_ISFIFO(mode):
+        type = tarfile.FIFOTYPE
+    elif stat.S_ISLNK(mode):
+        type = tarfile.SYMTYPE
+        linkname = os.readlink(name)
+    elif stat.S_ISCHR(mode):
+        type = tarfile.CHRTYPE
+    elif stat.S_ISBLK(mode):
+        type = tarfile.BLKTYPE
+    else:
+        return None
+
+    tarinfo.name = arcname
+    tarinfo.mode = mode
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.size = st.st_size if type == tarfile.REGTYPE else 0
+    tarinfo.mtime = st.st_mtime
+    tarinfo.type = type
+    tarinfo.linkname = linkname
+    if pwd is not None:
+        tarinfo.uname = _uname(tarinfo.uid)
+        tarinfo.gname = _gname(tarinfo.gid)
+    if type in (tarfile.CHRTYPE, tarfile.BLKTYPE) and hasattr(os, "major"):
+        tarinfo.devmajor = os.major(st.st_rdev)
+        tarinfo.devminor = os.minor(st.st_rdev)
+    return tarinfo
+
+
+class _CompressedTarFile(tarfile.TarFile):
+    # TarFile does not close a file object it was given; end the compressed
+    # stream once the tar stream is complete.
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.compressed_stream.close()
+
+    def __exit__(self, type, value, traceback):
+        super().__exit__(type, value, traceback)
+        if type is not None:
+            self.compressed_stream.abort()
+
+
+def open_tar_writer(fileobj, compression, compresslevel=None, executor=None, workers=1):
+    """Open a tar archive streamed into ``fileobj`` through a :class:`CompressedStream`."""
+    stream = CompressedStream(fileobj, compression, compresslevel, executor, workers)
+    archive = _CompressedTarFile.open(fileobj=stream, mode="w|")
+    archive.compressed_stream = stream
+    return archive
+
+
+class _ExternalTarFile(tarfile.TarFile):
+    # Close the decompressed file object given to tarfile with the archive.
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.external_fileobj.close()
+
+    def __exit__(self, type, value, traceback):
+        try:
+            super().__exit__(type, value, traceback)
+        finally:
+            self.external_fileobj.close()
+
+
+def open_decompressed(path, compression):
+    """Open the file ``path`` compressed with ``compression`` for reading its decompressed data.
+
+    The files made of several compressed streams, e.g. by the parallel
+    compression, are read as a whole.
+    """
+    if not is_available(compression):
+        raise ValueError("The '{}' compression library is not installed.".format(compression))
+    if compression == "gz":
+        return gzip.open(path, "rb")
+    elif compression == "bz2":
+        return bz2.open(path, "rb")
+    elif compression == "xz":
+        return lzma.open(path, "rb")
+    elif compression == "zst":
+        if zstd is not None:
+            return zstd.open(path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return lz4.frame.open(path, "rb")
+
+
+def open_tar_reader(path, compression):
+    """Open a zstd or lz4 compressed tar archive in streaming mode."""
+    if compression not in ("zst", "lz4"):
+        raise ValueError("'{}' is not a valid compression.".format(compression))
+    fileobj = open_decompressed(path, compression)
+    try:
+        archive = _ExternalTarFile.open(fileobj=fileobj, mode="r|")
+    except Exception:
+        fileobj.close()
+        raise
+    archive.external_fileobj = fileobj
+    return archive
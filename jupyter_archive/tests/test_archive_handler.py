@@ -1,12 +1,49 @@
+import asyncio
+import bz2
+import functools
+import gzip
 import io
+import json
+import lzma
+import os
 import platform
+import pstats
 import shutil
 import tarfile
+import threading
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import pytest
 
+from jupyter_server.auth import User
+from prometheus_client import REGISTRY
 from tornado.httpclient import HTTPClientError
+from tornado.httputil import HTTPServerRequest
+
+from jupyter_archive import extract, handlers
+from jupyter_archive.handlers import ArchiveStream
+from jupyter_archive.jobs import Job
+from jupyter_archive.tarstream import is_available, lz4, open_tar_writer, zstandard, zstd
+
+
+def _skip_unavailable(compression):
+    if compression in ["zst", "lz4"] and not is_available(compression):
+        pytest.skip(f"The {compression} compression library is not installed")
+
+
+def _decompress(compression, data):
+    if compression == "zst" and zstd is not None:
+        return zstd.decompress(data)
+    elif compression == "zst":
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+    return lz4.frame.decompress(data)
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
 
 
 @pytest.mark.parametrize(
@@ -72,11 +109,16 @@ from tornado.httpclient import HTTPClientError
         ("tar.bz2", "r|bz2"),
         ("txz", "r|xz"),
         ("tar.xz", "r|xz"),
+        ("tzst", "zst"),
+        ("tar.zst", "zst"),
+        ("tlz4", "lz4"),
+        ("tar.lz4", "lz4"),
     ],
 )
 async def test_download(jp_fetch, jp_root_dir, followSymlinks, download_hidden, file_list, format, mode):
     if followSymlinks and platform.system() == "Windows":
         pytest.skip("Symlinks not working on Windows")
+    _skip_unavailable(mode)
 
     # Create a dummy directory.
     archive_dir_path = jp_root_dir / "download-archive-dir"
@@ -117,6 +159,9 @@ async def test_download(jp_fetch, jp_root_dir, followSymlinks, download_hidden,
     if format == "zip":
         with zipfile.ZipFile(r.buffer, mode=mode) as zf:
             assert set(zf.namelist()) == file_list
+    elif mode in ["zst", "lz4"]:
+        with tarfile.open(fileobj=io.BytesIO(_decompress(mode, r.body)), mode="r:") as tf:
+            assert set(map(lambda m: m.name, tf.getmembers())) == file_list
     else:
         with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
             assert set(map(lambda m: m.name, tf.getmembers())) == file_list
@@ -140,6 +185,11 @@ def _create_archive_file(root_dir, file_name, format, mode):
             for file_path in archive_dir_path.rglob("*"):
                 if file_path.is_file():
                     writer.write(file_path, file_path.relative_to(root_dir))
+    elif mode in ["zst", "lz4"]:
+        with open(archive_path, "wb") as f, open_tar_writer(f, mode) as writer:
+            for file_path in archive_dir_path.rglob("*"):
+                if file_path.is_file():
+                    writer.add(file_path, file_path.relative_to(root_dir))
     else:
         with tarfile.open(str(archive_path), mode=mode) as writer:
             for file_path in archive_dir_path.rglob("*"):
@@ -172,9 +222,16 @@ def _create_archive_file(root_dir, file_name, format, mode):
         ("tar.bz2", "w|bz2"),
         ("txz", "w|xz"),
         ("tar.xz", "w|xz"),
+        ("tzst", "zst"),
+        ("tar.zst", "zst"),
+        ("tlz4", "lz4"),
+        ("tar.lz4", "lz4"),
     ],
 )
-async def test_extract(jp_fetch, jp_root_dir, file_name, format, mode):
+@pytest.mark.parametrize("workers", [1, 4])
+async def test_extract(jp_fetch, jp_root_dir, jp_serverapp, file_name, format, mode, workers):
+    _skip_unavailable(mode)
+    jp_serverapp.web_app.settings["jupyter_archive"].extraction_workers = workers
     archive_dir_path, archive_path = _create_archive_file(jp_root_dir, file_name, format, mode)
 
     r = await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
@@ -197,9 +254,12 @@ async def test_extract(jp_fetch, jp_root_dir, file_name, format, mode):
         ("tar.bz2", "w|bz2"),
         ("txz", "w|xz"),
         ("tar.xz", "w|xz"),
+        ("tar.zst", "zst"),
+        ("tar.lz4", "lz4"),
     ],
 )
 async def test_extract_failure(jp_fetch, jp_root_dir, format, mode):
+    _skip_unavailable(mode)
     # The request should fail when the extension has an unnecessary prefix.
     prefixed_format = f"prefix{format}"
     archive_dir_path, archive_path = _create_archive_file(jp_root_dir, "extract-archive-dir", prefixed_format, mode)
@@ -210,9 +270,11 @@ async def test_extract_failure(jp_fetch, jp_root_dir, format, mode):
     assert not archive_dir_path.exists()
 
 
-async def test_extract_symlink_traversal(jp_fetch, jp_root_dir, tmp_path):
+@pytest.mark.parametrize("workers", [1, 4])
+async def test_extract_symlink_traversal(jp_fetch, jp_root_dir, jp_serverapp, tmp_path, workers):
     if platform.system() == "Windows":
         pytest.skip("Symlinks not working on Windows")
+    jp_serverapp.web_app.settings["jupyter_archive"].extraction_workers = workers
 
     # A malicious archive that first creates a symlink escaping the extraction
     # directory, then writes a file through it.
@@ -245,7 +307,9 @@ async def test_extract_symlink_traversal(jp_fetch, jp_root_dir, tmp_path):
         ("../test"),
     ],
 )
-async def test_extract_path_traversal(jp_fetch, jp_root_dir, file_path):
+@pytest.mark.parametrize("workers", [1, 4])
+async def test_extract_path_traversal(jp_fetch, jp_root_dir, jp_serverapp, file_path, workers):
+    jp_serverapp.web_app.settings["jupyter_archive"].extraction_workers = workers
     unsafe_file_path = jp_root_dir / "test"
     archive_path = jp_root_dir / "test.tar.gz"
     open(unsafe_file_path, 'a').close()
@@ -256,3 +320,1081 @@ async def test_extract_path_traversal(jp_fetch, jp_root_dir, file_path):
         await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
     assert e.type == HTTPClientError
     assert e.value.code == 400
+
+
+@pytest.mark.parametrize("format, mode", [("zip", "w"), ("tar.gz", "w|gz")])
+@pytest.mark.parametrize("limit", ["max_extraction_size", "max_extraction_members"])
+async def test_extract_quota(jp_fetch, jp_root_dir, jp_serverapp, format, mode, limit):
+    setattr(jp_serverapp.web_app.settings["jupyter_archive"], limit, 2)
+    archive_dir_path, archive_path = _create_archive_file(jp_root_dir, "quota-dir", format, mode)
+
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
+    assert e.value.code == 400
+    # The files extracted before reaching the limit are removed
+    assert not archive_dir_path.exists()
+
+
+async def test_extract_compression_ratio(jp_fetch, jp_root_dir, jp_serverapp, monkeypatch):
+    monkeypatch.setattr(extract, "RATIO_MIN_SIZE", 64 * 1024)
+    # Sparse data legitimately expands more than 1000 times
+    archive_path = jp_root_dir / "zeros.tar.xz"
+    with tarfile.open(archive_path, "w|xz") as tf:
+        info = tarfile.TarInfo("zeros-dir/zeros.bin")
+        info.size = 1024 * 1024
+        tf.addfile(info, io.BytesIO(bytes(info.size)))
+    assert archive_path.stat().st_size * 1000 < 1024 * 1024
+
+    # No limit by default
+    r = await jp_fetch("extract-archive", "zeros.tar.xz", method="GET")
+    assert r.code == 200
+    assert (jp_root_dir / "zeros-dir/zeros.bin").stat().st_size == 1024 * 1024
+
+    shutil.rmtree(jp_root_dir / "zeros-dir")
+    jp_serverapp.web_app.settings["jupyter_archive"].max_compression_ratio = 1000
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("extract-archive", "zeros.tar.xz", method="GET")
+    assert e.value.code == 400
+    assert not (jp_root_dir / "zeros-dir").exists()
+
+
+@pytest.mark.parametrize("format, mode", [("zip", "w"), ("tar.gz", "w|gz"), ("tar.xz", "w|xz")])
+async def test_archive_contents(jp_fetch, jp_root_dir, jp_serverapp, tmp_path, format, mode):
+    jp_serverapp.web_app.settings["jupyter_archive"].archive_index_dir = str(tmp_path / "index")
+    archive_dir_path, archive_path = _create_archive_file(jp_root_dir, "contents-dir", format, mode)
+
+    for _ in range(2):
+        r = await jp_fetch("archive-contents", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
+        assert r.code == 200
+        members = json.loads(r.body)
+        assert sorted(member["name"] for member in members) == [
+            "contents-dir/extract-test1.txt",
+            "contents-dir/extract-test2.txt",
+            "contents-dir/extract-test3.md",
+        ]
+        assert all(member["type"] == "file" and member["size"] == 6 for member in members)
+        assert all((member["compressed_size"] is None) == (format != "zip") for member in members)
+    # The tar index is cached
+    assert len(list((tmp_path / "index").iterdir())) == (0 if format == "zip" else 1)
+    assert not archive_dir_path.exists()
+
+    (jp_root_dir / "archive.txt").write_text("not an archive")
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("archive-contents", "archive.txt", method="GET")
+    assert e.value.code == 400
+
+
+@pytest.mark.parametrize("format, mode", [("zip", "w"), ("tar.gz", "w|gz")])
+async def test_extract_members(jp_fetch, jp_root_dir, format, mode):
+    archive_dir_path, archive_path = _create_archive_file(jp_root_dir, "members-dir", format, mode)
+    (jp_root_dir / "destination").mkdir()
+
+    params = [
+        ("member", "members-dir/extract-test1.txt"),
+        ("member", "members-dir/extract-test3.md"),
+        ("destination", "destination"),
+    ]
+    r = await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), params=params, method="GET")
+    assert r.code == 200
+    assert not archive_dir_path.exists()
+    assert sorted(path.name for path in (jp_root_dir / "destination" / "members-dir").iterdir()) == [
+        "extract-test1.txt",
+        "extract-test3.md",
+    ]
+    assert (jp_root_dir / "destination" / "members-dir" / "extract-test3.md").read_text() == "hello3"
+
+    for params, code in [
+        ([("member", "missing.txt")], 404),
+        ([("destination", "../outside")], 400),
+        ([("destination", "missing")], 404),
+    ]:
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch(
+                "extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), params=params, method="GET"
+            )
+        assert e.value.code == code
+
+
+@pytest.mark.parametrize("format, mode", [("zip", "r"), ("tar.gz", "r:gz")])
+async def test_download_selection(jp_fetch, jp_root_dir, format, mode):
+    archive_dir_path = jp_root_dir / "selection-dir"
+    for folder in ["src/pkg", "node_modules/lib", "docs"]:
+        (archive_dir_path / folder).mkdir(parents=True)
+    (archive_dir_path / "README.md").write_text("readme")
+    (archive_dir_path / "setup.py").write_text("setup")
+    (archive_dir_path / "src" / "main.py").write_text("main")
+    (archive_dir_path / "src" / "pkg" / "module.py").write_text("module")
+    (archive_dir_path / "src" / "pkg" / "module.pyc").write_text("compiled")
+    (archive_dir_path / "node_modules" / "lib" / "index.js").write_text("js")
+    (archive_dir_path / "docs" / "index.md").write_text("docs")
+
+    params = [
+        ("archiveToken", 564646),
+        ("archiveFormat", format),
+        ("path", "src"),
+        ("path", "README.md"),
+        ("path", "node_modules"),
+        ("exclude", "*.pyc"),
+        ("exclude", "node_modules"),
+    ]
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+    assert r.headers["content-disposition"] == "attachment; filename=selection-dir.{}".format(format)
+
+    if format == "zip":
+        with zipfile.ZipFile(r.buffer, mode=mode) as zf:
+            names = set(zf.namelist())
+            assert zf.read("src/pkg/module.py") == b"module"
+    else:
+        with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
+            names = set(tf.getnames())
+            assert tf.extractfile("src/pkg/module.py").read() == b"module"
+    assert names == {"README.md", "src/main.py", "src/pkg/module.py"}
+
+    # Include patterns apply to a whole directory too
+    params = {"archiveToken": 564646, "archiveFormat": format, "include": "*.md"}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    if format == "zip":
+        with zipfile.ZipFile(r.buffer, mode=mode) as zf:
+            names = set(zf.namelist())
+    else:
+        with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
+            names = set(tf.getnames())
+    assert names == {"selection-dir/README.md", "selection-dir/docs/index.md"}
+
+
+@pytest.mark.parametrize("format, mode", [("zip", "r"), ("tar.gz", "r:gz")])
+async def test_download_delta(jp_fetch, jp_root_dir, format, mode):
+    def read_archive(r):
+        if format == "zip":
+            with zipfile.ZipFile(r.buffer, mode=mode) as zf:
+                return {name: zf.read(name) for name in zf.namelist()}
+        with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
+            return {member.name: tf.extractfile(member).read() for member in tf.getmembers()}
+
+    # A timestamp after 1980, the earliest one in ZIP files
+    T = 1_600_000_000
+    archive_dir_path = jp_root_dir / "delta-dir"
+    (archive_dir_path / "sub").mkdir(parents=True)
+    for name in ["a.txt", "b.txt", "c.txt", "sub/d.txt"]:
+        (archive_dir_path / name).write_text(name)
+        os.utime(archive_dir_path / name, (T - 1000, T - 1000))
+    os.utime(archive_dir_path / "c.txt", (T + 1000, T + 1000))
+
+    params = {"archiveToken": 564646, "archiveFormat": format, "since": T}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+    members = read_archive(r)
+    assert sorted(members) == ["delta-dir/.jupyter-archive-manifest.json", "delta-dir/c.txt"]
+    manifest = json.loads(members["delta-dir/.jupyter-archive-manifest.json"])
+    assert manifest["since"] == T
+    assert sorted(manifest["files"]) == ["delta-dir/a.txt", "delta-dir/b.txt", "delta-dir/c.txt", "delta-dir/sub/d.txt"]
+    assert manifest["files"]["delta-dir/c.txt"]["hash"] == "crc32:{:08x}".format(zlib.crc32(b"c.txt"))
+
+    # Send the manifest of a full download back to get the changes
+    params = {"archiveToken": 564646, "archiveFormat": format, "since": 0}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    manifest = read_archive(r)["delta-dir/.jupyter-archive-manifest.json"]
+    (archive_dir_path / "a.txt").write_text("changed")
+    os.utime(archive_dir_path / "b.txt", (T, T))
+    (archive_dir_path / "sub" / "d.txt").unlink()
+    (archive_dir_path / "e.txt").write_text("new")
+
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="POST", body=manifest)
+    assert r.code == 200
+    members = read_archive(r)
+    assert sorted(members) == ["delta-dir/.jupyter-archive-manifest.json", "delta-dir/a.txt", "delta-dir/e.txt"]
+    assert members["delta-dir/a.txt"] == b"changed"
+    manifest = json.loads(members["delta-dir/.jupyter-archive-manifest.json"])
+    assert manifest["deleted"] == ["delta-dir/sub/d.txt"]
+    assert sorted(manifest["files"]) == ["delta-dir/a.txt", "delta-dir/b.txt", "delta-dir/c.txt", "delta-dir/e.txt"]
+
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("directories", archive_dir_path.stem, params=params, method="POST", body=b"not a manifest")
+    assert e.value.code == 400
+
+
+@pytest.mark.parametrize("path, code", [("../secret", 400), ("/etc", 400), ("missing", 404), (".hidden", 404)])
+async def test_download_invalid_selection(jp_fetch, jp_root_dir, path, code):
+    archive_dir_path = jp_root_dir / "selection-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / ".hidden").write_text("hidden")
+    (jp_root_dir / "secret").write_text("secret")
+
+    params = {"archiveToken": 564646, "archiveFormat": "zip", "path": path}
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert e.value.code == code
+
+
+@pytest.mark.parametrize(
+    "format, mode",
+    [
+        ("zip", "r"),
+        ("tar.gz", "r:gz"),
+    ],
+)
+async def test_download_backpressure(jp_fetch, jp_root_dir, jp_serverapp, format, mode):
+    # Force the archiving thread to wait for the IOLoop after every chunk.
+    jp_serverapp.web_app.settings["jupyter_archive"].handler_max_buffer_length = 1
+
+    archive_dir_path = jp_root_dir / "backpressure-dir"
+    archive_dir_path.mkdir(parents=True)
+    content = os.urandom(2 * 1024 * 1024)
+    (archive_dir_path / "random.bin").write_bytes(content)
+
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    if format == "zip":
+        with zipfile.ZipFile(r.buffer, mode=mode) as zf:
+            assert zf.read("backpressure-dir/random.bin") == content
+    else:
+        with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
+            assert tf.extractfile("backpressure-dir/random.bin").read() == content
+
+
+def test_connection_closed_early(jp_serverapp):
+    # The client may leave before the archive is being sent
+    request = HTTPServerRequest(method="GET", uri="/directories/folder", connection=mock.Mock())
+    handler = handlers.DownloadArchiveHandler(jp_serverapp.web_app, request)
+    handler.on_connection_close()
+    assert handler.canceled
+
+
+class _StubHandler:
+    # What ArchiveStream uses of DownloadArchiveHandler; the flushes are done by the test
+    def __init__(self):
+        self.flush_condition = threading.Condition(threading.Lock())
+        self.canceled = False
+        self.handler_max_buffer_length = 10240
+        self.job = Job(None, "download", "")
+        self._write_buffer = []
+        self._handed_slabs = 0
+        self._released_slabs = 0
+        self._handed_bytes = 0
+        self._released_bytes = 0
+        self.sent = []
+
+    def request_flush(self):
+        pass
+
+    def send(self):
+        # Copy the chunks handed so far, then let the stream reuse their slabs
+        with self.flush_condition:
+            self.sent.extend(bytes(chunk) for chunk in self._write_buffer)
+            self._write_buffer = []
+            self._released_slabs = self._handed_slabs
+            self._released_bytes = self._handed_bytes
+            self.flush_condition.notify_all()
+
+
+def test_archive_stream_slabs(monkeypatch):
+    monkeypatch.setattr(handlers, "SLAB_SIZE", 100)
+    monkeypatch.setattr(handlers, "SLAB_COUNT", 3)
+    handler = _StubHandler()
+    stream = ArchiveStream(handler)
+    chunks = [os.urandom(n) for n in [10, 95, 40, 250, 1, 99, 100, 30, 70, 5] * 3]
+    stalls = _sample("jupyter_archive_download_stall_seconds_count", buffer="slabs")
+
+    def write():
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    # All the slabs are handed: the stream waits for them to be sent
+    writer.join(0.2)
+    assert writer.is_alive()
+    assert handler._handed_slabs == 3
+    while writer.is_alive():
+        handler.send()
+        writer.join(0.01)
+    handler.send()
+
+    assert b"".join(handler.sent) == b"".join(chunks)
+    assert stream.tell() == handler.job.bytes_written == sum(len(chunk) for chunk in chunks)
+    # The small writes are coalesced, the large ones handed as they are
+    assert [len(chunk) for chunk in handler.sent[:4]] == [100, 45, 250, 100]
+    assert _sample("jupyter_archive_download_stall_seconds_count", buffer="slabs") > stalls
+
+
+def test_archive_stream_stalled_client(monkeypatch):
+    # The large writes skip the slabs, but the bytes not sent yet stay bounded
+    monkeypatch.setattr(handlers, "SLAB_SIZE", 100)
+    monkeypatch.setattr(handlers, "BUFFER_CHUNK_SIZE", 100)
+    handler = _StubHandler()
+    handler.handler_max_buffer_length = 10
+    stream = ArchiveStream(handler)
+    chunks = [os.urandom(300) for _ in range(20)]
+    stalls = _sample("jupyter_archive_download_stall_seconds_count", buffer="write_buffer")
+
+    def write():
+        for chunk in chunks:
+            stream.write(chunk)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive()
+    # Handed as long as less than 10 chunks of 100 bytes were not sent
+    assert len(handler._write_buffer) == 4
+    assert handler._handed_bytes == 1200
+    while writer.is_alive():
+        handler.send()
+        assert handler._handed_bytes - handler._released_bytes < 1300
+        writer.join(0.01)
+    handler.send()
+
+    assert b"".join(handler.sent) == b"".join(chunks)
+    assert _sample("jupyter_archive_download_stall_seconds_count", buffer="write_buffer") > stalls
+
+
+@pytest.mark.parametrize("level", [0, -1])
+async def test_download_concurrent(jp_fetch, jp_root_dir, level):
+    # The downloads share no lock: they are not serialized
+    contents = {}
+    for i in range(4):
+        archive_dir_path = jp_root_dir / f"concurrent-dir{i}"
+        archive_dir_path.mkdir(parents=True)
+        contents[i] = os.urandom(3 * 1024 * 1024)
+        (archive_dir_path / "random.bin").write_bytes(contents[i])
+        for j in range(200):
+            (archive_dir_path / f"small{j}.txt").write_text(f"hello{j}")
+
+    responses = await asyncio.gather(
+        *(
+            jp_fetch(
+                "directories",
+                f"concurrent-dir{i}",
+                params={"archiveToken": i, "archiveFormat": "zip", "compressionLevel": level},
+                method="GET",
+            )
+            for i in range(4)
+        )
+    )
+    for i, r in enumerate(responses):
+        assert r.code == 200
+        with zipfile.ZipFile(r.buffer, mode="r") as zf:
+            assert zf.testzip() is None
+            assert zf.read(f"concurrent-dir{i}/random.bin") == contents[i]
+            assert zf.read(f"concurrent-dir{i}/small199.txt") == b"hello199"
+
+
+@pytest.mark.parametrize("workers, pool", [(1, "thread"), (4, "thread"), (2, "process")])
+async def test_download_parallel_zip(jp_fetch, jp_root_dir, jp_serverapp, workers, pool):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.compression_workers = workers
+    config.compression_pool = pool
+
+    archive_dir_path = jp_root_dir / "parallel-dir"
+    archive_dir_path.mkdir(parents=True)
+    # Spans several compression blocks, with both incompressible and repetitive parts
+    big = os.urandom(1500 * 1024) + b"jupyter-archive" * 200000
+    (archive_dir_path / "big.bin").write_bytes(big)
+    (archive_dir_path / "empty.txt").write_bytes(b"")
+    for i in range(20):
+        (archive_dir_path / f"small{i}.txt").write_text(f"hello{i}")
+
+    params = {"archiveToken": 564646, "archiveFormat": "zip"}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    with zipfile.ZipFile(r.buffer, mode="r") as zf:
+        assert zf.testzip() is None
+        assert zf.read("parallel-dir/big.bin") == big
+        assert zf.read("parallel-dir/empty.txt") == b""
+        for i in range(20):
+            assert zf.read(f"parallel-dir/small{i}.txt") == f"hello{i}".encode()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize(
+    "format, decompress",
+    [
+        ("tar.gz", gzip.decompress),
+        ("tar.bz2", bz2.decompress),
+        ("tar.xz", lzma.decompress),
+        ("tar.zst", "zst"),
+    ],
+)
+async def test_download_parallel_tar(jp_fetch, jp_root_dir, jp_serverapp, workers, format, decompress):
+    if decompress == "zst":
+        _skip_unavailable(decompress)
+        decompress = functools.partial(_decompress, "zst")
+    jp_serverapp.web_app.settings["jupyter_archive"].compression_workers = workers
+
+    archive_dir_path = jp_root_dir / "parallel-dir"
+    archive_dir_path.mkdir(parents=True)
+    # Spans several compression blocks for all formats
+    big = os.urandom(3 * 1024 * 1024) + b"jupyter-archive" * 400000
+    (archive_dir_path / "big.bin").write_bytes(big)
+    (archive_dir_path / "small.txt").write_text("hello")
+
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    # The standard decompressors handle the multiple streams written by several workers
+    with tarfile.open(fileobj=io.BytesIO(decompress(r.body)), mode="r:") as tf:
+        assert tf.extractfile("parallel-dir/big.bin").read() == big
+        assert tf.extractfile("parallel-dir/small.txt").read() == b"hello"
+
+
+@pytest.mark.parametrize("workers, size", [(0, 0), (2, 1), (2, 16 * 1024 * 1024)])
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+async def test_download_read_ahead(jp_fetch, jp_root_dir, jp_serverapp, workers, size, format):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.read_ahead_workers = workers
+    config.read_ahead_size = size
+
+    archive_dir_path = jp_root_dir / "read-ahead-dir"
+    archive_dir_path.mkdir(parents=True)
+    big = os.urandom(2 * 1024 * 1024 + 10)
+    (archive_dir_path / "big.bin").write_bytes(big)
+    for i in range(50):
+        (archive_dir_path / f"small{i}.txt").write_text(f"hello{i}" * i)
+    if platform.system() != "Windows":
+        os.link(archive_dir_path / "big.bin", archive_dir_path / "link.bin")
+
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    if format == "zip":
+        archive = zipfile.ZipFile(r.buffer, mode="r")
+        read = archive.read
+    else:
+        archive = tarfile.open(fileobj=io.BytesIO(gzip.decompress(r.body)), mode="r:")
+
+        def read(name):
+            return archive.extractfile(name).read()
+
+    with archive:
+        assert read("read-ahead-dir/big.bin") == big
+        if platform.system() != "Windows":
+            assert read("read-ahead-dir/link.bin") == big
+        for i in range(50):
+            assert read(f"read-ahead-dir/small{i}.txt") == f"hello{i}".encode() * i
+
+
+@pytest.mark.parametrize("compression", ["gz", "bz2", "xz"])
+async def test_extract_multistream(jp_fetch, jp_root_dir, compression):
+    archive_dir_path = jp_root_dir / "multistream-dir"
+    archive_dir_path.mkdir(parents=True)
+    big = os.urandom(5 * 1024 * 1024)
+    (archive_dir_path / "big.bin").write_bytes(big)
+
+    archive_path = jp_root_dir / f"multistream-dir.tar.{compression}"
+    with open(archive_path, "wb") as f, ThreadPoolExecutor(2) as executor:
+        with open_tar_writer(f, compression, executor=executor, workers=2) as writer:
+            writer.add(archive_dir_path / "big.bin", "multistream-dir/big.bin")
+    shutil.rmtree(archive_dir_path)
+
+    r = await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
+    assert r.code == 200
+    assert (archive_dir_path / "big.bin").read_bytes() == big
+
+
+@pytest.mark.parametrize(
+    "params, stored",
+    [
+        ({}, set()),
+        ({"compressionLevel": 0}, {"image.png", "random.bin", "text.txt"}),
+        ({"compressionLevel": 1, "adaptiveCompression": "true"}, {"image.png", "random.bin"}),
+        ({"adaptiveCompression": "true"}, {"image.png", "random.bin"}),
+    ],
+)
+async def test_download_compression_level(jp_fetch, jp_root_dir, params, stored):
+    archive_dir_path = jp_root_dir / "compression-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "image.png").write_text("not really an image " * 100)
+    (archive_dir_path / "random.bin").write_bytes(os.urandom(256 * 1024))
+    (archive_dir_path / "text.txt").write_text("hello " * 10000)
+
+    params = {"archiveToken": 564646, "archiveFormat": "zip", **params}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    with zipfile.ZipFile(r.buffer, mode="r") as zf:
+        assert zf.testzip() is None
+        for info in zf.infolist():
+            name = info.filename.split("/")[-1]
+            expected = zipfile.ZIP_STORED if name in stored else zipfile.ZIP_DEFLATED
+            assert info.compress_type == expected
+
+
+@pytest.mark.parametrize("level", [0, -1])
+async def test_download_content_length(jp_fetch, jp_root_dir, jp_serverapp, level):
+    jp_serverapp.web_app.settings["jupyter_archive"].handler_max_buffer_length = 64
+    archive_dir_path = jp_root_dir / "length-dir"
+    (archive_dir_path / "folder").mkdir(parents=True)
+    (archive_dir_path / "random.bin").write_bytes(os.urandom(300 * 1024))
+    (archive_dir_path / "folder" / "中文.txt").write_text("你好")
+
+    params = {"archiveToken": 564646, "archiveFormat": "zip", "compressionLevel": level}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+    if level == 0:
+        assert int(r.headers["Content-Length"]) == len(r.body)
+    else:
+        assert "Content-Length" not in r.headers
+
+    with zipfile.ZipFile(r.buffer, mode="r") as zf:
+        assert zf.testzip() is None
+        assert zf.read("length-dir/folder/中文.txt").decode() == "你好"
+
+
+@pytest.mark.parametrize("format, mode", [("tar.gz", "r|gz"), ("tar.bz2", "r|bz2"), ("tar.xz", "r|xz")])
+@pytest.mark.parametrize("level", [0, 1, 9])
+async def test_download_tar_compression_level(jp_fetch, jp_root_dir, format, mode, level):
+    archive_dir_path = jp_root_dir / "compression-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "text.txt").write_text("hello " * 10000)
+
+    params = {"archiveToken": 564646, "archiveFormat": format, "compressionLevel": level}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    with tarfile.open(fileobj=r.buffer, mode=mode) as tf:
+        assert tf.extractfile(tf.next()).read() == b"hello " * 10000
+
+
+@pytest.mark.parametrize("params", [{"compressionLevel": "fast"}, {"compressionLevel": 10}, {"adaptiveCompression": "yes"}])
+async def test_download_invalid_compression(jp_fetch, jp_root_dir, params):
+    archive_dir_path = jp_root_dir / "compression-dir"
+    archive_dir_path.mkdir(parents=True)
+
+    params = {"archiveToken": 564646, "archiveFormat": "zip", **params}
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert e.value.code == 400
+
+
+async def test_download_cache(jp_fetch, jp_root_dir, jp_serverapp, tmp_path):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.archive_cache_dir = str(tmp_path / "cache")
+
+    archive_dir_path = jp_root_dir / "cache-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+
+    params = {"archiveToken": 564646, "archiveFormat": "tar.gz"}
+    first = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    cached = list((tmp_path / "cache").glob("*.archive"))
+    assert len(cached) == 1
+    assert cached[0].read_bytes() == first.body
+
+    # Served from the cache
+    second = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert second.body == first.body
+    assert len(list((tmp_path / "cache").glob("*.archive"))) == 1
+
+    # A change in the directory invalidates the cached archive
+    (archive_dir_path / "test2.txt").write_text("hello2")
+    third = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    with tarfile.open(fileobj=third.buffer, mode="r|gz") as tf:
+        assert {m.name for m in tf.getmembers()} == {"cache-dir/test1.txt", "cache-dir/test2.txt"}
+    assert len(list((tmp_path / "cache").glob("*.archive"))) == 2
+
+    # Other options produce another archive
+    params["downloadHidden"] = "true"
+    await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert len(list((tmp_path / "cache").glob("*.archive"))) == 3
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz", "tar.bz2"])
+async def test_download_range(jp_fetch, jp_root_dir, jp_serverapp, tmp_path, format):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.archive_cache_dir = str(tmp_path / "cache")
+
+    archive_dir_path = jp_root_dir / "range-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "random.bin").write_bytes(os.urandom(100000))
+    (archive_dir_path / "test1.txt").write_text("hello1")
+
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    full = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    etag = full.headers["Etag"]
+    assert full.headers["Accept-Ranges"] == "bytes"
+    size = len(full.body)
+
+    # The cached archive is lost, e.g. evicted: it is rebuilt with the same bytes
+    for path in (tmp_path / "cache").glob("*.archive"):
+        path.unlink()
+
+    for range_header, start, end in [("bytes=1000-", 1000, size), ("bytes=10-19", 10, 20), ("bytes=-100", size - 100, size)]:
+        headers = {"Range": range_header, "If-Range": etag}
+        r = await jp_fetch("directories", archive_dir_path.stem, params=params, headers=headers, method="GET")
+        assert r.code == 206
+        assert r.headers["Etag"] == etag
+        assert r.headers["Content-Range"] == f"bytes {start}-{end - 1}/{size}"
+        assert r.body == full.body[start:end]
+        # Rebuilt for the first range, then read from the cache
+        assert any(cookie.startswith("archiveToken=564646") for cookie in r.headers.get_list("Set-Cookie"))
+
+    # The content changed, the whole new archive is sent
+    (archive_dir_path / "test2.txt").write_text("hello2")
+    headers = {"Range": "bytes=1000-", "If-Range": etag}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, headers=headers, method="GET")
+    assert r.code == 200
+    assert r.headers["Etag"] != etag
+
+    size = len(r.body)
+    for range_header in [f"bytes={size * 2}-", "bytes=-0"]:
+        with pytest.raises(HTTPClientError) as e:
+            headers = {"Range": range_header}
+            await jp_fetch("directories", archive_dir_path.stem, params=params, headers=headers, method="GET")
+        assert e.value.code == 416
+        assert e.value.response.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+async def test_extract_parallel(jp_fetch, jp_root_dir, jp_serverapp, format):
+    jp_serverapp.web_app.settings["jupyter_archive"].extraction_workers = 4
+    big = os.urandom(3 * 1024 * 1024)
+    files = {"parallel-dir/big.bin": big}
+    for i in range(50):
+        files[f"parallel-dir/folder{i % 5}/sub/file{i}.txt"] = f"hello{i}".encode()
+
+    archive_path = jp_root_dir / f"parallel.{format}"
+    if format == "zip":
+        with zipfile.ZipFile(archive_path, "w") as zf:
+            zf.writestr("parallel-dir/empty/", b"")
+            for name, data in files.items():
+                zf.writestr(name, data)
+    else:
+        with tarfile.open(archive_path, "w:gz") as tf:
+            for name, data in files.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                member.mtime = 1234567890
+                tf.addfile(member, io.BytesIO(data))
+            # A read-only directory filled after its creation
+            directory = tarfile.TarInfo("parallel-dir/readonly")
+            directory.type = tarfile.DIRTYPE
+            directory.mode = 0o555
+            tf.addfile(directory)
+            member = tarfile.TarInfo("parallel-dir/readonly/file.txt")
+            member.size = 5
+            tf.addfile(member, io.BytesIO(b"hello"))
+            # A link to a file which was just written
+            link = tarfile.TarInfo("parallel-dir/link.bin")
+            link.type = tarfile.LNKTYPE
+            link.linkname = "parallel-dir/big.bin"
+            link.mtime = 1234567890
+            tf.addfile(link)
+
+    r = await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
+    assert r.code == 200
+
+    for name, data in files.items():
+        assert (jp_root_dir / name).read_bytes() == data
+    if format == "zip":
+        assert (jp_root_dir / "parallel-dir/empty").is_dir()
+    else:
+        assert (jp_root_dir / "parallel-dir/big.bin").stat().st_mtime == 1234567890
+        assert (jp_root_dir / "parallel-dir/readonly/file.txt").read_bytes() == b"hello"
+        assert (jp_root_dir / "parallel-dir/link.bin").read_bytes() == big
+        (jp_root_dir / "parallel-dir/readonly").chmod(0o755)
+
+
+async def test_archive_jobs(jp_fetch, jp_root_dir, jp_serverapp):
+    archive_dir_path = jp_root_dir / "jobs-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+    (archive_dir_path / "test2.txt").write_text("hello22")
+
+    params = {"archiveToken": "download-token", "archiveFormat": "zip"}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    r = await jp_fetch("archive-jobs", "download-token", method="GET")
+    job = json.loads(r.body)
+    assert job["kind"] == "download"
+    assert job["status"] == "finished"
+    assert job["files_processed"] == job["files_total"] == 2
+    assert job["bytes_processed"] == job["bytes_total"] == 13
+    assert job["bytes_written"] > 0
+
+    archive_path = jp_root_dir / "jobs.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("jobs-extracted/test.txt", "hello")
+    r = await jp_fetch(
+        "extract-archive", "jobs.zip", params={"archiveToken": "extract-token"}, method="GET"
+    )
+    assert r.code == 200
+
+    r = await jp_fetch("archive-jobs", method="GET")
+    jobs = {job["id"]: job for job in json.loads(r.body)}
+    assert jobs["extract-token"]["kind"] == "extract"
+    assert jobs["extract-token"]["status"] == "finished"
+    assert jobs["extract-token"]["bytes_processed"] == 5
+    # The paths are relative to the server root
+    assert jobs["extract-token"]["path"] == "jobs.zip"
+    assert jobs["download-token"]["path"] == "jobs-dir"
+
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("archive-jobs", "unknown", method="GET")
+    assert e.value.code == 404
+
+    # The jobs of the other users are not reported nor canceled
+    jp_serverapp.web_app.settings["jupyter_archive"].start_job("extract", "other.zip", "other-token", user="other")
+    r = await jp_fetch("archive-jobs", method="GET")
+    assert "other-token" not in {job["id"] for job in json.loads(r.body)}
+    for method in ("GET", "DELETE"):
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch("archive-jobs", "other-token", method=method)
+        assert e.value.code == 404
+    assert not jp_serverapp.web_app.settings["jupyter_archive"].jobs.get("other-token").cancel_requested
+
+
+async def test_extract_job(jp_fetch, jp_root_dir, jp_serverapp):
+    archive_path = jp_root_dir / "job.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("job-extracted/test.txt", "hello")
+
+    r = await jp_fetch("extract-archive", "job.zip", params={"archiveToken": "job-token"}, method="POST", body=b"")
+    assert r.code == 202
+    assert r.headers["Location"].endswith("/archive-jobs/job-token")
+    assert json.loads(r.body)["id"] == "job-token"
+
+    for _ in range(100):
+        r = await jp_fetch("archive-jobs", "job-token", method="GET")
+        job = json.loads(r.body)
+        if job["status"] not in ("pending", "running"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "finished"
+    assert (jp_root_dir / "job-extracted/test.txt").read_text() == "hello"
+
+
+async def test_extract_incremental(jp_fetch, jp_root_dir):
+    archive_path = jp_root_dir / "dataset.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("dataset/same.txt", "same")
+        zf.writestr("dataset/changed.txt", "old")
+
+    params = {"archiveToken": "first-token", "incremental": "true"}
+    await jp_fetch("extract-archive", "dataset.zip", params=params, method="GET")
+    r = await jp_fetch("archive-jobs", "first-token", method="GET")
+    assert json.loads(r.body)["files_skipped"] == 0
+
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("dataset/same.txt", "same")
+        zf.writestr("dataset/changed.txt", "new!")
+    params = {"archiveToken": "second-token", "incremental": "true"}
+    await jp_fetch("extract-archive", "dataset.zip", params=params, method="GET")
+    r = await jp_fetch("archive-jobs", "second-token", method="GET")
+    job = json.loads(r.body)
+    assert job["files_skipped"] == 1
+    assert job["files_processed"] == 2
+    assert (jp_root_dir / "dataset/changed.txt").read_text() == "new!"
+
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("extract-archive", "dataset.zip", params={"incremental": "yes"}, method="GET")
+    assert e.value.code == 400
+
+
+async def test_extract_job_cancel(jp_fetch, jp_root_dir, jp_serverapp):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.max_extraction_jobs = 1
+    archive_path = jp_root_dir / "job.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("job-extracted/test.txt", "hello")
+
+    # Keep the only extraction worker busy so that the job waits in the queue
+    release = threading.Event()
+    config.get_extraction_job_executor().submit(release.wait)
+    try:
+        r = await jp_fetch("extract-archive", "job.zip", method="POST", body=b"")
+        job_id = json.loads(r.body)["id"]
+        assert json.loads(r.body)["status"] == "pending"
+
+        r = await jp_fetch("archive-jobs", job_id, method="DELETE")
+        assert r.code == 202
+        assert json.loads(r.body)["cancel_requested"]
+    finally:
+        release.set()
+
+    for _ in range(100):
+        r = await jp_fetch("archive-jobs", job_id, method="GET")
+        job = json.loads(r.body)
+        if job["status"] not in ("pending", "running"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "canceled"
+    assert not (jp_root_dir / "job-extracted").exists()
+
+    # Downloads are canceled by closing their connection
+    archive_dir_path = jp_root_dir / "jobs-dir"
+    archive_dir_path.mkdir(parents=True)
+    params = {"archiveToken": "download-token", "archiveFormat": "zip"}
+    await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("archive-jobs", "download-token", method="DELETE")
+    assert e.value.code == 400
+
+
+async def _wait_job(jp_fetch, job_id):
+    for _ in range(100):
+        r = await jp_fetch("archive-jobs", job_id, method="GET")
+        job = json.loads(r.body)
+        if job["status"] not in ("pending", "running"):
+            return job
+        await asyncio.sleep(0.05)
+    return job
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+async def test_compress_job(jp_fetch, jp_root_dir, format):
+    archive_dir_path = jp_root_dir / "compress-dir"
+    (archive_dir_path / "sub").mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+    (archive_dir_path / "sub/test2.txt").write_text("hello22")
+    (archive_dir_path / "test.log").write_text("log")
+
+    params = {"archiveToken": "compress-token", "archiveFormat": format, "exclude": "*.log"}
+    r = await jp_fetch("compress-archive", "compress-dir", params=params, method="POST", body=b"")
+    assert r.code == 202
+    assert r.headers["Location"].endswith("/archive-jobs/compress-token")
+    reply = json.loads(r.body)
+    assert reply["kind"] == "compress"
+    assert reply["archive"] == f"compress-dir.{format}"
+
+    job = await _wait_job(jp_fetch, "compress-token")
+    assert job["status"] == "finished"
+    assert job["files_processed"] == job["files_total"] == 2
+    archive_path = jp_root_dir / f"compress-dir.{format}"
+    assert job["bytes_written"] == archive_path.stat().st_size
+    if format == "zip":
+        with zipfile.ZipFile(archive_path) as zf:
+            assert set(zf.namelist()) == {"compress-dir/test1.txt", "compress-dir/sub/test2.txt"}
+    else:
+        with tarfile.open(archive_path) as tf:
+            assert set(member.name for member in tf if member.isreg()) == {
+                "compress-dir/test1.txt",
+                "compress-dir/sub/test2.txt",
+            }
+    # No temporary file is left
+    assert not any(path.name.startswith(".compress-dir") for path in jp_root_dir.iterdir())
+
+    # The archive is not overwritten
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("compress-archive", "compress-dir", params=params, method="POST", body=b"")
+    assert e.value.code == 409
+
+    # A selection, named and written into the folder itself
+    params = [("archiveFormat", format), ("path", "sub"), ("name", "sub-only"), ("destination", "compress-dir")]
+    r = await jp_fetch("compress-archive", "compress-dir", params=params, method="POST", body=b"")
+    assert json.loads(r.body)["archive"] == "compress-dir/sub-only"
+    job = await _wait_job(jp_fetch, json.loads(r.body)["id"])
+    assert job["status"] == "finished"
+    assert job["files_total"] == 1
+
+    for params, code in [
+        ({"name": "../escape.zip"}, 400),
+        ({"destination": "../"}, 400),
+        ({"destination": "missing"}, 404),
+    ]:
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch("compress-archive", "compress-dir", params=params, method="POST", body=b"")
+        assert e.value.code == code
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("compress-archive", "missing-dir", method="POST", body=b"")
+    assert e.value.code == 404
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("compress-archive", "compress-dir/test1.txt", method="POST", body=b"")
+    assert e.value.code == 400
+    assert not (archive_dir_path / "test1.txt.zip").exists()
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("compress-archive", "compress-dir", method="GET")
+    assert e.value.code == 405
+
+
+async def test_compress_job_cancel(jp_fetch, jp_root_dir, jp_serverapp):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.max_download_jobs = 1
+    archive_dir_path = jp_root_dir / "compress-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+
+    # Keep the only download worker busy so that the job waits in the queue
+    release = threading.Event()
+    config.get_download_executor().submit(release.wait)
+    try:
+        r = await jp_fetch("compress-archive", "compress-dir", method="POST", body=b"")
+        job_id = json.loads(r.body)["id"]
+        assert json.loads(r.body)["status"] == "pending"
+
+        r = await jp_fetch("archive-jobs", job_id, method="DELETE")
+        assert r.code == 202
+    finally:
+        release.set()
+
+    job = await _wait_job(jp_fetch, job_id)
+    assert job["status"] == "canceled"
+    assert sorted(path.name for path in jp_root_dir.iterdir()) == ["compress-dir"]
+
+
+async def test_compress_job_target_created(jp_fetch, jp_root_dir, jp_serverapp):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.max_download_jobs = 1
+    archive_dir_path = jp_root_dir / "compress-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+
+    release = threading.Event()
+    config.get_download_executor().submit(release.wait)
+    try:
+        r = await jp_fetch("compress-archive", "compress-dir", method="POST", body=b"")
+        job_id = json.loads(r.body)["id"]
+        # The archive file is created by someone else while the job waits
+        (jp_root_dir / "compress-dir.zip").write_text("mine")
+    finally:
+        release.set()
+
+    job = await _wait_job(jp_fetch, job_id)
+    assert job["status"] == "failed"
+    assert "already exists" in job["error"]
+    assert (jp_root_dir / "compress-dir.zip").read_text() == "mine"
+    assert sorted(path.name for path in jp_root_dir.iterdir()) == ["compress-dir", "compress-dir.zip"]
+
+
+@pytest.mark.parametrize("limit, code", [("max_jobs", 503), ("max_jobs_per_user", 429)])
+async def test_job_admission(jp_fetch, jp_root_dir, jp_serverapp, monkeypatch, limit, code):
+    # The requests authenticated with the token are made by a new anonymous user otherwise
+    monkeypatch.setattr(jp_serverapp.identity_provider, "generate_anonymous_user", lambda handler: User("alice"))
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.max_extraction_jobs = 1
+    setattr(config, limit, 1)
+    config.retry_after = 7
+    archive_path = jp_root_dir / "job.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("job-extracted/test.txt", "hello")
+    archive_dir_path = jp_root_dir / "admission-dir"
+    archive_dir_path.mkdir(parents=True)
+    params = {"archiveToken": 564646, "archiveFormat": "zip"}
+
+    release = threading.Event()
+    config.get_extraction_job_executor().submit(release.wait)
+    try:
+        # The pending extraction fills the quota
+        r = await jp_fetch("extract-archive", "job.zip", method="POST", body=b"")
+        job_id = json.loads(r.body)["id"]
+
+        for fetch in (
+            jp_fetch("directories", archive_dir_path.stem, params=params, method="GET"),
+            jp_fetch("extract-archive", "job.zip", method="POST", body=b""),
+        ):
+            with pytest.raises(HTTPClientError) as e:
+                await fetch
+            assert e.value.code == code
+            assert e.value.response.headers["Retry-After"] == "7"
+    finally:
+        release.set()
+
+    for _ in range(100):
+        r = await jp_fetch("archive-jobs", job_id, method="GET")
+        if json.loads(r.body)["status"] == "finished":
+            break
+        await asyncio.sleep(0.05)
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+
+async def test_job_token_reuse(jp_fetch, jp_root_dir, jp_serverapp):
+    config = jp_serverapp.web_app.settings["jupyter_archive"]
+    config.max_extraction_jobs = 1
+    config.max_jobs = 2
+    archive_path = jp_root_dir / "job.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("job-extracted/test.txt", "hello")
+    params = {"archiveToken": "shared-token"}
+
+    release = threading.Event()
+    config.get_extraction_job_executor().submit(release.wait)
+    try:
+        r = await jp_fetch("extract-archive", "job.zip", params=params, method="POST", body=b"")
+        assert r.code == 202
+        # The token of an active job cannot replace it to get past max_jobs
+        for _ in range(5):
+            with pytest.raises(HTTPClientError) as e:
+                await jp_fetch("extract-archive", "job.zip", params=params, method="POST", body=b"")
+            assert e.value.code == 409
+        r = await jp_fetch("archive-jobs", method="GET")
+        assert [job["id"] for job in json.loads(r.body) if job["status"] in ("pending", "running")] == [
+            "shared-token"
+        ]
+        # The limit still counts the first job
+        await jp_fetch("extract-archive", "job.zip", method="POST", body=b"")
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch("extract-archive", "job.zip", method="POST", body=b"")
+        assert e.value.code == 503
+    finally:
+        release.set()
+
+    for _ in range(100):
+        r = await jp_fetch("archive-jobs", "shared-token", method="GET")
+        if json.loads(r.body)["status"] == "finished":
+            break
+        await asyncio.sleep(0.05)
+    # Once finished, the token can be used again
+    r = await jp_fetch("extract-archive", "job.zip", params=params, method="POST", body=b"")
+    assert r.code == 202
+    assert (await _wait_job(jp_fetch, "shared-token"))["status"] == "finished"
+
+
+async def test_profile(jp_fetch, jp_root_dir, jp_serverapp, tmp_path):
+    jp_serverapp.web_app.settings["jupyter_archive"].profile_dir = str(tmp_path / "profiles")
+    archive_dir_path, archive_path = _create_archive_file(jp_root_dir, "profile-dir", "zip", "w")
+
+    await jp_fetch("extract-archive", archive_path.relative_to(jp_root_dir).as_posix(), method="GET")
+    params = {"archiveToken": 564646, "archiveFormat": "tar.gz"}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+
+    profiles = sorted((tmp_path / "profiles").iterdir())
+    assert [path.name.split("-")[0] for path in profiles] == ["download", "extract"]
+    functions = {function for _, _, function in pstats.Stats(str(profiles[0])).stats}
+    assert "archive_and_download" in functions
+
+
+async def test_metrics(jp_fetch, jp_root_dir):
+    archive_dir_path = jp_root_dir / "metrics-dir"
+    archive_dir_path.mkdir(parents=True)
+    (archive_dir_path / "test1.txt").write_text("hello1")
+    (archive_dir_path / "test2.txt").write_text("hello22")
+    download = {"kind": "download", "format": "tar.gz"}
+    extract = {"kind": "extract", "format": "zip"}
+    names = [
+        ("jupyter_archive_bytes_in_total", download),
+        ("jupyter_archive_bytes_out_total", download),
+        ("jupyter_archive_download_first_byte_seconds_count", {"format": "tar.gz"}),
+        ("jupyter_archive_job_duration_seconds_count", dict(download, status="finished")),
+        ("jupyter_archive_job_queue_seconds_count", {"kind": "download"}),
+        ("jupyter_archive_bytes_in_total", extract),
+        ("jupyter_archive_bytes_out_total", extract),
+        ("jupyter_archive_job_duration_seconds_count", dict(extract, status="finished")),
+        ("jupyter_archive_active_jobs", {"kind": "download"}),
+        ("jupyter_archive_active_jobs", {"kind": "extract"}),
+        ("jupyter_archive_download_buffered_bytes", {}),
+    ]
+    before = [_sample(name, **labels) for name, labels in names]
+
+    params = {"archiveToken": "metrics-token", "archiveFormat": "tgz"}
+    r = await jp_fetch("directories", archive_dir_path.stem, params=params, method="GET")
+    assert r.code == 200
+    archive_size = len(r.body)
+    archive_path = jp_root_dir / "metrics.zip"
+    with zipfile.ZipFile(archive_path, "w") as zf:
+        zf.writestr("metrics-extracted/test.txt", "hello")
+    r = await jp_fetch("extract-archive", "metrics.zip", method="GET")
+    assert r.code == 200
+
+    after = [_sample(name, **labels) for name, labels in names]
+    deltas = [a - b for a, b in zip(after, before)]
+    assert deltas == [13, archive_size, 1, 1, 1, archive_path.stat().st_size, 5, 1, 0, 0, 0]
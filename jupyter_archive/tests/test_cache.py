@@ -0,0 +1,51 @@
+import os
+
+from jupyter_archive.cache import ArchiveCache, fingerprint
+from jupyter_archive.scanner import scan_files
+
+
+def _add(cache, key, size):
+    entry = cache.open(key)
+    entry.write(b"x" * size)
+    entry.commit()
+
+
+def test_cache_eviction(tmp_path):
+    cache = ArchiveCache(str(tmp_path), max_size=250)
+
+    _add(cache, "a", 100)
+    _add(cache, "b", 100)
+    os.utime(cache.path("a"), (1, 1))
+    os.utime(cache.path("b"), (2, 2))
+    # "a" is now the most recently used
+    assert cache.get("a") == cache.path("a")
+
+    _add(cache, "c", 100)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_cache_entry_too_large(tmp_path):
+    cache = ArchiveCache(str(tmp_path), max_size=10)
+    _add(cache, "a", 100)
+    assert cache.get("a") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_cache_entry_discard(tmp_path):
+    cache = ArchiveCache(str(tmp_path), max_size=1000)
+    entry = cache.open("a")
+    entry.write(b"partial")
+    entry.discard()
+    assert cache.get("a") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_fingerprint(tmp_path):
+    (tmp_path / "a.txt").write_text("hello")
+    first = fingerprint(scan_files(tmp_path))
+    assert fingerprint(scan_files(tmp_path)) == first
+
+    (tmp_path / "a.txt").write_text("hello world")
+    assert fingerprint(scan_files(tmp_path)) != first
@@ -0,0 +1,227 @@
+import asyncio
+import base64
+import io
+import json
+import tarfile
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+from jupyter_server.services.contents.manager import AsyncContentsManager
+from tornado import web
+from tornado.httpclient import HTTPClientError
+
+from jupyter_archive.tarstream import is_available, open_tar_writer
+
+
+class MemoryContentsManager(AsyncContentsManager):
+    """Contents manager keeping the files in memory, as a database-backed one would."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files = {}
+        self.directories = {""}
+        self.max_concurrent_saves = 0
+        self._saving = 0
+        # Paths of the files fetched with their content
+        self.fetched = []
+
+    def add(self, path, data):
+        parts = path.split("/")
+        for n in range(1, len(parts)):
+            self.directories.add("/".join(parts[:n]))
+        self.files[path] = data
+
+    def _model(self, path, content=False):
+        is_dir = path in self.directories
+        model = {
+            "name": path.rpartition("/")[2],
+            "path": path,
+            "type": "directory" if is_dir else "file",
+            "mimetype": None,
+            "writable": True,
+            "created": datetime(2020, 1, 1, tzinfo=timezone.utc),
+            "last_modified": datetime(2020, 1, 1, tzinfo=timezone.utc),
+            "size": None if is_dir else len(self.files[path]),
+            "content": None,
+            "format": None,
+        }
+        if content and is_dir:
+            prefix = path + "/" if path else ""
+            children = [
+                other
+                for other in (self.directories | set(self.files))
+                if other and other.startswith(prefix) and "/" not in other[len(prefix):]
+            ]
+            model["content"] = [self._model(child) for child in children]
+            model["format"] = "json"
+        elif content:
+            model["content"] = base64.b64encode(self.files[path]).decode("ascii")
+            model["format"] = "base64"
+        return model
+
+    async def get(self, path, content=True, type=None, format=None, require_hash=False):
+        path = path.strip("/")
+        if path not in self.directories and path not in self.files:
+            raise web.HTTPError(404, "No such file or directory: {}".format(path))
+        if content and path in self.files:
+            self.fetched.append(path)
+        return self._model(path, content)
+
+    async def save(self, model, path):
+        path = path.strip("/")
+        if model["type"] == "directory":
+            self.directories.add(path)
+            return self._model(path)
+        self._saving += 1
+        self.max_concurrent_saves = max(self.max_concurrent_saves, self._saving)
+        try:
+            # Let the other saves of the batch start
+            await asyncio.sleep(0.001)
+            self.files[path] = base64.b64decode(model["content"])
+        finally:
+            self._saving -= 1
+        return self._model(path)
+
+    async def delete_file(self, path):
+        path = path.strip("/")
+        self.files.pop(path, None)
+        self.directories.discard(path)
+
+    async def rename_file(self, old_path, new_path):
+        raise NotImplementedError
+
+    async def file_exists(self, path=""):
+        return path.strip("/") in self.files
+
+    async def dir_exists(self, path):
+        return path.strip("/") in self.directories
+
+    async def is_hidden(self, path):
+        return any(part.startswith(".") for part in path.strip("/").split("/"))
+
+
+@pytest.fixture
+def jp_server_config(jp_server_config):
+    return {
+        "ServerApp": {
+            "jpserver_extensions": {"jupyter_archive": True},
+            "contents_manager_class": MemoryContentsManager,
+        }
+    }
+
+
+@pytest.fixture
+def contents(jp_serverapp):
+    cm = jp_serverapp.contents_manager
+    assert isinstance(cm, MemoryContentsManager)
+    cm.add("folder/a.txt", b"hello a")
+    cm.add("folder/sub/b.txt", b"hello b" * 100000)
+    cm.add("folder/sub/c.log", b"log")
+    cm.add("folder/.hidden.txt", b"hidden")
+    return cm
+
+
+def _members(format, body):
+    if format == "zip":
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    with tarfile.open(fileobj=io.BytesIO(body), mode="r:gz") as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive if member.isreg()}
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+async def test_download_contents(jp_fetch, contents, format):
+    params = {"archiveToken": 564646, "archiveFormat": format}
+    r = await jp_fetch("directories", "folder", params=params, method="GET")
+    assert r.code == 200
+    contents.fetched.clear()
+    assert _members(format, r.body) == {
+        "folder/a.txt": b"hello a",
+        "folder/sub/b.txt": b"hello b" * 100000,
+        "folder/sub/c.log": b"log",
+    }
+
+    # A selection of paths, filtered
+    params = list(params.items()) + [("path", "sub"), ("path", "a.txt"), ("exclude", "*.log"), ("compressionLevel", 0)]
+    r = await jp_fetch("directories", "folder", params=params, method="GET")
+    assert _members(format, r.body) == {"a.txt": b"hello a", "sub/b.txt": b"hello b" * 100000}
+    # Each file is fetched once, when it is archived
+    assert sorted(contents.fetched) == ["folder/a.txt", "folder/sub/b.txt"]
+
+
+async def test_download_contents_missing(jp_fetch, contents):
+    params = {"archiveToken": 564646, "path": "missing.txt"}
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("directories", "folder", params=params, method="GET")
+    assert e.value.code == 404
+
+
+async def test_local_only(jp_fetch, contents):
+    # The archives are written and extracted incrementally on the local file system only
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("compress-archive", "folder", method="POST", body=b"")
+    assert e.value.code == 400
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("extract-archive", "folder/a.txt", params={"incremental": "true"}, method="GET")
+    assert e.value.code == 400
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz", "tar.zst", "tar.lz4"])
+async def test_extract_contents(jp_fetch, jp_serverapp, contents, format):
+    if format[4:] in ("zst", "lz4") and not is_available(format[4:]):
+        pytest.skip(f"The {format[4:]} compression library is not installed")
+    jp_serverapp.web_app.settings["jupyter_archive"].contents_prefetch = 4
+    files = {"archive/file{}.txt".format(i): "content {}".format(i).encode() for i in range(10)}
+    files["archive/sub/large.bin"] = bytes(range(256)) * 1000
+    body = io.BytesIO()
+    if format == "zip":
+        with zipfile.ZipFile(body, "w") as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+    else:
+        if format == "tar.gz":
+            archive = tarfile.open(fileobj=body, mode="w:gz")
+        else:
+            archive = open_tar_writer(body, format[4:])
+        with archive:
+            for name, data in files.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+    contents.add(f"folder/archive.{format}", body.getvalue())
+
+    r = await jp_fetch("extract-archive", f"folder/archive.{format}", method="GET")
+    assert r.code == 200
+    for name, data in files.items():
+        assert contents.files["folder/" + name] == data
+    assert "folder/archive/sub" in contents.directories
+    # The files are saved by batches
+    assert 1 < contents.max_concurrent_saves <= 4
+
+    # Some members, into another folder
+    contents.directories.add("other")
+    params = [("member", "archive/sub"), ("destination", "other")]
+    r = await jp_fetch("extract-archive", f"folder/archive.{format}", params=params, method="GET")
+    assert r.code == 200
+    assert sorted(path for path in contents.files if path.startswith("other/")) == ["other/archive/sub/large.bin"]
+
+    r = await jp_fetch("archive-contents", f"folder/archive.{format}", method="GET")
+    assert sorted(member["name"] for member in json.loads(r.body)) == sorted(files)
+
+
+async def test_extract_contents_rollback(jp_fetch, contents):
+    body = io.BytesIO()
+    with tarfile.open(fileobj=body, mode="w:gz") as archive:
+        for name in ["unsafe/a.txt", "../evil.txt"]:
+            member = tarfile.TarInfo(name)
+            member.size = 4
+            archive.addfile(member, io.BytesIO(b"evil"))
+    contents.add("folder/unsafe.tar.gz", body.getvalue())
+    before = set(contents.files), set(contents.directories)
+
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch("extract-archive", "folder/unsafe.tar.gz", method="GET")
+    assert e.value.code == 400
+    # The members extracted before the unsafe one are deleted
+    assert (set(contents.files), set(contents.directories)) == before
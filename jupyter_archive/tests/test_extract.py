@@ -0,0 +1,247 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive import extract
+from jupyter_archive.extract import (
+    CreatedPaths,
+    ExtractionLimitError,
+    ExtractionQuota,
+    extract_incremental,
+    extract_tar,
+    extract_zip,
+)
+from jupyter_archive.jobs import Job
+from jupyter_archive.tarstream import is_available, open_tar_reader, open_tar_writer
+
+
+class _CancelAfter(Job):
+    # Job canceled once `count` members are extracted
+    def __init__(self, count):
+        super().__init__(None, "extract", "")
+        self.count = count
+
+    def advance(self, files=0, nbytes=0):
+        super().advance(files, nbytes)
+        if self.files_processed >= self.count:
+            self.cancel()
+
+
+def _make_archive(path, format):
+    names = ["folder/existing.txt"] + [f"folder/sub{i}/file{i}.txt" for i in range(10)]
+    if format == "zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            for name in names:
+                zf.writestr(name, "new")
+    else:
+        with tarfile.open(path, "w:gz") as tf:
+            for name in names:
+                member = tarfile.TarInfo(name)
+                member.size = 3
+                tf.addfile(member, io.BytesIO(b"new"))
+
+
+def _extract(path, destination, format, parallel, job, created, quota=None):
+    if format == "zip":
+        with ThreadPoolExecutor(2) as executor:
+            extract_zip(path, destination, executor if parallel else None, 2, job, created, quota=quota)
+    else:
+        with tarfile.open(path, "r:gz") as archive:
+            extract_tar(archive, destination, parallel, job, created, quota)
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+@pytest.mark.parametrize("parallel", [False, True])
+def test_extract_cancel_rollback(tmp_path, format, parallel):
+    archive_path = tmp_path / f"archive.{format}"
+    _make_archive(archive_path, format)
+    destination = tmp_path / "destination"
+    (destination / "folder").mkdir(parents=True)
+    (destination / "folder" / "existing.txt").write_text("old")
+    (destination / "other.txt").write_text("other")
+
+    job = _CancelAfter(3)
+    created = CreatedPaths(destination)
+    _extract(archive_path, destination, format, parallel, job, created)
+    assert job.cancel_requested
+    # The extraction stopped between two members
+    assert job.files_processed < 11
+
+    created.rollback()
+    remaining = sorted(str(path.relative_to(destination)) for path in destination.rglob("*"))
+    assert remaining == ["folder", os.path.join("folder", "existing.txt"), "other.txt"]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_extract_failure_rollback(tmp_path, parallel):
+    archive_path = tmp_path / "archive.tar.gz"
+    with tarfile.open(archive_path, "w:gz") as tf:
+        member = tarfile.TarInfo("folder/file.txt")
+        member.size = 3
+        tf.addfile(member, io.BytesIO(b"new"))
+        link = tarfile.TarInfo("folder/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "../../outside"
+        tf.addfile(link)
+    destination = tmp_path / "destination"
+    destination.mkdir()
+
+    created = CreatedPaths(destination)
+    with pytest.raises(tarfile.FilterError):
+        _extract(archive_path, destination, "tar.gz", parallel, Job(None, "extract", ""), created)
+    assert (destination / "folder" / "file.txt").exists()
+
+    created.rollback()
+    assert list(destination.iterdir()) == []
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+@pytest.mark.parametrize("parallel", [False, True])
+@pytest.mark.parametrize(
+    "limits, message",
+    [
+        ({"max_members": 5}, "more than 5 members"),
+        ({"max_size": 20}, "larger than 20 bytes"),
+        ({"free_space": 20}, "Not enough disk space"),
+    ],
+)
+def test_extract_quota(tmp_path, format, parallel, limits, message):
+    archive_path = tmp_path / f"archive.{format}"
+    _make_archive(archive_path, format)
+    destination = tmp_path / "destination"
+    destination.mkdir()
+
+    created = CreatedPaths(destination)
+    quota = ExtractionQuota(archive_path.stat().st_size, **limits)
+    with pytest.raises(ExtractionLimitError, match=message):
+        _extract(archive_path, destination, format, parallel, Job(None, "extract", ""), created, quota)
+    if format == "zip":
+        # Checked from the central directory before anything is written
+        assert list(destination.iterdir()) == []
+    created.rollback()
+    assert list(destination.iterdir()) == []
+
+    # The archive fits in the default limits
+    quota = ExtractionQuota(archive_path.stat().st_size, max_ratio=1000)
+    _extract(archive_path, destination, format, parallel, Job(None, "extract", ""), None, quota)
+    assert quota.members == 11
+    assert quota.size == 33
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+def test_extract_bomb(tmp_path, monkeypatch, format):
+    monkeypatch.setattr(extract, "RATIO_MIN_SIZE", 1024 * 1024)
+    archive_path = tmp_path / f"archive.{format}"
+    names = [f"zeros{i}" for i in range(8)]
+    if format == "zip":
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name in names:
+                zf.writestr(name, bytes(1024 * 1024))
+    else:
+        with tarfile.open(archive_path, "w:gz") as tf:
+            for name in names:
+                member = tarfile.TarInfo(name)
+                member.size = 1024 * 1024
+                tf.addfile(member, io.BytesIO(bytes(member.size)))
+    destination = tmp_path / "destination"
+    destination.mkdir()
+
+    quota = ExtractionQuota(archive_path.stat().st_size, max_ratio=100)
+    with pytest.raises(ExtractionLimitError, match="decompression bomb"):
+        _extract(archive_path, destination, format, False, Job(None, "extract", ""), None, quota)
+    # Stopped before the extracted size exceeds the ratio
+    extracted = sum(path.stat().st_size for path in destination.iterdir())
+    assert extracted <= max(1024 * 1024, 100 * archive_path.stat().st_size)
+
+
+def _make_dataset(path, format, files, mtime):
+    if format == "zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, data in files.items():
+                zf.writestr(zipfile.ZipInfo(name, time.localtime(mtime)[:6]), data)
+        return
+    with open(path, "wb") as f:
+        if format == "tar.gz":
+            tf = tarfile.open(fileobj=f, mode="w:gz")
+        else:
+            tf = open_tar_writer(f, format[4:])
+        with tf:
+            for name, data in files.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                member.mtime = mtime
+                tf.addfile(member, io.BytesIO(data))
+
+
+def _open(path, format):
+    if format == "zip":
+        return zipfile.ZipFile(path)
+    if format == "tar.gz":
+        return tarfile.open(path, "r:gz")
+    # Streaming mode
+    return open_tar_reader(path, format[4:])
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz", "tar.zst", "tar.lz4"])
+def test_extract_incremental(tmp_path, format):
+    if format[4:] in ("zst", "lz4") and not is_available(format[4:]):
+        pytest.skip(f"The {format[4:]} compression library is not installed")
+    archive_path = tmp_path / f"archive.{format}"
+    files = {"data/same.txt": b"same", "data/changed.txt": b"old!", "data/sub/new.txt": b"new"}
+    _make_dataset(archive_path, format, files, 1600000000)
+    destination = tmp_path / "destination"
+    destination.mkdir()
+
+    with _open(archive_path, format) as archive:
+        extract_incremental(archive, destination)
+    for name, data in files.items():
+        assert (destination / name).read_bytes() == data
+        assert abs((destination / name).stat().st_mtime - 1600000000) < 2
+
+    # The dataset is updated: a file changed with the same size, another one is new
+    files["data/changed.txt"] = b"new!"
+    files["data/other.txt"] = b"other"
+    _make_dataset(archive_path, format, files, 1600000000)
+    (destination / "data/changed.txt").write_bytes(b"old!")
+    os.utime(destination / "data/changed.txt", (1500000000, 1500000000))
+    inode = (destination / "data/same.txt").stat().st_ino
+
+    job = Job(None, "extract", "")
+    created = CreatedPaths(destination)
+    with _open(archive_path, format) as archive:
+        extract_incremental(archive, destination, job, created)
+    for name, data in files.items():
+        assert (destination / name).read_bytes() == data
+    assert (destination / "data/same.txt").stat().st_ino == inode
+    assert job.files_skipped == 2
+    assert created.paths == [str(destination / "data/other.txt")]
+    # Nothing is left of the temporary files
+    remaining = sorted(path.name for path in (destination / "data").iterdir())
+    assert remaining == ["changed.txt", "other.txt", "same.txt", "sub"]
+
+    # Files with the same content but another mtime
+    os.utime(destination / "data/same.txt", (1500000000, 1500000000))
+    job = Job(None, "extract", "")
+    with _open(archive_path, format) as archive:
+        extract_incremental(archive, destination, job, names=["data/same.txt"])
+    if format == "zip":
+        # Compared with the CRC-32 of the central directory, and the mtime is fixed
+        assert job.files_skipped == 1
+        assert (destination / "data/same.txt").stat().st_ino == inode
+    else:
+        assert job.files_skipped == 0
+    assert abs((destination / "data/same.txt").stat().st_mtime - 1600000000) < 2
+    assert job.files_processed == 1
+
+    # A selected folder brings its content, and an unknown name is an error
+    job = Job(None, "extract", "")
+    with _open(archive_path, format) as archive:
+        extract_incremental(archive, destination, job, names=["data/sub"])
+    assert (job.files_processed, job.files_skipped) == (1, 1)
+    with _open(archive_path, format) as archive, pytest.raises(KeyError):
+        extract_incremental(archive, destination, names=["data/missing.txt"])
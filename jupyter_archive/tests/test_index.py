@@ -0,0 +1,168 @@
+import gzip
+import io
+import os
+import random
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive import index
+from jupyter_archive.cache import ArchiveCache
+from jupyter_archive.extract import extract_tar_members, extract_zip
+from jupyter_archive.index import IndexedReader, build_tar_index, list_members, select_members, tar_index
+from jupyter_archive.tarstream import open_tar_writer
+
+
+def _content(size, seed):
+    # Compressible but not trivially
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b"abcdefghij", k=rng.randint(1, 8))) for _ in range(200)]
+    data = b" ".join(rng.choices(words, k=size // 4))
+    return data[:size]
+
+
+def _write_tar(path, files, parallel):
+    with open(path, "wb") as f:
+        if parallel:
+            with ThreadPoolExecutor(2) as executor, open_tar_writer(f, "gz", 6, executor, 2) as archive:
+                _add_files(archive, files)
+        else:
+            with tarfile.open(fileobj=f, mode="w:gz") as archive:
+                _add_files(archive, files)
+
+
+def _add_files(archive, files):
+    for name, data in files.items():
+        member = tarfile.TarInfo(name)
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_indexed_reader(tmp_path, monkeypatch, parallel):
+    monkeypatch.setattr(index, "CHECKPOINT_SPACING", 512 * 1024)
+    files = {f"folder/file{i}.txt": _content(700 * 1024, i) for i in range(6)}
+    archive_path = tmp_path / "archive.tar.gz"
+    _write_tar(archive_path, files, parallel)
+    data = gzip.decompress(archive_path.read_bytes())
+
+    tar_index = build_tar_index(archive_path, "gz")
+    assert [entry["name"] for entry in tar_index["members"]] == list(files)
+    if parallel:
+        # The blocks compressed in parallel end with a sync flush
+        assert len(tar_index["checkpoints"]) > 3
+    else:
+        assert len(tar_index["checkpoints"]) == 1
+
+    rng = random.Random(0)
+    with IndexedReader(archive_path, tar_index) as reader:
+        for _ in range(20):
+            position = rng.randrange(len(data))
+            reader.seek(position)
+            assert reader.read(10000) == data[position:position + 10000]
+        reader.seek(0)
+        assert reader.read() == data
+
+
+def test_indexed_reader_multiple_members(tmp_path):
+    first = io.BytesIO()
+    with tarfile.open(fileobj=first, mode="w") as archive:
+        _add_files(archive, {"a.txt": b"a" * 5000, "b.txt": b"b" * 20000})
+    data = first.getvalue()
+    archive_path = tmp_path / "archive.tar.gz"
+    # Two gzip members, the first one with a file name in its header, and zero padding
+    with open(archive_path, "wb") as f:
+        with gzip.GzipFile("archive.tar", "wb", fileobj=f) as member:
+            member.write(data[:10000])
+        f.write(gzip.compress(data[10000:]) + b"\0" * 10)
+
+    tar_index = build_tar_index(archive_path, "gz")
+    assert [entry["name"] for entry in tar_index["members"]] == ["a.txt", "b.txt"]
+    with IndexedReader(archive_path, tar_index) as reader:
+        reader.seek(9000)
+        assert reader.read(2000) == data[9000:11000]
+        reader.seek(0)
+        assert reader.read() == data
+
+
+@pytest.mark.parametrize("compression", ["gz", "bz2", "xz"])
+def test_list_members(tmp_path, compression):
+    archive_path = tmp_path / f"archive.tar.{compression}"
+    with tarfile.open(archive_path, f"w:{compression}") as archive:
+        folder = tarfile.TarInfo("folder")
+        folder.type = tarfile.DIRTYPE
+        folder.mtime = 1600000000
+        archive.addfile(folder)
+        _add_files(archive, {"folder/a.txt": b"hello"})
+    assert list_members(archive_path, compression) == [
+        {"name": "folder", "type": "directory", "size": 0, "compressed_size": None, "mtime": 1600000000},
+        {"name": "folder/a.txt", "type": "file", "size": 5, "compressed_size": None, "mtime": 0},
+    ]
+
+    zip_path = tmp_path / "archive.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("folder/", b"")
+        archive.writestr("folder/a.txt", b"a" * 1000)
+    members = list_members(zip_path, "zip")
+    assert [(member["name"], member["type"], member["size"]) for member in members] == [
+        ("folder/", "directory", 0),
+        ("folder/a.txt", "file", 1000),
+    ]
+    assert members[1]["compressed_size"] < 1000
+
+
+def test_tar_index_cache(tmp_path, monkeypatch):
+    archive_path = tmp_path / "archive.tar.gz"
+    _write_tar(archive_path, {"a.txt": b"a"}, False)
+    cache = ArchiveCache(str(tmp_path / "cache"), 1024 * 1024, ".index")
+    built = tar_index(archive_path, "gz", cache)
+
+    def fail(*args):
+        raise AssertionError("The index is built again")
+
+    with monkeypatch.context() as m:
+        m.setattr(index, "build_tar_index", fail)
+        assert tar_index(archive_path, "gz", cache) == built
+
+    # A modified archive is indexed again
+    _write_tar(archive_path, {"a.txt": b"a", "b.txt": b"b"}, False)
+    os.utime(archive_path, (1, 1))
+    assert [entry["name"] for entry in tar_index(archive_path, "gz", cache)["members"]] == ["a.txt", "b.txt"]
+
+
+def test_select_members():
+    names = ["folder/", "folder/a.txt", "folder/sub/b.txt", "folder2/c.txt", "d.txt"]
+    assert select_members(names, ["folder"]) == {"folder/", "folder/a.txt", "folder/sub/b.txt"}
+    assert select_members(names, ["folder/sub/", "d.txt"]) == {"folder/sub/b.txt", "d.txt"}
+    with pytest.raises(KeyError):
+        select_members(names, ["missing.txt"])
+
+
+@pytest.mark.parametrize("format", ["zip", "tar.gz"])
+def test_extract_members(tmp_path, format):
+    archive_path = tmp_path / f"archive.{format}"
+    if format == "zip":
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            for name in ["folder/a.txt", "folder/sub/b.txt", "c.txt", "d.txt"]:
+                archive.writestr(name, name)
+    else:
+        with tarfile.open(archive_path, "w:gz") as archive:
+            _add_files(archive, {name: name.encode() for name in ["folder/a.txt", "folder/sub/b.txt", "c.txt"]})
+            link = tarfile.TarInfo("d.txt")
+            link.type = tarfile.LNKTYPE
+            link.linkname = "c.txt"
+            archive.addfile(link)
+    destination = tmp_path / "destination"
+    destination.mkdir()
+
+    if format == "zip":
+        extract_zip(archive_path, destination, names=["folder/sub", "d.txt"])
+    else:
+        extract_tar_members(archive_path, build_tar_index(archive_path, "gz"), ["folder/sub", "d.txt"], destination)
+    extracted = sorted(str(path.relative_to(destination)) for path in destination.rglob("*") if path.is_file())
+    assert extracted == ["d.txt", os.path.join("folder", "sub", "b.txt")]
+    assert (destination / "folder" / "sub" / "b.txt").read_text() == "folder/sub/b.txt"
+    # The hard link is extracted as a copy of its target
+    assert (destination / "d.txt").read_text() == ("d.txt" if format == "zip" else "c.txt")
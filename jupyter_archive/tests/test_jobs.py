@@ -0,0 +1,91 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from jupyter_archive.jobs import JobConflictError, JobLimitError, JobRegistry
+
+
+def test_job_progress():
+    registry = JobRegistry()
+    job = registry.start("download", "/tmp/dir", "token")
+    assert registry.get("token") is job
+
+    job.set_total(4, 1000)
+    job.advance(1, 250)
+    report = job.to_dict()
+    assert report["status"] == "running"
+    assert report["files_processed"] == 1
+    assert report["bytes_processed"] == 250
+    assert report["throughput"] > 0
+    assert report["eta"] > 0
+
+    job.finish()
+    report = job.to_dict()
+    assert report["status"] == "finished"
+    assert report["eta"] is None
+    # A job only ends once
+    job.finish("failed", "error")
+    assert job.status == "finished"
+
+
+def test_job_retention():
+    registry = JobRegistry(retention=0)
+    running = registry.start("extract", "/tmp/archive.zip")
+    assert running.id
+    finished = registry.start("extract", "/tmp/archive.zip")
+    finished.finish()
+
+    assert registry.list() == [running]
+    assert registry.get(finished.id) is None
+
+
+def test_job_limits():
+    registry = JobRegistry()
+    first = registry.start("download", "/tmp/dir", user="alice", max_jobs=2, max_user_jobs=1)
+    with pytest.raises(JobLimitError) as e:
+        registry.start("download", "/tmp/dir", user="alice", max_jobs=2, max_user_jobs=1)
+    assert e.value.per_user
+    registry.start("extract", "/tmp/archive.zip", user="bob", max_jobs=2, max_user_jobs=1)
+    with pytest.raises(JobLimitError) as e:
+        registry.start("extract", "/tmp/archive.zip", user="carol", max_jobs=2, max_user_jobs=1)
+    assert not e.value.per_user
+
+    # Finished jobs do not count
+    first.finish()
+    registry.start("download", "/tmp/dir", user="alice", max_jobs=2, max_user_jobs=1)
+
+
+def test_job_id_conflict():
+    registry = JobRegistry()
+    first = registry.start("download", "/tmp/dir", "token", max_jobs=2)
+    # Reusing the id of an active job would replace it and hide it from the limits
+    for _ in range(5):
+        with pytest.raises(JobConflictError):
+            registry.start("download", "/tmp/dir", "token", max_jobs=2)
+    assert registry.list() == [first]
+
+    # The id of a finished job can be used again
+    first.finish()
+    second = registry.start("download", "/tmp/dir", "token", max_jobs=2)
+    assert registry.get("token") is second
+
+
+def test_job_metrics():
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    registry = JobRegistry()
+    active = sample("jupyter_archive_active_jobs", kind="extract")
+    queued = sample("jupyter_archive_job_queue_seconds_count", kind="extract")
+    job = registry.start("extract", "/tmp/archive.tar.gz", status="pending", archive_format="tar.gz")
+    assert job.to_dict()["format"] == "tar.gz"
+    assert sample("jupyter_archive_active_jobs", kind="extract") == active + 1
+
+    job.run()
+    job.advance(1, 100)
+    assert sample("jupyter_archive_job_queue_seconds_count", kind="extract") == queued + 1
+    assert sample("jupyter_archive_bytes_out_total", kind="extract", format="tar.gz") >= 100
+
+    job.finish("failed")
+    assert sample("jupyter_archive_active_jobs", kind="extract") == active
+    labels = {"kind": "extract", "format": "tar.gz", "status": "failed"}
+    assert sample("jupyter_archive_job_duration_seconds_count", **labels) >= 1
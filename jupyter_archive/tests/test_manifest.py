@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import zlib
+
+import pytest
+
+from jupyter_archive.manifest import HashingReader, Manifest, file_hash, load_manifest
+from jupyter_archive.scanner import scan_files
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "folder"
+    (folder / "sub").mkdir(parents=True)
+    for name in ["a.txt", "b.txt", "c.txt", "sub/d.txt"]:
+        (folder / name).write_text(name)
+        os.utime(folder / name, (1000, 1000))
+    return folder
+
+
+def _manifest(folder, since=None, previous=None):
+    manifest = Manifest("folder/.jupyter-archive-manifest.json", since)
+    changed = manifest.select(scan_files(folder), previous)
+    return manifest, sorted(arcname.replace(os.sep, "/") for _, arcname, _ in changed)
+
+
+def test_manifest_since(folder):
+    os.utime(folder / "b.txt", (2000, 2000))
+    manifest, changed = _manifest(folder, since=1500)
+    assert changed == ["folder/b.txt"]
+    assert sorted(manifest.files) == ["folder/a.txt", "folder/b.txt", "folder/c.txt", "folder/sub/d.txt"]
+    assert manifest.deleted == []
+
+
+def test_manifest_previous(folder):
+    previous, changed = _manifest(folder)
+    assert len(changed) == 4
+    for key, entry in previous.files.items():
+        entry["hash"] = file_hash(folder.parent / key)
+    previous = load_manifest(previous.dumps())
+
+    # Modified, touched, deleted and new files
+    (folder / "a.txt").write_text("changed")
+    os.utime(folder / "b.txt", (2000, 2000))
+    (folder / "c.txt").unlink()
+    (folder / "sub" / "e.txt").write_text("new")
+    # Left by the extraction of a previous delta archive
+    (folder / ".jupyter-archive-manifest.json").write_text("{}")
+
+    manifest, changed = _manifest(folder, previous=previous)
+    assert changed == ["folder/a.txt", "folder/sub/e.txt"]
+    assert manifest.deleted == ["folder/c.txt"]
+    assert manifest.files["folder/b.txt"] == {"size": 5, "mtime": 2000, "hash": previous["folder/b.txt"]["hash"]}
+    assert manifest.files["folder/sub/d.txt"]["hash"] == previous["folder/sub/d.txt"]["hash"]
+
+
+@pytest.mark.parametrize("data", [b"", b"[]", b'{"files": []}', b'{"files": {"a": {"size": "1"}}}', b"\xff"])
+def test_load_manifest_invalid(data):
+    with pytest.raises(ValueError):
+        load_manifest(data)
+
+
+def test_load_manifest():
+    files = {"folder/a.txt": {"size": 1, "mtime": 1000.5, "hash": None}}
+    assert load_manifest(json.dumps({"version": 1, "files": files})) == files
+    assert load_manifest(json.dumps({"manifest": {"files": files}})) == files
+
+
+def test_hashing_reader(tmp_path):
+    data = os.urandom(100000)
+    (tmp_path / "data.bin").write_bytes(data)
+    reader = HashingReader(io.BytesIO(data))
+    while reader.read(4096):
+        pass
+    assert reader.size == len(data)
+    assert reader.hexdigest() == "crc32:{:08x}".format(zlib.crc32(data)) == file_hash(tmp_path / "data.bin")
@@ -0,0 +1,103 @@
+import os
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive import readahead
+from jupyter_archive.readahead import ReadAhead, content_sizes
+from jupyter_archive.scanner import scan_files
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(2)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Batches and chunks without writing megabytes
+    monkeypatch.setattr(readahead, "CHUNK_SIZE", 1000)
+    monkeypatch.setattr(readahead, "SMALL_FILE_SIZE", 300)
+
+
+@pytest.mark.parametrize("max_size", [1, 2500, 2**20])
+def test_read_ahead(tmp_path, executor, small_chunks, max_size):
+    root = tmp_path / "files"
+    root.mkdir()
+    contents = {}
+    for index, size in enumerate([0, 10, 300, 301, 2500, 50, 60, 3000, 1000, 70]):
+        contents["file{}.bin".format(index)] = os.urandom(size)
+    for name, content in contents.items():
+        (root / name).write_bytes(content)
+    (root / "folder").mkdir()
+    files = scan_files(root)
+
+    with ReadAhead(files, executor, max_size) as read_ahead:
+        read = {os.path.basename(file_name): fileobj.read() for file_name, _, _, fileobj in read_ahead}
+    assert read == contents
+
+
+def test_read_ahead_partial_reads(tmp_path, executor, small_chunks):
+    root = tmp_path / "files"
+    root.mkdir()
+    big = os.urandom(3500)
+    (root / "a.bin").write_bytes(big)
+    (root / "b.bin").write_bytes(big)
+    (root / "c.txt").write_text("hello")
+    files = scan_files(root)
+
+    with ReadAhead(files, executor, 1000) as read_ahead:
+        items = iter(read_ahead)
+        _, _, _, fileobj = next(items)
+        assert b"".join(iter(lambda: fileobj.read(700), b"")) == big
+        # The content of a file which is not read is skipped
+        next(items)
+        _, _, _, fileobj = next(items)
+        assert fileobj.read() == b"hello"
+
+
+def test_read_ahead_changed_file(tmp_path, executor, small_chunks):
+    root = tmp_path / "files"
+    root.mkdir()
+    (root / "grown.bin").write_bytes(b"a" * 2000)
+    (root / "shrunk.bin").write_bytes(b"b" * 2000)
+    files = scan_files(root)
+    (root / "grown.bin").write_bytes(b"a" * 3000)
+    (root / "shrunk.bin").write_bytes(b"b" * 1500)
+
+    with ReadAhead(files, executor, 2**20) as read_ahead:
+        read = [fileobj.read() for *_, fileobj in read_ahead]
+    # The files are read to their end
+    assert read == [b"a" * 3000, b"b" * 1500]
+
+
+def test_read_ahead_error(tmp_path, executor):
+    root = tmp_path / "files"
+    root.mkdir()
+    (root / "a.txt").write_text("hello")
+    (root / "b.txt").write_text("world")
+    files = scan_files(root)
+    (root / "b.txt").unlink()
+
+    with ReadAhead(files, executor, 2**20) as read_ahead:
+        items = iter(read_ahead)
+        assert next(items)[3].read() == b"hello"
+        with pytest.raises(FileNotFoundError):
+            next(items)
+
+
+def test_content_sizes(tmp_path):
+    if platform.system() == "Windows":
+        pytest.skip("Symlinks not working on Windows")
+    root = tmp_path / "files"
+    root.mkdir()
+    (root / "a.txt").write_text("hello")
+    os.link(root / "a.txt", root / "b.txt")
+    (root / "c.txt").symlink_to(root / "a.txt")
+
+    files = scan_files(root, dereference=False)
+    assert content_sizes(files) == [5, 5, None]
+    assert content_sizes(files, hardlinks=True) == [5, None, None]
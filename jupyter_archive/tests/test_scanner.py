@@ -0,0 +1,140 @@
+import io
+import os
+import platform
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive.scanner import PathFilter, scan_files, scan_paths
+from jupyter_archive.tarstream import tarinfo_from_stat
+from jupyter_archive.zipstream import zipinfo_from_stat
+
+
+def _walk(archive_path, follow_symlinks, download_hidden):
+    # Reference listing with a sorted os.walk
+    prefix = len(str(archive_path.parent)) + len(os.path.sep)
+    for root, dirs, files in os.walk(archive_path, followlinks=follow_symlinks):
+        if not download_hidden:
+            files = [f for f in files if not f[0] == "."]
+            dirs[:] = [d for d in dirs if not d[0] == "."]
+        dirs.sort()
+        for file_ in sorted(files):
+            yield os.path.join(root, file_), os.path.join(root[prefix:], file_)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "tree"
+    for i in range(3):
+        for j in range(4):
+            (root / f"dir{i}" / f"sub{j}").mkdir(parents=True)
+            (root / f"dir{i}" / f"sub{j}" / f"file{j}.txt").write_text("hello" * j)
+        (root / f"dir{i}" / f"file{i}.txt").write_text("hello")
+    (root / ".hidden").mkdir()
+    (root / ".hidden" / "file.txt").write_text("hidden")
+    (root / ".hidden.txt").write_text("hidden")
+    if platform.system() != "Windows":
+        outside = tmp_path / "outside"
+        outside.mkdir()
+        (outside / "linked.txt").write_text("linked")
+        (root / "link-dir").symlink_to(outside, target_is_directory=True)
+        (root / "link.txt").symlink_to(root / "dir0" / "file0.txt")
+        (root / "broken.txt").symlink_to(tmp_path / "missing")
+    return root
+
+
+@pytest.mark.parametrize("follow_symlinks", [True, False])
+@pytest.mark.parametrize("download_hidden", [True, False])
+@pytest.mark.parametrize("prefetch", [0, 3])
+def test_scan_files(tree, follow_symlinks, download_hidden, prefetch):
+    executor = ThreadPoolExecutor(prefetch) if prefetch else None
+    files = scan_files(tree, follow_symlinks, download_hidden, True, executor, prefetch)
+    if executor is not None:
+        executor.shutdown()
+
+    assert [(file_name, arcname) for file_name, arcname, _ in files] == list(
+        _walk(tree, follow_symlinks, download_hidden)
+    )
+    for file_name, _, st in files:
+        if os.path.exists(file_name):
+            assert st.st_size == os.stat(file_name).st_size
+
+
+def test_scan_files_lstat(tree):
+    if platform.system() == "Windows":
+        pytest.skip("Symlinks not working on Windows")
+    files = {arcname: st for _, arcname, st in scan_files(tree, dereference=False)}
+    assert files["tree/link.txt"].st_ino == os.lstat(tree / "link.txt").st_ino
+    assert files["tree/dir0/file0.txt"].st_ino == os.stat(tree / "dir0" / "file0.txt").st_ino
+
+
+def test_zipinfo_from_stat(tree):
+    for file_name in [tree / "dir0" / "file0.txt", tree / "dir0"]:
+        expected = zipfile.ZipInfo.from_file(file_name, "arc/name")
+        zinfo = zipinfo_from_stat(file_name, "arc/name", os.stat(file_name))
+        for attribute in ["filename", "date_time", "external_attr", "file_size"]:
+            assert getattr(zinfo, attribute) == getattr(expected, attribute)
+
+
+def test_tarinfo_from_stat(tree):
+    if platform.system() == "Windows":
+        pytest.skip("Symlinks not working on Windows")
+    os.link(tree / "dir0" / "file0.txt", tree / "hardlink.txt")
+    names = ["dir0/file0.txt", "hardlink.txt", "link.txt", "dir1"]
+    with tarfile.open(fileobj=io.BytesIO(), mode="w") as expected_archive, tarfile.open(
+        fileobj=io.BytesIO(), mode="w"
+    ) as archive:
+        for name in names:
+            expected = expected_archive.gettarinfo(tree / name, name)
+            tarinfo = tarinfo_from_stat(archive, str(tree / name), name, os.lstat(tree / name))
+            assert tarinfo.get_info() == expected.get_info()
+    assert tarinfo_from_stat(archive, str(tree / "hardlink.txt"), "hardlink.txt", os.lstat(tree / "hardlink.txt")).islnk()
+
+
+@pytest.mark.parametrize(
+    "include, exclude, expected",
+    [
+        ([], [], True),
+        (["*.txt"], [], True),
+        (["*.py"], [], False),
+        (["dir0"], [], True),
+        (["dir0/sub1"], [], True),
+        (["dir0/sub2"], [], False),
+        (["dir0/*/*.txt"], [], True),
+        ([], ["sub1"], False),
+        ([], ["file1.*"], False),
+        ([], ["dir1"], True),
+        (["dir0"], ["*.txt"], False),
+    ],
+)
+def test_path_filter(tree, include, exclude, expected):
+    path_filter = PathFilter(tree, include, exclude)
+    assert path_filter.includes(str(tree / "dir0" / "sub1" / "file1.txt")) is expected
+
+
+def test_scan_files_filter(tree):
+    path_filter = PathFilter(tree, ["*.txt"], ["sub1", "dir2"])
+    arcnames = [arcname for _, arcname, _ in scan_files(tree, follow_symlinks=False, path_filter=path_filter)]
+    assert arcnames == [
+        arcname
+        for _, arcname in _walk(tree, False, False)
+        if arcname.endswith(".txt") and "sub1" not in arcname and "dir2" not in arcname
+    ]
+    assert "tree/dir0/file0.txt" in arcnames
+
+
+def test_scan_paths(tree):
+    files = scan_paths(tree, ["dir1", "dir0/file0.txt", "dir1/sub0"], path_filter=PathFilter(tree, exclude=["sub3"]))
+    arcnames = [arcname for _, arcname, _ in files]
+    expected = [
+        os.path.join("dir1", "file1.txt"),
+        *(os.path.join("dir1", f"sub{j}", f"file{j}.txt") for j in range(3)),
+        os.path.join("dir0", "file0.txt"),
+    ]
+    assert sorted(arcnames) == sorted(expected)
+    assert arcnames[-1] == os.path.join("dir0", "file0.txt")
+    for file_name, arcname, st in files:
+        assert file_name == str(tree / arcname)
+        assert st.st_size == os.stat(file_name).st_size
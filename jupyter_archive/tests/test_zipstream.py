@@ -0,0 +1,146 @@
+import io
+import os
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jupyter_archive import zipstream
+from jupyter_archive.zipstream import ZipStreamWriter, crc32_combine, stored_size
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (b"", b""),
+        (b"hello", b""),
+        (b"", b"world"),
+        (b"hello", b"world"),
+        (os.urandom(100000), os.urandom(12345)),
+    ],
+)
+def test_crc32_combine(first, second):
+    assert crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second)) == zlib.crc32(first + second)
+
+
+@pytest.mark.parametrize("zip64", [False, True])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_zip_stream_writer(tmp_path, monkeypatch, zip64, workers):
+    if zip64:
+        # Force the zip64 records without writing gigabytes of data
+        monkeypatch.setattr(zipstream, "ZIP64_LIMIT", 100)
+
+    big = os.urandom(zipstream.BLOCK_SIZE + 10) + b"a" * zipstream.BLOCK_SIZE
+    (tmp_path / "big.bin").write_bytes(big)
+    (tmp_path / "empty.txt").write_bytes(b"")
+    (tmp_path / "中文.txt").write_text("你好")
+    (tmp_path / "folder").mkdir()
+
+    buffer = io.BytesIO()
+    executor = ThreadPoolExecutor(workers) if workers > 1 else None
+    with ZipStreamWriter(buffer, executor=executor, workers=workers) as writer:
+        for name in ["big.bin", "empty.txt", "中文.txt", "folder"]:
+            writer.add(tmp_path / name, name)
+    if executor is not None:
+        executor.shutdown()
+
+    with zipfile.ZipFile(buffer) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["big.bin", "empty.txt", "中文.txt", "folder/"]
+        assert zf.read("big.bin") == big
+        assert zf.read("empty.txt") == b""
+        assert zf.read("中文.txt").decode() == "你好"
+        assert zf.getinfo("folder/").is_dir()
+
+
+@pytest.mark.parametrize("zip64", [False, True])
+def test_stored_size(tmp_path, monkeypatch, zip64):
+    if zip64:
+        monkeypatch.setattr(zipstream, "ZIP64_LIMIT", 100)
+
+    (tmp_path / "big.bin").write_bytes(os.urandom(zipstream.BLOCK_SIZE + 10))
+    (tmp_path / "small.txt").write_bytes(b"hello")
+    (tmp_path / "中文.txt").write_text("你好")
+    (tmp_path / "folder").mkdir()
+    members = [zipfile.ZipInfo.from_file(tmp_path / name, name) for name in ["big.bin", "small.txt", "中文.txt", "folder"]]
+
+    buffer = io.BytesIO()
+    with ZipStreamWriter(buffer, compresslevel=0) as writer:
+        for zinfo in members:
+            writer.add(tmp_path / zinfo.filename, zinfo=zinfo, fixed_size=True)
+
+    assert len(buffer.getvalue()) == stored_size(members)
+    with zipfile.ZipFile(buffer) as zf:
+        assert zf.testzip() is None
+
+
+def test_stored_size_changed_file(tmp_path):
+    (tmp_path / "grown.txt").write_bytes(b"hello")
+    (tmp_path / "shrunk.txt").write_bytes(b"hello")
+    grown = zipfile.ZipInfo.from_file(tmp_path / "grown.txt", "grown.txt")
+    shrunk = zipfile.ZipInfo.from_file(tmp_path / "shrunk.txt", "shrunk.txt")
+    (tmp_path / "grown.txt").write_bytes(b"hello world")
+    (tmp_path / "shrunk.txt").write_bytes(b"he")
+
+    buffer = io.BytesIO()
+    with ZipStreamWriter(buffer, compresslevel=0) as writer:
+        writer.add(tmp_path / "grown.txt", zinfo=grown, fixed_size=True)
+    assert len(buffer.getvalue()) == stored_size([grown])
+    with zipfile.ZipFile(buffer) as zf:
+        assert zf.read("grown.txt") == b"hello"
+
+    with pytest.raises(OSError):
+        with ZipStreamWriter(io.BytesIO(), compresslevel=0) as writer:
+            writer.add(tmp_path / "shrunk.txt", zinfo=shrunk, fixed_size=True)
+
+
+@pytest.mark.parametrize("compresslevel", [0, -1])
+@pytest.mark.parametrize("from_fileobj", [False, True])
+def test_changed_file(tmp_path, monkeypatch, compresslevel, from_fileobj):
+    monkeypatch.setattr(zipstream, "BLOCK_SIZE", 1024)
+    contents = {"grown.bin": (1000, 5000), "shrunk.bin": (3000, 1500), "grown-blocks.bin": (2500, 4000)}
+    members = []
+    for name, (size, _) in contents.items():
+        (tmp_path / name).write_bytes(os.urandom(size))
+        members.append(zipfile.ZipInfo.from_file(tmp_path / name, name))
+    for name, (_, size) in contents.items():
+        (tmp_path / name).write_bytes(os.urandom(size))
+
+    # The files are archived as they are when read, not as they were stat'ed
+    buffer = io.BytesIO()
+    with ZipStreamWriter(buffer, compresslevel) as writer:
+        for zinfo in members:
+            fileobj = io.BytesIO((tmp_path / zinfo.filename).read_bytes()) if from_fileobj else None
+            writer.add(tmp_path / zinfo.filename, zinfo=zinfo, fileobj=fileobj)
+    with zipfile.ZipFile(buffer) as zf:
+        assert zf.testzip() is None
+        for name in contents:
+            assert zf.read(name) == (tmp_path / name).read_bytes()
+
+
+@pytest.mark.parametrize("compresslevel", [0, -1])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_zip_stream_writer_fileobj(tmp_path, compresslevel, workers):
+    big = os.urandom(zipstream.BLOCK_SIZE + 10) + b"a" * zipstream.BLOCK_SIZE
+    (tmp_path / "big.bin").write_bytes(big)
+    (tmp_path / "small.txt").write_bytes(b"hello")
+
+    buffers = []
+    for from_fileobj in [False, True]:
+        buffer = io.BytesIO()
+        executor = ThreadPoolExecutor(workers) if workers > 1 else None
+        with ZipStreamWriter(buffer, compresslevel, executor=executor, workers=workers) as writer:
+            for name in ["big.bin", "small.txt"]:
+                zinfo = zipfile.ZipInfo.from_file(tmp_path / name, name)
+                fileobj = io.BytesIO((tmp_path / name).read_bytes()) if from_fileobj else None
+                writer.add(tmp_path / name, zinfo=zinfo, fileobj=fileobj)
+        if executor is not None:
+            executor.shutdown()
+        buffers.append(buffer.getvalue())
+
+    # Deflated with the same dictionaries, the archives are the same
+    assert buffers[0] == buffers[1]
+    with zipfile.ZipFile(io.BytesIO(buffers[1])) as zf:
+        assert zf.testzip() is None
+        assert zf.read("big.bin") == big
@@ -0,0 +1,457 @@
+import io
+import math
+import os
+import stat
+import struct
+import time
+import zipfile
+import zlib
+from collections import Counter, deque
+from concurrent.futures import Future
+
+# Size of the uncompressed blocks deflated independently by the workers.
+BLOCK_SIZE = 1024 * 1024
+# Size of the window used by deflate to find back-references.
+DICT_SIZE = 32 * 1024
+# Same threshold as the standard library for switching to zip64 records.
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_DATA_DESCRIPTOR = struct.Struct("<4sLLL")
+_DATA_DESCRIPTOR64 = struct.Struct("<4sLQQ")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_END_RECORD64 = struct.Struct("<4sQ2H2L4Q")
+_END_LOCATOR64 = struct.Struct("<4sLQL")
+
+# Extensions of files that are already compressed; they are stored as-is in
+# adaptive compression mode.
+COMPRESSED_EXTENSIONS = {
+    ".7z", ".aac", ".avi", ".avif", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz", ".h5", ".hdf5",
+    ".heic", ".jar", ".jpeg", ".jpg", ".lz4", ".mkv", ".mov", ".mp3", ".mp4", ".npz", ".odp", ".ods",
+    ".odt", ".ogg", ".parquet", ".png", ".pptx", ".rar", ".tbz", ".tbz2", ".tgz", ".txz", ".webm",
+    ".webp", ".whl", ".xlsx", ".xz", ".zip", ".zst",
+}
+# Number of bytes read at the start of a file to estimate its entropy.
+PROBE_SIZE = 64 * 1024
+# Entropy (in bits per byte) above which the deflate gain is not worth the CPU.
+ENTROPY_THRESHOLD = 7.8
+
+_DEFAULT_VERSION = 20
+_ZIP64_VERSION = 45
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def _crc32_zeros_operators():
+    # CRC-32 operators for appending 2**n zero bytes (see zlib's crc32_combine).
+    operator = [0xEDB88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = [_gf2_matrix_times(operator, column) for column in operator]
+    operators = [operator]
+    for _ in range(63):
+        operator = [_gf2_matrix_times(operator, column) for column in operator]
+        operators.append(operator)
+    return operators
+
+
+_CRC32_OPERATORS = _crc32_zeros_operators()
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Return the CRC-32 of the concatenation of two blocks from their CRC-32.
+
+    ``length2`` is the length of the second block.
+    """
+    power = 0
+    while length2:
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(_CRC32_OPERATORS[power], crc1)
+        length2 >>= 1
+        power += 1
+    return crc1 ^ crc2
+
+
+def deflate_block(data, zdict=b"", level=-1, last=True):
+    """Compress ``data`` as a raw deflate block.
+
+    Non-final blocks end with a sync flush so that independently compressed
+    blocks can be concatenated into a single deflate stream; ``zdict`` should
+    be the end of the previous block to keep the compression ratio.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.crc32(data), len(data)
+
+
+def store_block(data, zdict=b"", level=0, last=True):
+    """Store a block without compression; see :func:`deflate_block`."""
+    return data, zlib.crc32(data), len(data)
+
+
+def store_file_block(filename, offset, length, level=0, last=True):
+    """Read a block of a file stored without compression."""
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data, zlib.crc32(data), len(data)
+
+
+def deflate_file_block(filename, offset, length, level=-1, last=True):
+    """Read and compress a block of a file; see :func:`deflate_block`."""
+    with open(filename, "rb") as f:
+        zdict = b""
+        if offset:
+            start = max(0, offset - DICT_SIZE)
+            f.seek(start)
+            zdict = f.read(offset - start)
+        data = f.read(length)
+    return deflate_block(data, zdict, level, last)
+
+
+def entropy(data):
+    """Shannon entropy of ``data`` in bits per byte."""
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+
+def is_incompressible(filename, size):
+    """Whether the file is already compressed, guessed from its extension or the entropy of its first block."""
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    # Small files are cheap to deflate whatever their content
+    if size < PROBE_SIZE:
+        return False
+    with open(filename, "rb") as f:
+        return entropy(f.read(PROBE_SIZE)) > ENTROPY_THRESHOLD
+
+
+def zipinfo_from_stat(filename, arcname, st):
+    """Like :meth:`zipfile.ZipInfo.from_file`, from the ``os.stat`` result ``st`` of the file."""
+    isdir = stat.S_ISDIR(st.st_mode)
+    date_time = time.localtime(st.st_mtime)[0:6]
+    if arcname is None:
+        arcname = filename
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    while arcname[0] in (os.sep, os.altsep):
+        arcname = arcname[1:]
+    if isdir:
+        arcname += "/"
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    if isdir:
+        zinfo.file_size = 0
+        zinfo.external_attr |= 0x10
+    else:
+        zinfo.file_size = st.st_size
+    return zinfo
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+def _encode_filename(zinfo):
+    try:
+        return zinfo.filename.encode("ascii"), zinfo.flag_bits
+    except UnicodeEncodeError:
+        return zinfo.filename.encode("utf-8"), zinfo.flag_bits | _FLAG_UTF8
+
+
+def _is_zip64(file_size):
+    # Decide on zip64 before knowing the compressed size, like the standard library
+    return file_size * 1.05 > ZIP64_LIMIT
+
+
+def _zip64_fields(file_size, compress_size, header_offset):
+    # Values of the central directory record which do not fit in 32 bits
+    return [value for value in (file_size, compress_size, header_offset) if value > ZIP64_LIMIT]
+
+
+def _is_end64(count, size, start):
+    return count >= 0xFFFF or size > ZIP64_LIMIT or start > ZIP64_LIMIT
+
+
+def stored_size(members):
+    """Return the size of the archive of ``members`` written in store mode.
+
+    ``members`` are the :class:`zipfile.ZipInfo` given to
+    :meth:`ZipStreamWriter.add` with ``compresslevel`` 0; the size only
+    depends on their names and sizes, so no file is read.
+    """
+    offset = 0
+    central_size = 0
+    count = 0
+    for zinfo in members:
+        filename, _ = _encode_filename(zinfo)
+        file_size = 0 if zinfo.is_dir() else zinfo.file_size
+        header_offset = offset
+        if _is_zip64(file_size):
+            offset += _LOCAL_HEADER.size + len(filename) + 20 + file_size + _DATA_DESCRIPTOR64.size
+        else:
+            offset += _LOCAL_HEADER.size + len(filename) + file_size + _DATA_DESCRIPTOR.size
+        zip64_fields = _zip64_fields(file_size, file_size, header_offset)
+        central_size += _CENTRAL_HEADER.size + len(filename) + (4 + 8 * len(zip64_fields) if zip64_fields else 0)
+        count += 1
+
+    size = offset + central_size + _END_RECORD.size
+    if _is_end64(count, central_size, offset):
+        size += _END_RECORD64.size + _END_LOCATOR64.size
+    return size
+
+
+class _Member:
+    # Bookkeeping of a member while its blocks are written.
+    def __init__(self, zinfo):
+        self.zinfo = zinfo
+        self.zip64 = False
+        self.size = 0
+        self.fixed_size = False
+
+
+class ZipStreamWriter:
+    """Write a zip archive into a non-seekable file object.
+
+    Files are split in blocks of ``BLOCK_SIZE`` bytes deflated on ``executor``
+    (a :class:`concurrent.futures.Executor`) or in the calling thread if it is
+    ``None``. The blocks are written in order; each member is followed by a
+    data descriptor as its size and CRC are only known once it is compressed.
+
+    With ``compresslevel`` 0 the files are stored without compression. With
+    ``adaptive`` the files that look already compressed are stored too.
+
+    The files are read to their end and their sizes are written in the
+    data descriptors, in case they changed since they were stat'ed. The
+    members added with ``fixed_size`` keep the size of their ``zinfo``
+    instead, so that the archive size can be known in advance with
+    :func:`stored_size`: a file which grew is truncated and a file which
+    shrank raises an ``OSError``.
+    """
+
+    def __init__(self, fileobj, compresslevel=-1, executor=None, workers=1, adaptive=False):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.adaptive = adaptive
+        self._executor = executor
+        # Number of blocks being compressed ahead of the one being written
+        self._max_pending = 2 * workers if executor is not None else 0
+        self._pending = deque()
+        self._members = []
+        self._offset = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for *_, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._closed = True
+
+    def add(self, filename, arcname=None, zinfo=None, fileobj=None, fixed_size=False):
+        """Add the file ``filename`` as ``arcname`` in the archive.
+
+        ``zinfo`` is the :class:`zipfile.ZipInfo` of the file if it was
+        already stat'ed, whose size is kept with ``fixed_size``. If
+        ``fileobj`` is given, the content of the file is read from it in the
+        calling thread, e.g. from a
+        :class:`~jupyter_archive.readahead.ReadAhead`, and only the
+        compression runs on ``executor``.
+        """
+        if zinfo is None:
+            zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+        if zinfo.is_dir():
+            zinfo.compress_type = zipfile.ZIP_STORED
+            self._drain(0)
+            member = _Member(zinfo)
+            self._start_member(member)
+            self._end_member(member)
+            return
+
+        size = zinfo.file_size
+        if self.compresslevel == 0 or (self.adaptive and filename is not None and is_incompressible(filename, size)):
+            zinfo.compress_type = zipfile.ZIP_STORED
+            read_block = store_file_block
+            compress_block = store_block
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            read_block = deflate_file_block
+            compress_block = deflate_block
+        member = _Member(zinfo)
+        member.fixed_size = fixed_size
+        n_blocks = max(1, -(-size // BLOCK_SIZE))
+        zdict = b""
+        for index in range(n_blocks):
+            offset = index * BLOCK_SIZE
+            last = index == n_blocks - 1
+            # The last block goes to the end of the file, in case it grew
+            length = None if last and not fixed_size else min(BLOCK_SIZE, size - offset)
+            if fileobj is not None:
+                data = fileobj.read(-1 if length is None else length)
+                function = compress_block
+                args = (data, zdict, self.compresslevel, last)
+                zdict = data[-DICT_SIZE:]
+            else:
+                function = read_block
+                args = (filename, offset, length, self.compresslevel, last)
+            if self._executor is None:
+                future = Future()
+                future.set_result(function(*args))
+            else:
+                future = self._executor.submit(function, *args)
+            self._pending.append((member, index == 0, index == n_blocks - 1, future))
+            self._drain(self._max_pending)
+
+    def writestr(self, zinfo, data):
+        """Add a member made of the bytes ``data``, like :meth:`zipfile.ZipFile.writestr`."""
+        zinfo.file_size = len(data)
+        self.add(None, zinfo=zinfo, fileobj=io.BytesIO(data))
+
+    def close(self):
+        """Write the remaining members and the central directory."""
+        if self._closed:
+            return
+        self._drain(0)
+        self._write_central_directory()
+        self._closed = True
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self._offset += len(data)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            member, first, last, future = self._pending.popleft()
+            compressed, crc, size = future.result()
+            if first:
+                self._start_member(member)
+            self._write(compressed)
+            member.zinfo.CRC = crc32_combine(member.zinfo.CRC, crc, size)
+            member.zinfo.compress_size += len(compressed)
+            member.size += size
+            if last:
+                self._end_member(member)
+
+    def _start_member(self, member):
+        zinfo = member.zinfo
+        zinfo.header_offset = self._offset
+        zinfo.flag_bits |= _FLAG_DATA_DESCRIPTOR
+        member.zip64 = _is_zip64(zinfo.file_size)
+        zinfo.CRC = 0
+        zinfo.compress_size = 0
+
+        extra = b""
+        size = 0
+        version = _DEFAULT_VERSION
+        if member.zip64:
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            size = 0xFFFFFFFF
+            version = _ZIP64_VERSION
+        zinfo.extract_version = zinfo.create_version = version
+
+        filename, flag_bits = _encode_filename(zinfo)
+        dosdate, dostime = _dos_date_time(zinfo.date_time)
+        header = _LOCAL_HEADER.pack(
+            zipfile.stringFileHeader,
+            version,
+            0,
+            flag_bits,
+            zinfo.compress_type,
+            dostime,
+            dosdate,
+            0,
+            size,
+            size,
+            len(filename),
+            len(extra),
+        )
+        self._write(header + filename + extra)
+
+    def _end_member(self, member):
+        zinfo = member.zinfo
+        if member.fixed_size and member.size != zinfo.file_size:
+            raise OSError("{} changed while being archived.".format(zinfo.filename))
+        if not member.zip64 and max(member.size, zinfo.compress_size) > ZIP64_LIMIT:
+            # Its local header has no zip64 record
+            raise OSError("{} grew too large while being archived.".format(zinfo.filename))
+        # The file may have changed since it was stat'ed
+        zinfo.file_size = member.size
+        if member.zip64:
+            descriptor = _DATA_DESCRIPTOR64.pack(b"PK\x07\x08", zinfo.CRC, zinfo.compress_size, zinfo.file_size)
+        else:
+            descriptor = _DATA_DESCRIPTOR.pack(b"PK\x07\x08", zinfo.CRC, zinfo.compress_size, zinfo.file_size)
+        self._write(descriptor)
+        self._members.append(zinfo)
+
+    def _write_central_directory(self):
+        start = self._offset
+        for zinfo in self._members:
+            zip64_fields = _zip64_fields(zinfo.file_size, zinfo.compress_size, zinfo.header_offset)
+            file_size, compress_size, header_offset = (
+                0xFFFFFFFF if value > ZIP64_LIMIT else value
+                for value in (zinfo.file_size, zinfo.compress_size, zinfo.header_offset)
+            )
+
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack("<HH" + "Q" * len(zip64_fields), 1, 8 * len(zip64_fields), *zip64_fields)
+                zinfo.extract_version = zinfo.create_version = _ZIP64_VERSION
+
+            filename, flag_bits = _encode_filename(zinfo)
+            dosdate, dostime = _dos_date_time(zinfo.date_time)
+            header = _CENTRAL_HEADER.pack(
+                zipfile.stringCentralDir,
+                zinfo.create_version,
+                zinfo.create_system,
+                zinfo.extract_version,
+                0,
+                flag_bits,
+                zinfo.compress_type,
+                dostime,
+                dosdate,
+                zinfo.CRC,
+                compress_size,
+                file_size,
+                len(filename),
+                len(extra),
+                0,
+                0,
+                0,
+                zinfo.external_attr,
+                header_offset,
+            )
+            self._write(header + filename + extra)
+
+        count = len(self._members)
+        size = self._offset - start
+        if _is_end64(count, size, start):
+            end64_offset = self._offset
+            self._write(
+                _END_RECORD64.pack(
+                    zipfile.stringEndArchive64, 44, _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, count, count, size, start
+                )
+            )
+            self._write(_END_LOCATOR64.pack(zipfile.stringEndArchive64Locator, 0, end64_offset, 1))
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            start = min(start, 0xFFFFFFFF)
+        self._write(_END_RECORD.pack(zipfile.stringEndArchive, 0, 0, count, count, size, start, 0))
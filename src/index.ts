@@ -6,7 +6,7 @@ import { showErrorMessage } from '@jupyterlab/apputils';
 import { URLExt, PathExt } from '@jupyterlab/coreutils';
 import { ISettingRegistry } from '@jupyterlab/settingregistry';
 import { IFileBrowserFactory } from '@jupyterlab/filebrowser';
-import { ServerConnection } from '@jupyterlab/services';
+import { Contents, ServerConnection } from '@jupyterlab/services';
 import { ITranslator, nullTranslator } from '@jupyterlab/translation';
 import { each } from '@lumino/algorithm';
 import { IDisposable } from '@lumino/disposable';
@@ -25,7 +25,11 @@ type ArchiveFormat =
   | 'tar.bz'
   | 'tar.bz2'
   | 'txz'
-  | 'tar.xz';
+  | 'tar.xz'
+  | 'tzst'
+  | 'tar.zst'
+  | 'tlz4'
+  | 'tar.lz4';
 
 namespace CommandIDs {
   export const downloadArchive = 'filebrowser:download-archive';
@@ -38,7 +42,9 @@ function downloadArchiveRequest(
   path: string,
   archiveFormat: ArchiveFormat,
   followSymlinks: string,
-  downloadHidden: string
+  downloadHidden: string,
+  paths: string[] = [],
+  excludePatterns: string[] = []
 ): void {
   const settings = ServerConnection.makeSettings();
 
@@ -60,6 +66,11 @@ function downloadArchiveRequest(
   fullurl.searchParams.append('archiveFormat', archiveFormat);
   fullurl.searchParams.append('followSymlinks', followSymlinks);
   fullurl.searchParams.append('downloadHidden', downloadHidden);
+  // Archive only the selected files and folders of the folder
+  paths.forEach(item => fullurl.searchParams.append('path', item));
+  excludePatterns.forEach(pattern =>
+    fullurl.searchParams.append('exclude', pattern)
+  );
 
   const xsrfTokenMatch = document.cookie.match('\\b_xsrf=([^;]*)\\b');
   if (xsrfTokenMatch) {
@@ -140,17 +151,22 @@ const extension: JupyterFrontEndPlugin<void> = {
       '.tar.bz',
       '.tar.bz2',
       '.txz',
-      '.tar.xz'
+      '.tar.xz',
+      '.tzst',
+      '.tar.zst',
+      '.tlz4',
+      '.tar.lz4'
     ];
     let archiveFormat: ArchiveFormat; // Default value read from settings
     let followSymlinks: string; // Default value read from settings
     let downloadHidden: string; // Default value read from settings
+    let excludePatterns: string[] = []; // Default value read from settings
 
     // matches anywhere on filebrowser
     const selectorContent = '.jp-DirListing-content';
 
-    // matches directory filebrowser items
-    const selectorOnlyDir = '.jp-DirListing-item[data-isdir="true"]';
+    // matches all filebrowser items
+    const selectorItem = '.jp-DirListing-item';
 
     // matches file filebrowser items
     const selectorNotDir = '.jp-DirListing-item[data-isdir="false"]';
@@ -167,7 +183,14 @@ const extension: JupyterFrontEndPlugin<void> = {
     archiveCurrentFolder.title.label = trans.__('Download Current Folder As');
     archiveCurrentFolder.title.icon = archiveIcon;
 
-    ['zip', 'tar.bz2', 'tar.gz', 'tar.xz'].forEach(format => {
+    [
+      'zip',
+      'tar.bz2',
+      'tar.gz',
+      'tar.xz',
+      'tar.zst',
+      'tar.lz4'
+    ].forEach(format => {
       archiveFolder.addItem({
         command: CommandIDs.downloadArchive,
         args: { format }
@@ -195,7 +218,7 @@ const extension: JupyterFrontEndPlugin<void> = {
 
           if (!newFormat) {
             archiveFolderItem = app.contextMenu.addItem({
-              selector: selectorOnlyDir,
+              selector: selectorItem,
               rank: 10,
               type: 'submenu',
               submenu: archiveFolder
@@ -210,7 +233,7 @@ const extension: JupyterFrontEndPlugin<void> = {
           } else {
             archiveFolderItem = app.contextMenu.addItem({
               command: CommandIDs.downloadArchive,
-              selector: selectorOnlyDir,
+              selector: selectorItem,
               rank: 10
             });
 
@@ -235,12 +258,15 @@ const extension: JupyterFrontEndPlugin<void> = {
           updateFormat(newFormat, archiveFormat);
           followSymlinks = settings.get('followSymlinks').composite as string;
           downloadHidden = settings.get('downloadHidden').composite as string;
+          excludePatterns = settings.get('excludePatterns')
+            .composite as string[];
         });
 
         const newFormat = settings.get('format').composite as ArchiveFormat;
         updateFormat(newFormat, archiveFormat);
         followSymlinks = settings.get('followSymlinks').composite as string;
         downloadHidden = settings.get('downloadHidden').composite as string;
+        excludePatterns = settings.get('excludePatterns').composite as string[];
       })
       .catch(reason => {
         console.error(reason);
@@ -255,19 +281,36 @@ const extension: JupyterFrontEndPlugin<void> = {
       execute: args => {
         const widget = tracker.currentWidget;
         if (widget) {
+          const format = args['format'] as ArchiveFormat;
+          const selectedFormat =
+            allowedArchiveExtensions.indexOf('.' + format) >= 0
+              ? format
+              : archiveFormat;
+          const items: Contents.IModel[] = [];
           each(widget.selectedItems(), item => {
-            if (item.type === 'directory') {
-              const format = args['format'] as ArchiveFormat;
-              downloadArchiveRequest(
-                item.path,
-                allowedArchiveExtensions.indexOf('.' + format) >= 0
-                  ? format
-                  : archiveFormat,
-                followSymlinks,
-                downloadHidden
-              );
-            }
+            items.push(item);
           });
+          if (items.length === 1 && items[0].type === 'directory') {
+            // A single folder is archived under its own name
+            downloadArchiveRequest(
+              items[0].path,
+              selectedFormat,
+              followSymlinks,
+              downloadHidden,
+              [],
+              excludePatterns
+            );
+          } else if (items.length > 0) {
+            // The selection is streamed in a single archive of the current folder
+            downloadArchiveRequest(
+              widget.model.path,
+              selectedFormat,
+              followSymlinks,
+              downloadHidden,
+              items.map(item => PathExt.basename(item.path)),
+              excludePatterns
+            );
+          }
         }
       },
       icon: args => ('format' in args ? undefined : archiveIcon),
@@ -338,7 +381,9 @@ const extension: JupyterFrontEndPlugin<void> = {
               ? format
               : archiveFormat,
             followSymlinks,
-            downloadHidden
+            downloadHidden,
+            [],
+            excludePatterns
           );
         }
       },